@@ -1,36 +1,247 @@
 """Core dell'agente AI"""
 
 import os
-from typing import Generator, Optional
+import json
+import time
+import random
+from typing import Dict, Generator, Iterator, List, Optional, Tuple
 from config import Config
-from prompts import SYSTEM_PROMPT, CONTINUE_PROMPT
-from executor import CommandParser, CommandExecutor
+from prompts import SYSTEM_PROMPT, SYSTEM_PROMPT_MULTI, CONTINUE_PROMPT, MULTI_CONTINUE_PROMPT, TOOL_MODE_PROMPTS
+from executor import CommandParser, CommandExecutor, StreamParser
+from context import ContextManager
+from session import SessionJournal
+from tracing import Span, Tracer
+from tool_calling import TOOL_MODES, ToolCalls, openai_tools, anthropic_tools, response_schema, render_calls, render_json
 
 class AIProvider:
     """Provider base per i modelli AI"""
     
+    # Utilizzo dell'ultima chiamata, se il backend lo riporta: input_tokens,
+    # cached_tokens (letti dalla cache), evaluated_tokens (calcolati da zero),
+    # cache_write_tokens, output_tokens. None = dato non disponibile
+    last_usage: Optional[dict] = None
+    
     def chat(self, messages: list) -> str:
         raise NotImplementedError
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        """
+        Risposta con i comandi come strumenti nativi (mode="native") o come
+        JSON vincolato da uno schema (mode="json"): comandi costruiti dagli
+        argomenti e testo nel formato a tag per la cronologia
+        """
+        raise NotImplementedError(f"Il provider non supporta la modalità '{mode}'")
+    
+    def chat_n(self, messages: list, n: int) -> List[str]:
+        """N risposte candidate con una sola richiesta (parametro `n` dell'API)"""
+        raise NotImplementedError
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        """Restituisce la risposta un pezzo alla volta (default: tutta insieme)"""
+        yield self.chat(messages)
+    
+    def probe(self) -> Optional[str]:
+        """
+        Verifica che il backend risponda (solleva un'eccezione se non è
+        raggiungibile). Ritorna una breve descrizione, None se non supportato
+        """
+        return None
+    
+    def warmup(self):
+        """Precarica il modello, così la prima richiesta non paga il caricamento"""
+
+
+def _chat_tools_openai_compatible(provider: AIProvider, messages: list, mode: str, multi: bool, **extra) -> ToolCalls:
+    """Strumenti (`tools`) o output JSON (`response_format`) per OpenAI, Groq e LM Studio"""
+    kwargs = {"model": provider.model, "messages": messages, **extra}
+    if mode == "native":
+        kwargs["tools"] = openai_tools()
+        # Sempre una chiamata: anche RESPOND e DONE sono strumenti
+        kwargs["tool_choice"] = "required"
+    else:
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "commands", "schema": response_schema(multi)},
+        }
+    response = provider.client.chat.completions.create(**kwargs)
+    provider.last_usage = _openai_usage(response.usage)
+    message = response.choices[0].message
+    if mode == "native":
+        calls = [(call.function.name, call.function.arguments) for call in message.tool_calls or []]
+        return render_calls(calls, message.content)
+    return render_json(message.content or "")
+
+
+def _probe_openai_compatible(client, model: str) -> str:
+    """Elenco dei modelli come health check (OpenAI, Groq, LM Studio), senza retry"""
+    models = [m.id for m in client.with_options(timeout=5.0, max_retries=0).models.list()]
+    if model in models or not models:
+        return f"{len(models)} modelli disponibili"
+    return f"{len(models)} modelli disponibili, '{model}' non tra questi"
+
+
+def _openai_usage(usage) -> Optional[dict]:
+    """Normalizza l'usage in formato OpenAI (prefix caching automatico)"""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else None
+    return {
+        "input_tokens": usage.prompt_tokens,
+        "cached_tokens": cached,
+        "evaluated_tokens": usage.prompt_tokens - cached if cached is not None else None,
+        "cache_write_tokens": None,
+        "output_tokens": usage.completion_tokens,
+    }
+
+
+def _stream_openai_compatible(stream, provider: AIProvider) -> Iterator[str]:
+    """Estrae i token da uno stream in formato OpenAI (OpenAI, Groq, LM Studio)"""
+    try:
+        for chunk in stream:
+            # Con include_usage l'ultimo chunk non ha choices ma riporta l'usage
+            if getattr(chunk, "usage", None):
+                provider.last_usage = _openai_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Chiudere lo stream interrompe la generazione lato server
+        stream.close()
 
 
 class OllamaProvider(AIProvider):
-    def __init__(self, model: str, base_url: str):
+    def __init__(self, model: str, base_url: str, keep_alive: str = "30m", num_ctx: Optional[int] = None,
+                 pool_size: int = 4, connect_timeout: float = 5.0, read_timeout: float = 300.0,
+                 max_retries: int = 3, retry_backoff: float = 0.5):
+        import requests
+        from requests.adapters import HTTPAdapter
+        
         self.model = model
         self.base_url = base_url
+        # Il modello resta caricato tra un turno e l'altro: la cache KV del
+        # prefisso comune (system prompt + cronologia) viene riutilizzata
+        self.keep_alive = keep_alive
+        # num_ctx costante: cambiarlo forzerebbe il ricaricamento del modello
+        self.num_ctx = num_ctx
+        
+        # Sessione con connessioni keep-alive riutilizzate tra le chiamate
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
     
-    def chat(self, messages: list) -> str:
+    def _retry_delay(self, attempt: int) -> float:
+        """Backoff esponenziale con jitter"""
+        return self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+    
+    def _post(self, payload: dict, stream: bool = False):
+        """POST verso /api/chat con retry su errori 5xx e connessione rifiutata"""
         import requests
         
-        response = requests.post(
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(
+                    f"{self.base_url}/api/chat",
+                    json=payload,
+                    stream=stream,
+                    timeout=self.timeout
+                )
+            except requests.ConnectionError:
+                # Include il timeout di connessione; il timeout di lettura no:
+                # un modello lento non va interrogato di nuovo
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response
+                response.close()
+            
+            time.sleep(self._retry_delay(attempt))
+    
+    def _payload(self, messages: list, stream: bool) -> dict:
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if self.num_ctx:
+            payload["options"] = {"num_ctx": self.num_ctx}
+        return payload
+    
+    def _record_usage(self, data: dict):
+        # prompt_eval_count conta solo i token effettivamente valutati:
+        # quelli del prefisso già in cache KV non vengono ricalcolati
+        self.last_usage = {
+            "input_tokens": None,
+            "cached_tokens": None,
+            "evaluated_tokens": data.get("prompt_eval_count"),
+            "cache_write_tokens": None,
+            "output_tokens": data.get("eval_count"),
+        }
+    
+    def chat(self, messages: list) -> str:
+        self.last_usage = None
+        response = self._post(self._payload(messages, stream=False))
+        data = response.json()
+        self._record_usage(data)
+        return data["message"]["content"]
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        self.last_usage = None
+        payload = self._payload(messages, stream=False)
+        if mode == "native":
+            payload["tools"] = openai_tools()
+        else:
+            # Ollama converte lo schema in una grammatica per il campionamento
+            payload["format"] = response_schema(multi)
+        data = self._post(payload).json()
+        self._record_usage(data)
+        message = data["message"]
+        if mode == "native":
+            calls = [
+                (call["function"]["name"], call["function"].get("arguments") or {})
+                for call in message.get("tool_calls") or []
+            ]
+            return render_calls(calls, message.get("content"))
+        return render_json(message.get("content") or "")
+    
+    def probe(self) -> Optional[str]:
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=(self.timeout[0], 5.0))
+        response.raise_for_status()
+        models = [m.get("name") for m in response.json().get("models", [])]
+        if self.model in models or f"{self.model}:latest" in models:
+            return f"modello {self.model} installato"
+        return f"modello {self.model} non installato ({len(models)} disponibili)"
+    
+    def warmup(self):
+        # Una chat senza messaggi carica il modello con lo stesso keep_alive
+        # e num_ctx delle richieste vere, senza generare token
+        response = self.session.post(
             f"{self.base_url}/api/chat",
-            json={
-                "model": self.model,
-                "messages": messages,
-                "stream": False
-            }
+            json=self._payload([], stream=False),
+            timeout=self.timeout
         )
         response.raise_for_status()
-        return response.json()["message"]["content"]
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        self.last_usage = None
+        with self._post(self._payload(messages, stream=True), stream=True) as response:
+            # Ollama invia un oggetto JSON per riga
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                token = data.get("message", {}).get("content", "")
+                if token:
+                    yield token
+                if data.get("done"):
+                    self._record_usage(data)
+                    break
 
 
 class OpenAIProvider(AIProvider):
@@ -40,20 +251,58 @@ class OpenAIProvider(AIProvider):
         self.model = model
     
     def chat(self, messages: list) -> str:
+        # OpenAI mette in cache automaticamente i prefissi identici: i
+        # messaggi vengono inviati invariati e in ordine stabile
         response = self.client.chat.completions.create(
             model=self.model,
             messages=messages
         )
+        self.last_usage = _openai_usage(response.usage)
         return response.choices[0].message.content
+    
+    def chat_n(self, messages: list, n: int) -> List[str]:
+        # Il prompt viene valutato (e pagato) una volta sola per tutte le scelte
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            n=n
+        )
+        self.last_usage = _openai_usage(response.usage)
+        return [choice.message.content or "" for choice in response.choices]
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        self.last_usage = None
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        yield from _stream_openai_compatible(stream, self)
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        return _chat_tools_openai_compatible(self, messages, mode, multi)
+    
+    def probe(self) -> Optional[str]:
+        return _probe_openai_compatible(self.client, self.model)
 
 
 class AnthropicProvider(AIProvider):
+    # Breakpoint di cache: tutto il prefisso fino al blocco marcato viene riutilizzato
+    CACHE_CONTROL = {"type": "ephemeral"}
+    
     def __init__(self, api_key: str, model: str):
         from anthropic import Anthropic
         self.client = Anthropic(api_key=api_key)
         self.model = model
     
-    def chat(self, messages: list) -> str:
+    @classmethod
+    def _prepare(cls, messages: list):
+        """
+        Separa il system prompt e imposta i breakpoint di cache: sul system
+        prompt e sugli ultimi due messaggi utente (il penultimo legge la cache
+        scritta al turno precedente, l'ultimo la scrive per il prossimo).
+        """
         # Anthropic usa formato diverso
         system = ""
         chat_messages = []
@@ -64,13 +313,73 @@ class AnthropicProvider(AIProvider):
             else:
                 chat_messages.append(msg)
         
+        system_blocks = [{"type": "text", "text": system, "cache_control": cls.CACHE_CONTROL}]
+        
+        user_indexes = [i for i, msg in enumerate(chat_messages) if msg["role"] == "user"]
+        for i in user_indexes[-2:]:
+            chat_messages[i] = {
+                "role": "user",
+                "content": [{
+                    "type": "text",
+                    "text": chat_messages[i]["content"],
+                    "cache_control": cls.CACHE_CONTROL,
+                }],
+            }
+        
+        return system_blocks, chat_messages
+    
+    def _record_usage(self, usage):
+        cached = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.last_usage = {
+            "input_tokens": usage.input_tokens + cached + written,
+            "cached_tokens": cached,
+            "evaluated_tokens": usage.input_tokens + written,
+            "cache_write_tokens": written,
+            "output_tokens": usage.output_tokens,
+        }
+    
+    def chat(self, messages: list) -> str:
+        system, chat_messages = self._prepare(messages)
+        
         response = self.client.messages.create(
             model=self.model,
             max_tokens=4096,
             system=system,
             messages=chat_messages
         )
+        self._record_usage(response.usage)
         return response.content[0].text
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        # tool_use è già output strutturato: anche la modalità json usa gli strumenti
+        system, chat_messages = self._prepare(messages)
+        
+        response = self.client.messages.create(
+            model=self.model,
+            max_tokens=4096,
+            system=system,
+            messages=chat_messages,
+            tools=anthropic_tools(),
+            tool_choice={"type": "any"}
+        )
+        self._record_usage(response.usage)
+        text = "".join(block.text for block in response.content if block.type == "text")
+        calls = [(block.name, block.input) for block in response.content if block.type == "tool_use"]
+        return render_calls(calls, text)
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        system, chat_messages = self._prepare(messages)
+        
+        self.last_usage = None
+        with self.client.messages.stream(
+            model=self.model,
+            max_tokens=4096,
+            system=system,
+            messages=chat_messages
+        ) as stream:
+            yield from stream.text_stream
+            self._record_usage(stream.get_final_message().usage)
 
 
 class GroqProvider(AIProvider):
@@ -84,10 +393,29 @@ class GroqProvider(AIProvider):
             model=self.model,
             messages=messages
         )
+        self.last_usage = _openai_usage(response.usage)
         return response.choices[0].message.content
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        self.last_usage = None
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True
+        )
+        yield from _stream_openai_compatible(stream, self)
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        return _chat_tools_openai_compatible(self, messages, mode, multi)
+    
+    def probe(self) -> Optional[str]:
+        return _probe_openai_compatible(self.client, self.model)
 
 # --- CLASSE AGGIUNTA PER LM STUDIO ---
 class LMStudioProvider(AIProvider):
+    # Temperature leggermente ridotta per comandi più precisi
+    temperature = 0.7
+    
     def __init__(self, base_url: str, model: str):
         # LM Studio simula le API di OpenAI
         from openai import OpenAI
@@ -98,104 +426,427 @@ class LMStudioProvider(AIProvider):
         self.model = model
     
     def chat(self, messages: list) -> str:
-        # Temperature leggermente ridotta per comandi più precisi
+        # Il prefisso invariato permette a LM Studio di riusare la cache KV
         response = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
-            temperature=0.7 
+            temperature=self.temperature
         )
+        self.last_usage = _openai_usage(response.usage)
         return response.choices[0].message.content
+    
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        self.last_usage = None
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        yield from _stream_openai_compatible(stream, self)
+    
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        return _chat_tools_openai_compatible(self, messages, mode, multi, temperature=self.temperature)
+    
+    def probe(self) -> Optional[str]:
+        return _probe_openai_compatible(self.client, self.model)
+    
+    def warmup(self):
+        # Un token di completamento fa caricare il modello in LM Studio
+        self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": "ok"}],
+            max_tokens=1
+        )
 # -------------------------------------
 
+
+class StreamToken(str):
+    """Frammento di risposta in streaming (da stampare senza andare a capo)"""
+
 class Agent:
     """Agente AI principale"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.provider = self._create_provider()
-        self.executor = CommandExecutor(config.workspace, config.safe_mode)
-        self.messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        self.provider = self._wrap_provider(self._create_provider())
+        self.executor = CommandExecutor(
+            config.workspace, config.safe_mode, config.max_parallel_tools,
+            config.execute_timeout, config.persistent_shell
+        )
+        if config.tool_mode not in TOOL_MODES:
+            raise ValueError(f"tool_mode sconosciuta: {config.tool_mode} (valide: {', '.join(TOOL_MODES)})")
+        # Torna a "tags" se il provider non supporta l'output strutturato
+        self.tool_mode = config.tool_mode
+        self.system_prompt = SYSTEM_PROMPT_MULTI if config.multi_command else SYSTEM_PROMPT
+        self.system_prompt += TOOL_MODE_PROMPTS.get(self.tool_mode, "")
+        self.messages = [{"role": "system", "content": self.system_prompt}]
+        self.context = ContextManager(
+            config.context_budget, config.context_keep_last, config.context_compact_ratio
+        )
+        self.cache_stats = {"input_tokens": 0, "cached_tokens": 0}
+        # Token riportati dal provider e iterazioni in tutta la sessione
+        self.usage = {"input_tokens": 0, "output_tokens": 0}
+        # Risposte del modello e quante non contenevano comandi validi (iterazioni sprecate)
+        self.parse_stats = {"responses": 0, "failures": 0, "tool_calls": 0, "invalid_tool_calls": 0}
+        self.iterations = 0
+        # Turno -> messaggio con il feedback inviato in quel turno (per ResultCache)
+        self._feedback_turns: Dict[int, dict] = {}
+        self.finished = False  # True quando l'ultimo task è terminato con [DONE]
         self.max_iterations = 20  # Sicurezza anti-loop
+        # Journal su disco della sessione (la directory si crea alla prima scrittura)
+        self.journal = SessionJournal(config.sessions_dir) if config.session_journal else None
+        # Span di chat, parsing ed esecuzione (spento se non c'è né file né riepilogo)
+        self.tracer = Tracer(config.trace_file, keep=config.trace_summary)
+        self.executor.tracer = self.tracer
+        self.executor.dedup_results = config.dedup_results
+        # Più risposte candidate in parallelo contro le risposte malformate (solo formato a tag;
+        # con la cache delle risposte la registrazione resterebbe non deterministica)
+        self.sampler = None
+        if config.speculative_samples > 1 and not config.response_cache_mode:
+            from speculative import SpeculativeSampler
+            self.sampler = SpeculativeSampler(
+                self.provider, self._parse_commands, config.speculative_samples,
+                config.speculative_policy, config.multi_command
+            )
     
-    def _create_provider(self) -> AIProvider:
-        """Crea il provider AI appropriato"""
-        if self.config.provider == "ollama":
-            return OllamaProvider(self.config.model, self.config.ollama_base_url)
-        elif self.config.provider == "openai":
-            if not self.config.openai_api_key:
+    def _create_provider(self, config: Optional[Config] = None) -> AIProvider:
+        """Crea il provider AI appropriato (per `config`, default quella dell'agente)"""
+        config = config or self.config
+        if config.provider == "router":
+            # Più backend con bilanciamento e failover: ognuno creato da questo metodo
+            from router import RouterProvider
+            return RouterProvider.from_config(config, self._create_provider)
+        elif config.provider == "ollama":
+            return OllamaProvider(
+                config.model,
+                config.ollama_base_url,
+                config.ollama_keep_alive,
+                config.ollama_num_ctx,
+                pool_size=config.ollama_pool_size,
+                connect_timeout=config.ollama_connect_timeout,
+                read_timeout=config.ollama_read_timeout,
+                max_retries=config.ollama_max_retries
+            )
+        elif config.provider == "openai":
+            if not config.openai_api_key:
                 raise ValueError("OPENAI_API_KEY non configurata")
-            return OpenAIProvider(self.config.openai_api_key, self.config.model)
-        elif self.config.provider == "anthropic":
-            if not self.config.anthropic_api_key:
+            return OpenAIProvider(config.openai_api_key, config.model)
+        elif config.provider == "anthropic":
+            if not config.anthropic_api_key:
                 raise ValueError("ANTHROPIC_API_KEY non configurata")
-            return AnthropicProvider(self.config.anthropic_api_key, self.config.model)
-        elif self.config.provider == "groq":
-            if not self.config.groq_api_key:
+            return AnthropicProvider(config.anthropic_api_key, config.model)
+        elif config.provider == "groq":
+            if not config.groq_api_key:
                 raise ValueError("GROQ_API_KEY non configurata")
-            return GroqProvider(self.config.groq_api_key, self.config.model)
+            return GroqProvider(config.groq_api_key, config.model)
         
         # --- BLOCCO AGGIUNTO PER LM STUDIO ---
-        elif self.config.provider == "lmstudio":
-             return LMStudioProvider(self.config.lmstudio_base_url, self.config.model)
+        elif config.provider == "lmstudio":
+             return LMStudioProvider(config.lmstudio_base_url, config.model)
         # -------------------------------------
         
         else:
-            raise ValueError(f"Provider sconosciuto: {self.config.provider}")
+            raise ValueError(f"Provider sconosciuto: {config.provider}")
+    
+    def _wrap_provider(self, provider: AIProvider) -> AIProvider:
+        """Applica la cache delle risposte su disco, se abilitata"""
+        if not self.config.response_cache_mode:
+            return provider
+        from response_cache import CachedProvider
+        return CachedProvider(
+            provider,
+            self.config.provider,
+            self.config.response_cache_dir,
+            self.config.response_cache_mode,
+            self.config.response_cache_max_mb
+        )
+    
+    def _cache_report(self, usage: dict) -> str:
+        """Statistiche della cache del prompt per il turno corrente"""
+        if usage["cached_tokens"] is not None and usage["input_tokens"]:
+            self.cache_stats["input_tokens"] += usage["input_tokens"]
+            self.cache_stats["cached_tokens"] += usage["cached_tokens"]
+            total = self.cache_stats
+            return (
+                f"💾 Cache prompt: {usage['cached_tokens']}/{usage['input_tokens']} token "
+                f"(sessione: {total['cached_tokens'] * 100 // max(total['input_tokens'], 1)}% hit)"
+            )
+        if usage["evaluated_tokens"] is not None:
+            # Il backend riporta solo i token ricalcolati (es. Ollama): il resto
+            # del prompt è stato riusato dalla cache KV
+            reused = max(self.context.last_tokens - usage["evaluated_tokens"], 0)
+            return f"💾 Cache prompt: {usage['evaluated_tokens']} token valutati, ~{reused} riusati"
+        return "💾 Cache prompt: statistiche non disponibili"
+    
+    def _stream_response(self, span: Optional[Span] = None) -> Generator[str, None, str]:
+        """
+        Mostra i token in arrivo e si ferma al primo comando completo
+        (in modalità multi-comando legge invece la risposta intera).
+        Se c'è uno span registra il tempo al primo token
+        """
+        yield "\n🤖 AI:"
+        
+        response = ""
+        parser = StreamParser()
+        stream = self.provider.chat_stream(self.messages)
+        try:
+            for token in stream:
+                if span is not None and not response:
+                    span.mark("ttft_ms")
+                response += token
+                
+                if parser.feed(token) and not self.config.multi_command:
+                    # Comando completo: il resto della risposta non serve
+                    yield StreamToken(token[:len(token) - (len(response) - parser.end_position)])
+                    response = response[:parser.end_position]
+                    break
+                
+                yield StreamToken(token)
+        finally:
+            stream.close()
+        
+        yield StreamToken("\n")
+        return response
+    
+    def _tool_response(self) -> Generator[str, None, Tuple[str, list]]:
+        """
+        Risposta con output strutturato: (testo per la cronologia, comandi).
+        Se il provider non la supporta torna ai tag (nessun comando strutturato)
+        """
+        try:
+            calls = self.provider.chat_tools(self.messages, self.tool_mode, self.config.multi_command)
+        except NotImplementedError as e:
+            yield f"⚠️ {e}: uso il formato a tag"
+            self.tool_mode = "tags"
+            self.system_prompt = SYSTEM_PROMPT_MULTI if self.config.multi_command else SYSTEM_PROMPT
+            self.messages[0] = {"role": "system", "content": self.system_prompt}
+            return self.provider.chat(self.messages), []
+        
+        self.parse_stats["tool_calls"] += len(calls.commands)
+        self.parse_stats["invalid_tool_calls"] += calls.invalid
+        if calls.invalid:
+            yield f"⚠️ {calls.invalid} chiamate a strumenti scartate (nome o parametri non validi)"
+        return calls.text, calls.commands
+    
+    def _parse_commands(self, response: str) -> list:
+        """Comandi da eseguire per questa risposta"""
+        if self.config.multi_command:
+            return CommandParser.parse_all(response)
+        parsed = CommandParser.parse(response)
+        return [parsed] if parsed else []
+    
+    def _record_usage(self, usage: dict) -> str:
+        """Somma i token della risposta a quelli della sessione. Ritorna il report della cache"""
+        for key in self.usage:
+            self.usage[key] += usage.get(key) or 0
+        return self._cache_report(usage)
+    
+    def _turn_commands(self, response: str, tool_commands: list) -> list:
+        """Comandi del turno (dagli argomenti strutturati o dal testo) e statistiche di parsing"""
+        with self.tracer.span("parse", response_chars=len(response)) as span:
+            if tool_commands:
+                # Dagli argomenti strutturati: il testo a tag serve solo alla cronologia
+                commands = tool_commands if self.config.multi_command else tool_commands[:1]
+            else:
+                commands = self._parse_commands(response)
+            span.set(commands=len(commands), source="tool" if tool_commands else "text")
+        self.parse_stats["responses"] += 1
+        if not commands:
+            self.parse_stats["failures"] += 1
+        if self.sampler:
+            self.sampler.update(bool(commands))
+        return commands
+    
+    def _reject_response(self, response: str) -> str:
+        """Registra una risposta senza comandi validi e chiede di correggerla"""
+        self.messages.append({"role": "assistant", "content": response})
+        self.messages.append({
+            "role": "user", 
+            "content": "Non ho capito. Usa il formato corretto con le keyword tra parentesi quadre."
+        })
+        if self.journal is not None:
+            self.journal.record_turn(self.messages)
+        return "⚠️ Risposta non valida, nessun comando riconosciuto"
+    
+    def _record_turn(self, response: str, commands: list, results: list) -> Tuple[List[str], bool]:
+        """
+        Aggiorna la conversazione con la risposta e i risultati dei comandi.
+        Ritorna (output da mostrare, is_done)
+        """
+        outputs = []
+        feedbacks = []
+        is_done = False
+        for (command, _), (result, done) in zip(commands, results):
+            if result.error:
+                outputs.append(f"❌ Errore: {result.error}")
+                feedback = f"Errore nell'esecuzione: {result.error}"
+            else:
+                outputs.append(f"{result.output}")
+                feedback = result.output
+            feedbacks.append(f"[{len(feedbacks) + 1}] {command}:\n{feedback}")
+            is_done = is_done or done
+        
+        # Aggiorna la conversazione
+        self.messages.append({"role": "assistant", "content": response})
+        
+        if not is_done:
+            # Continua con il feedback (un unico messaggio per tutti i comandi)
+            if self.config.multi_command:
+                content = MULTI_CONTINUE_PROMPT.format(results="\n\n".join(feedbacks))
+            else:
+                content = CONTINUE_PROMPT.format(result=feedback)
+            self.messages.append({"role": "user", "content": content})
+            self._feedback_turns[self.executor.turn] = self.messages[-1]
+            self.executor.file_tools.results.commit()
+        else:
+            # Senza feedback il modello non ha ricevuto i risultati: non si possono citare
+            self.executor.file_tools.results.discard()
+            self.finished = True
+        
+        if self.journal is not None:
+            self.journal.record_turn(self.messages, commands, results)
+        return outputs, is_done
+    
+    def _execute_live(self, command: str, params: dict) -> Generator[str, None, Tuple]:
+        """Esegue un comando e yield le righe di output di EXECUTE man mano"""
+        stream = self.executor.execute_stream(command, params)
+        while True:
+            try:
+                line = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            yield f"│ {line}"
+    
+    def resume(self, session_id: str) -> int:
+        """Riprende una sessione salvata ('last' = la più recente). Ritorna i messaggi caricati"""
+        self.journal, messages = SessionJournal.open(self.config.sessions_dir, session_id)
+        if messages:
+            # Il prompt di sistema segue la configurazione attuale (es. --multi)
+            messages[0] = {"role": "system", "content": self.system_prompt}
+            self.messages = messages
+            self._feedback_turns.clear()
+            self.executor.file_tools.results.clear()
+        return len(self.messages)
     
     def run(self, user_input: str) -> Generator[str, None, None]:
         """Esegue un task e yield i risultati intermedi"""
         
         self.messages.append({"role": "user", "content": user_input})
-        
+        self.finished = False
+        self.tracer.begin_task()
+        try:
+            yield from self._run_loop()
+            if self.config.trace_summary:
+                yield self.tracer.summary()
+        finally:
+            # Anche se interrotto (Ctrl+C, errore del provider) il journal resta allineato
+            if self.journal is not None:
+                self.journal.sync(self.messages)
+    
+    def _begin_turn(self) -> int:
+        """Compatta la cronologia entro il budget del provider e apre un nuovo turno. Ritorna i token da inviare"""
+        compactions = self.context.compactions
+        tokens = self.context.prepare(self.messages)
+        if self.context.compactions != compactions:
+            # Un feedback omesso o riassunto non è più nella conversazione: i risultati
+            # inviati in quel turno non si possono più citare
+            live = {id(m) for m in self.messages}
+            dropped = {turn for turn, msg in self._feedback_turns.items() if id(msg) not in live}
+            for turn in dropped:
+                del self._feedback_turns[turn]
+            self.executor.file_tools.results.forget(dropped)
+        self.iterations += 1
+        self.executor.turn = self.iterations
+        # Risultati di un turno interrotto prima del feedback
+        self.executor.file_tools.results.discard()
+        return tokens
+    
+    def _over_budget_warning(self, tokens: int) -> str:
+        return (
+            f"⚠️ Contesto oltre il budget anche dopo la compattazione ({tokens}/{self.context.budget} token): "
+            f"gli ultimi {self.context.keep_last} scambi da soli non ci stanno"
+        )
+    
+    def _run_loop(self) -> Generator[str, None, None]:
         for iteration in range(self.max_iterations):
+            tokens = self._begin_turn()
+            self.tracer.iteration = iteration + 1
+            yield f"📊 Contesto: {tokens}/{self.context.budget} token"
+            if tokens > self.context.budget:
+                yield self._over_budget_warning(tokens)
+            
             # Ottieni risposta dall'AI
             try:
-                response = self.provider.chat(self.messages)
+                with self.tracer.span(
+                    "chat",
+                    provider=self.config.provider,
+                    messages=len(self.messages),
+                    prompt_chars=sum(len(m["content"]) for m in self.messages),
+                    context_tokens=tokens
+                ) as span:
+                    samples = self.sampler.next_samples() if self.sampler and self.tool_mode == "tags" else 1
+                    streamed = self.config.stream and self.tool_mode == "tags" and samples == 1
+                    usage = None
+                    tool_commands = []
+                    if samples > 1:
+                        sample = self.sampler.sample(self.messages, samples)
+                        response, usage = sample.response, sample.usage
+                        span.set(candidates=sample.candidates, malformed=sample.malformed,
+                                 cancelled=sample.cancelled, saved_ms=round(sample.saved_s * 1000, 1))
+                        yield sample.report()
+                    elif self.tool_mode != "tags":
+                        response, tool_commands = yield from self._tool_response()
+                    elif streamed:
+                        response = yield from self._stream_response(span)
+                    else:
+                        response = self.provider.chat(self.messages)
+                    if samples == 1:
+                        usage = self.provider.last_usage
+                    span.set(response_chars=len(response), tool_mode=self.tool_mode, **(usage or {}))
+                if not streamed:
+                    yield f"\n🤖 AI:\n{response}\n"
             except Exception as e:
                 yield f"❌ Errore comunicazione AI: {e}"
                 return
             
-            yield f"\n🤖 AI:\n{response}\n"
+            if usage:
+                yield self._record_usage(usage)
             
-            # Parsa il comando
-            parsed = CommandParser.parse(response)
-            
-            if not parsed:
-                yield "⚠️ Risposta non valida, nessun comando riconosciuto"
-                self.messages.append({"role": "assistant", "content": response})
-                self.messages.append({
-                    "role": "user", 
-                    "content": "Non ho capito. Usa il formato corretto con le keyword tra parentesi quadre."
-                })
+            commands = self._turn_commands(response, tool_commands)
+            if not commands:
+                yield self._reject_response(response)
                 continue
             
-            command, params = parsed
-            yield f"⚙️ Comando: {command}"
-            
-            # Esegui il comando
-            result, is_done = self.executor.execute(command, params)
+            for command, _ in commands:
+                yield f"⚙️ Comando: {command}"
             
-            if result.error:
-                yield f"❌ Errore: {result.error}"
-                feedback = f"Errore nell'esecuzione: {result.error}"
+            # Esegui i comandi (l'output di EXECUTE arriva riga per riga)
+            if len(commands) == 1:
+                results = [(yield from self._execute_live(*commands[0]))]
             else:
-                yield f"{result.output}"
-                feedback = result.output
+                results = self.executor.execute_batch(commands)
             
-            # Aggiorna la conversazione
-            self.messages.append({"role": "assistant", "content": response})
+            outputs, is_done = self._record_turn(response, commands, results)
+            yield from outputs
             
             if is_done:
                 return
-            
-            # Continua con il feedback
-            self.messages.append({
-                "role": "user",
-                "content": CONTINUE_PROMPT.format(result=feedback)
-            })
         
         yield "⚠️ Raggiunto limite massimo iterazioni"
     
+    def close(self):
+        """Chiude la shell persistente, i job in background e il file di trace"""
+        try:
+            self.executor.system_tools.close()
+        finally:
+            self.tracer.close()
+    
     def reset(self):
-        """Resetta la conversazione"""
-        self.messages = [{"role": "system", "content": SYSTEM_PROMPT}]
\ No newline at end of file
+        """Resetta la conversazione (il journal prosegue in una nuova sessione)"""
+        self.messages = [{"role": "system", "content": self.system_prompt}]
+        self._feedback_turns.clear()
+        self.executor.file_tools.results.clear()
+        if self.journal is not None:
+            self.journal = SessionJournal(self.config.sessions_dir)
\ No newline at end of file
@@ -0,0 +1,307 @@
+"""Versione asincrona dell'agente: più sessioni sullo stesso event loop"""
+
+import asyncio
+from dataclasses import replace
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+from config import Config
+from agent import Agent, OllamaProvider, AnthropicProvider, _openai_usage
+
+
+class AsyncAIProvider:
+    """Provider base asincrono per i modelli AI"""
+
+    last_usage: Optional[dict] = None
+
+    async def chat(self, messages: list) -> str:
+        raise NotImplementedError
+
+    async def aclose(self):
+        """Chiude le connessioni del client"""
+
+
+class AsyncOllamaProvider(AsyncAIProvider):
+    # Stesso payload, backoff e statistiche del provider sincrono
+    _payload = OllamaProvider._payload
+    _record_usage = OllamaProvider._record_usage
+    _retry_delay = OllamaProvider._retry_delay
+
+    def __init__(self, model: str, base_url: str, keep_alive: str = "30m", num_ctx: Optional[int] = None,
+                 pool_size: int = 4, connect_timeout: float = 5.0, read_timeout: float = 300.0,
+                 max_retries: int = 3, retry_backoff: float = 0.5):
+        import httpx
+        self.model = model
+        self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+    async def _post(self, payload: dict):
+        """POST verso /api/chat con retry su errori 5xx e connessione rifiutata"""
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.post("/api/chat", json=payload)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response
+
+            await asyncio.sleep(self._retry_delay(attempt))
+
+    async def chat(self, messages: list) -> str:
+        self.last_usage = None
+        response = await self._post(self._payload(messages, stream=False))
+        data = response.json()
+        self._record_usage(data)
+        return data["message"]["content"]
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class _AsyncOpenAICompatible(AsyncAIProvider):
+    """Client asincroni con API in formato OpenAI (OpenAI, Groq, LM Studio)"""
+
+    temperature: Optional[float] = None
+
+    async def chat(self, messages: list) -> str:
+        kwargs = {"model": self.model, "messages": messages}
+        if self.temperature is not None:
+            kwargs["temperature"] = self.temperature
+
+        response = await self.client.chat.completions.create(**kwargs)
+        self.last_usage = _openai_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class AsyncOpenAIProvider(_AsyncOpenAICompatible):
+    def __init__(self, api_key: str, model: str):
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(api_key=api_key)
+        self.model = model
+
+
+class AsyncGroqProvider(_AsyncOpenAICompatible):
+    def __init__(self, api_key: str, model: str):
+        from groq import AsyncGroq
+        self.client = AsyncGroq(api_key=api_key)
+        self.model = model
+
+
+class AsyncLMStudioProvider(_AsyncOpenAICompatible):
+    temperature = 0.7
+
+    def __init__(self, base_url: str, model: str):
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(base_url=base_url, api_key="lm-studio")
+        self.model = model
+
+
+class AsyncAnthropicProvider(AsyncAIProvider):
+    _record_usage = AnthropicProvider._record_usage
+
+    def __init__(self, api_key: str, model: str):
+        from anthropic import AsyncAnthropic
+        self.client = AsyncAnthropic(api_key=api_key)
+        self.model = model
+
+    async def chat(self, messages: list) -> str:
+        system, chat_messages = AnthropicProvider._prepare(messages)
+
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=4096,
+            system=system,
+            messages=chat_messages
+        )
+        self._record_usage(response.usage)
+        return response.content[0].text
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class AsyncAgent(Agent):
+    """
+    Agente con provider asincrono: le chiamate al modello non bloccano
+    l'event loop e i tool girano nel thread pool del loop.
+    """
+
+    def __init__(self, config: Config, semaphore: Optional[asyncio.Semaphore] = None):
+        # I provider asincroni non hanno chat_tools: solo il formato a tag
+        super().__init__(replace(config, tool_mode="tags"))
+        # Limite di richieste contemporanee verso lo stesso backend
+        self.semaphore = semaphore
+
+    def _wrap_provider(self, provider: AsyncAIProvider) -> AsyncAIProvider:
+        # La cache delle risposte su disco è disponibile solo per l'agente sincrono
+        return provider
+
+    def _create_provider(self) -> AsyncAIProvider:
+        """Crea il provider AI asincrono appropriato"""
+        if self.config.provider == "ollama":
+            return AsyncOllamaProvider(
+                self.config.model,
+                self.config.ollama_base_url,
+                self.config.ollama_keep_alive,
+                self.config.ollama_num_ctx,
+                pool_size=self.config.ollama_pool_size,
+                connect_timeout=self.config.ollama_connect_timeout,
+                read_timeout=self.config.ollama_read_timeout,
+                max_retries=self.config.ollama_max_retries
+            )
+        elif self.config.provider == "openai":
+            if not self.config.openai_api_key:
+                raise ValueError("OPENAI_API_KEY non configurata")
+            return AsyncOpenAIProvider(self.config.openai_api_key, self.config.model)
+        elif self.config.provider == "anthropic":
+            if not self.config.anthropic_api_key:
+                raise ValueError("ANTHROPIC_API_KEY non configurata")
+            return AsyncAnthropicProvider(self.config.anthropic_api_key, self.config.model)
+        elif self.config.provider == "groq":
+            if not self.config.groq_api_key:
+                raise ValueError("GROQ_API_KEY non configurata")
+            return AsyncGroqProvider(self.config.groq_api_key, self.config.model)
+        elif self.config.provider == "lmstudio":
+            return AsyncLMStudioProvider(self.config.lmstudio_base_url, self.config.model)
+        else:
+            raise ValueError(f"Provider sconosciuto: {self.config.provider}")
+
+    async def _chat(self) -> str:
+        if self.semaphore is None:
+            return await self.provider.chat(self.messages)
+        async with self.semaphore:
+            return await self.provider.chat(self.messages)
+
+    async def run(self, user_input: str) -> AsyncGenerator[str, None]:
+        """Esegue un task e yield i risultati intermedi"""
+        self.messages.append({"role": "user", "content": user_input})
+        self.finished = False
+        self.tracer.begin_task()
+        try:
+            async for output in self._run_loop():
+                yield output
+            if self.config.trace_summary:
+                yield self.tracer.summary()
+        finally:
+            if self.journal is not None:
+                self.journal.sync(self.messages)
+
+    async def _run_loop(self) -> AsyncGenerator[str, None]:
+        """Come Agent._run_loop, con la chiamata al provider asincrona e i tool nel thread pool"""
+        loop = asyncio.get_running_loop()
+        for iteration in range(self.max_iterations):
+            tokens = self._begin_turn()
+            self.tracer.iteration = iteration + 1
+            yield f"📊 Contesto: {tokens}/{self.context.budget} token"
+            if tokens > self.context.budget:
+                yield self._over_budget_warning(tokens)
+
+            try:
+                with self.tracer.span("chat", provider=self.config.provider, messages=len(self.messages),
+                                      context_tokens=tokens) as span:
+                    response = await self._chat()
+                    usage = self.provider.last_usage
+                    span.set(response_chars=len(response), **(usage or {}))
+            except Exception as e:
+                yield f"❌ Errore comunicazione AI: {e}"
+                return
+
+            yield f"\n🤖 AI:\n{response}\n"
+            if usage:
+                yield self._record_usage(usage)
+
+            commands = self._turn_commands(response, [])
+            if not commands:
+                yield self._reject_response(response)
+                continue
+
+            for command, _ in commands:
+                yield f"⚙️ Comando: {command}"
+
+            # I tool sono bloccanti (filesystem, subprocess): girano nel thread pool
+            if len(commands) == 1:
+                results = [await loop.run_in_executor(None, self.executor.execute, *commands[0])]
+            else:
+                results = await loop.run_in_executor(None, self.executor.execute_batch, commands)
+
+            outputs, is_done = self._record_turn(response, commands, results)
+            for output in outputs:
+                yield output
+
+            if is_done:
+                return
+
+        yield "⚠️ Raggiunto limite massimo iterazioni"
+
+    async def aclose(self):
+        """Chiude il client del provider, la shell persistente, i job e il file di trace della sessione"""
+        try:
+            await self.provider.aclose()
+        finally:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.close)
+
+
+class SessionRunner:
+    """
+    Esegue molte sessioni AsyncAgent sullo stesso event loop, con un limite
+    globale di richieste contemporanee per ciascun backend.
+    """
+
+    def __init__(self, max_per_backend: int = 4):
+        self.max_per_backend = max_per_backend
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @staticmethod
+    def backend_key(config: Config) -> str:
+        """Identifica il backend: i provider locali per URL, quelli cloud per nome"""
+        if config.provider == "ollama":
+            return f"ollama:{config.ollama_base_url}"
+        if config.provider == "lmstudio":
+            return f"lmstudio:{config.lmstudio_base_url}"
+        return config.provider
+
+    def _semaphore(self, config: Config) -> asyncio.Semaphore:
+        # Creati dentro il loop in esecuzione (richiesto da Python < 3.10)
+        key = self.backend_key(config)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.max_per_backend)
+        return self._semaphores[key]
+
+    async def run_session(self, config: Config, task: str) -> dict:
+        """Esegue un task in una nuova sessione e ne raccoglie l'output"""
+        agent = AsyncAgent(config, self._semaphore(config))
+        # Nessuno risponde alle conferme: input() da un thread del pool bloccherebbe le altre sessioni
+        agent.executor.interactive = False
+        outputs = []
+        try:
+            async for output in agent.run(task):
+                outputs.append(output)
+        finally:
+            await agent.aclose()
+        return {"task": task, "backend": self.backend_key(config), "outputs": outputs}
+
+    async def run_all(self, sessions: List[Tuple[Config, str]]) -> List[dict]:
+        """Esegue tutte le sessioni in parallelo (risultati nell'ordine di input)"""
+        return await asyncio.gather(
+            *(self.run_session(config, task) for config, task in sessions),
+            return_exceptions=True
+        )
+
+    def run(self, sessions: List[Tuple[Config, str]]) -> List[dict]:
+        """Punto di ingresso sincrono"""
+        return asyncio.run(self.run_all(sessions))
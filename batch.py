@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Modalità batch: esegue molti task senza terminale, ognuno con il proprio
+Agent e una copia isolata della workspace, e scrive i risultati in JSONL.
+
+    python batch.py tasks.jsonl -o results.jsonl --parallel ollama=2,openai=8
+    cat tasks.jsonl | python batch.py - -o results.jsonl
+
+Ogni riga di input è un oggetto JSON con il testo del task in `task`,
+`prompt` oppure `title` + `body`, e un id opzionale (`id` o `request_id`).
+Rilanciando con lo stesso file di output, i task già completati vengono
+saltati e quelli falliti rieseguiti.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import traceback
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Set, TextIO
+from config import Config
+from agent import Agent
+from async_agent import SessionRunner
+from search_index import SKIP_DIRS
+
+
+def read_tasks(stream: TextIO) -> Iterator[dict]:
+    """Task normalizzati {id, task, provider?, model?} da un file JSONL"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        data = json.loads(line)
+        if "task" in data or "prompt" in data:
+            text = data.get("task") or data.get("prompt")
+        else:
+            text = "\n\n".join(part for part in (data.get("title"), data.get("body")) if part)
+        if not text:
+            raise ValueError(f"Riga {number}: nessun task (usa 'task', 'prompt' o 'title'/'body')")
+        yield {
+            "id": str(data.get("id") or data.get("request_id") or number),
+            "task": text,
+            "provider": data.get("provider"),
+            "model": data.get("model"),
+        }
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Id dei task già completati con successo in un'esecuzione precedente"""
+    done = set()
+    try:
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get("status") == "ok":
+                    done.add(result["id"])
+    except OSError:
+        pass
+    return done
+
+
+def parse_parallel(value: Optional[str], default: int) -> Dict[str, int]:
+    """'ollama=2,openai=8' -> {'ollama': 2, 'openai': 8}; '4' -> {'*': 4}"""
+    limits = {"*": default}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, count = part.rpartition("=")
+        limits[name if sep else "*"] = int(count)
+    return limits
+
+
+class BatchRunner:
+    """
+    Esegue i task con un pool di thread per ogni backend (provider/URL),
+    dimensionato sul limite di task contemporanei di quel provider: un
+    backend lento non blocca gli altri. I risultati vengono scritti sul
+    file di output appena ciascun task termina.
+    """
+
+    def __init__(self, config: Config, work_dir: str, parallel: Dict[str, int], keep_workspaces: bool = True):
+        self.config = config
+        self.work_dir = os.path.abspath(work_dir)
+        self.parallel = parallel
+        self.keep_workspaces = keep_workspaces
+
+    def _task_config(self, task: dict) -> Config:
+        overrides = {k: task[k] for k in ("provider", "model") if task.get(k)}
+        return replace(self.config, **overrides)
+
+    def _prepare_workspace(self, task_id: str) -> str:
+        """Copia isolata della workspace per il task"""
+        safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in task_id)
+        target = os.path.join(self.work_dir, safe_id)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        if os.path.isdir(self.config.workspace):
+            shutil.copytree(self.config.workspace, target, symlinks=True,
+                            ignore=shutil.ignore_patterns(*SKIP_DIRS))
+        else:
+            os.makedirs(target)
+        return target
+
+    def run_task(self, task: dict) -> dict:
+        """Esegue un task e ritorna il record di risultato"""
+        config = self._task_config(task)
+        result = {"id": task["id"], "provider": config.provider, "model": config.model}
+        started = time.perf_counter()
+        agent = None
+        try:
+            workspace = self._prepare_workspace(task["id"])
+            result["workspace"] = workspace
+            agent = Agent(replace(config, workspace=workspace, session_journal=False))
+            agent.executor.interactive = False
+
+            last_output = ""
+            for output in agent.run(task["task"]):
+                if output.startswith(("✅", "❌", "⚠️")):
+                    last_output = output
+            if agent.finished:
+                result["status"] = "ok"
+            elif last_output.startswith("❌ Errore comunicazione AI"):
+                result["status"] = "error"
+            else:
+                result["status"] = "incomplete"
+            result["summary"] = last_output
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+            result["traceback"] = traceback.format_exc(limit=5)
+        finally:
+            result["elapsed"] = round(time.perf_counter() - started, 3)
+            if agent is not None:
+                result["iterations"] = agent.iterations
+                result["usage"] = dict(agent.usage, context_tokens=agent.context.total_tokens)
+                result["parse"] = dict(agent.parse_stats)
+                if agent.sampler:
+                    result["speculative"] = dict(agent.sampler.stats)
+                agent.close()
+            if not self.keep_workspaces and "workspace" in result:
+                shutil.rmtree(result["workspace"], ignore_errors=True)
+        return result
+
+    def run(self, tasks: List[dict], output: TextIO) -> Dict[str, int]:
+        """Esegue tutti i task e scrive i risultati man mano. Ritorna i conteggi per stato"""
+        pools: Dict[str, ThreadPoolExecutor] = {}
+        futures = []
+        for task in tasks:
+            config = self._task_config(task)
+            # Stessa chiave di backend usata dalle sessioni asyncio
+            key = SessionRunner.backend_key(config)
+            if key not in pools:
+                limit = self.parallel.get(config.provider, self.parallel["*"])
+                pools[key] = ThreadPoolExecutor(max_workers=max(1, limit), thread_name_prefix=key)
+            futures.append(pools[key].submit(self.run_task, task))
+
+        counts: Dict[str, int] = {}
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                print(f"[{result['status']}] {result['id']} ({result['elapsed']}s, "
+                      f"{result.get('iterations', 0)} iterazioni)", file=sys.stderr)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Agent batch runner")
+    parser.add_argument("tasks", help="JSONL file with tasks, or '-' for stdin")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL results file (appended)")
+    parser.add_argument("--provider", type=str, help="AI Provider (ollama, openai, lmstudio, etc)")
+    parser.add_argument("--model", type=str, help="Model name")
+    parser.add_argument("--tool-mode", choices=["tags", "native", "json"], help="How the model sends commands")
+    parser.add_argument("--samples", type=int, help="Candidate replies sampled in parallel (tags mode)")
+    parser.add_argument("--sample-policy", choices=["always", "on_failure"], help="When to sample candidates")
+    parser.add_argument("--parallel", type=str,
+                        help="Concurrent tasks per provider, e.g. 'ollama=2,openai=8' or '4'")
+    parser.add_argument("--work-dir", default="./.agent_batch", help="Where task workspaces are copied")
+    parser.add_argument("--cleanup", action="store_true", help="Delete task workspaces when done")
+    parser.add_argument("--rerun", action="store_true", help="Also rerun tasks already completed")
+    args = parser.parse_args()
+
+    config = Config()
+    if args.provider:
+        config.provider = args.provider
+    if args.model:
+        config.model = args.model
+    if args.tool_mode:
+        config.tool_mode = args.tool_mode
+    if args.samples:
+        config.speculative_samples = args.samples
+    if args.sample_policy:
+        config.speculative_policy = args.sample_policy
+
+    if args.tasks == "-":
+        tasks = list(read_tasks(sys.stdin))
+    else:
+        with open(args.tasks, "r", encoding="utf-8") as f:
+            tasks = list(read_tasks(f))
+
+    if not args.rerun:
+        done = completed_ids(args.output)
+        skipped = sum(1 for task in tasks if task["id"] in done)
+        tasks = [task for task in tasks if task["id"] not in done]
+        if skipped:
+            print(f"⏭️  {skipped} task già completati, saltati", file=sys.stderr)
+
+    runner = BatchRunner(
+        config, args.work_dir,
+        parse_parallel(args.parallel, 4),
+        keep_workspaces=not args.cleanup
+    )
+    with open(args.output, "a", encoding="utf-8") as output:
+        counts = runner.run(tasks, output)
+
+    print("📊 " + ", ".join(f"{status}: {count}" for status, count in sorted(counts.items())), file=sys.stderr)
+    sys.exit(0 if set(counts) <= {"ok"} else 1)
+
+
+if __name__ == "__main__":
+    main()
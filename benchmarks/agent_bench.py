@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Suite di benchmark dell'agente, interamente offline.
+
+  - loop:   Agent.run end-to-end contro il server finto (Ollama e/o API
+            OpenAI via LM Studio), in iterazioni al secondo
+  - parser: throughput del parser su payload grandi (vedi parser_bench.py)
+  - tools:  latenza di TREE, LIST_DIR, SEARCH e READ_FILE su una workspace
+            sintetica di --files file (10k-1M)
+  - startup: Agent pronto, health check, modello precaricato e primo
+            token del primo task, con caricamento del modello simulato
+  - memory: crescita di Agent.messages e della memoria allocata in una
+            sessione lunga (--memory-iterations iterazioni)
+
+I risultati sono metriche {valore, unità, direzione}: con --output si
+salvano in JSON, con --baseline si confrontano con un'esecuzione
+precedente e l'exit code è 1 se una metrica peggiora oltre --tolerance.
+
+    python benchmarks/agent_bench.py --output bench.json
+    python benchmarks/agent_bench.py loop tools --files 100000 --baseline bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from config import Config
+from agent import Agent
+from tools import FileTools
+from startup import AgentLoader
+from mock_server import MockLLMServer
+from parser_bench import bench_size
+
+BENCHMARKS = ("loop", "parser", "tools", "startup", "memory")
+# SDK richiesto da ciascun provider raggiungibile dal server finto
+PROVIDER_MODULES = {"ollama": "requests", "lmstudio": "openai", "openai": "openai"}
+
+# Un task tipico: esplorazione, lettura, modifica, comando, ricerca, fine
+LOOP_SCRIPT = [
+    "Guardo la struttura.\n[TREE]\npath: .\ndepth: 2\n[/TREE]",
+    "[LIST_DIR]\npath: src\n[/LIST_DIR]",
+    "[READ_FILE]\npath: src/module_0.py\n[/READ_FILE]",
+    "[SEARCH]\npattern: def compute\npath: src\nmode: content\n[/SEARCH]",
+    "[CREATE_FILE]\npath: out/result.py\ncontent:\n" + "value = compute(1)\n" * 40 + "[/CREATE_FILE]",
+    "[EDIT_FILE]\npath: out/result.py\nold_content:\nvalue = compute(1)\nvalue = compute(1)\n"
+    "new_content:\nvalue = compute(2)\nvalue = compute(1)\n[/EDIT_FILE]",
+    "[EXECUTE]\ncommand: echo ok\n[/EXECUTE]",
+    "[READ_FILE]\npath: out/result.py\nhead: 5\n[/READ_FILE]",
+    "[DONE]\nsummary: fatto\n[/DONE]",
+]
+
+
+def metric(value: float, unit: str, better: str, noise: float = 0.0) -> dict:
+    """better: 'higher' o 'lower'; variazioni assolute entro `noise` non sono regressioni"""
+    return {"value": round(value, 4), "unit": unit, "better": better, "noise": noise}
+
+
+def missing_module(name: str) -> Optional[str]:
+    try:
+        __import__(name)
+        return None
+    except ImportError:
+        return name
+
+
+@contextmanager
+def temp_dir(prefix: str) -> Iterator[str]:
+    path = tempfile.mkdtemp(prefix=prefix)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def make_project(root: str, files: int = 20):
+    """Piccolo progetto per il benchmark del loop"""
+    os.makedirs(os.path.join(root, "src"), exist_ok=True)
+    body = "".join(f"def compute_{i}(x):\n    return x * {i}\n\n" for i in range(40))
+    for i in range(files):
+        with open(os.path.join(root, "src", f"module_{i}.py"), "w", encoding="utf-8") as f:
+            f.write(f"# modulo {i}\n{body}")
+
+
+def mock_config(provider: str, server: MockLLMServer, workspace: str, stream: bool) -> Config:
+    """Config che punta al server finto, senza journal né cache"""
+    if provider == "openai":
+        # Il client OpenAI legge base URL e chiave dall'ambiente
+        os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+        os.environ["OPENAI_API_KEY"] = "mock"
+    return Config(
+        provider=provider,
+        model="mock",
+        workspace=workspace,
+        ollama_base_url=server.url,
+        lmstudio_base_url=server.url + "/v1",
+        stream=stream,
+        session_journal=False,
+    )
+
+
+# --- loop ---
+
+def bench_loop(providers: List[str], iterations: int, stream: bool) -> Dict[str, dict]:
+    results = {}
+    for provider in providers:
+        missing = missing_module(PROVIDER_MODULES[provider])
+        if missing:
+            print(f"⏭️  loop/{provider}: modulo '{missing}' non installato", file=sys.stderr)
+            continue
+
+        with temp_dir("bench-loop-") as workspace, MockLLMServer(LOOP_SCRIPT) as server:
+            make_project(workspace)
+            agent = Agent(mock_config(provider, server, workspace, stream))
+            try:
+                done = 0
+                tasks = 0
+                started = time.perf_counter()
+                while done < iterations:
+                    for _ in agent.run("Analizza il progetto e crea out/result.py"):
+                        pass
+                    done = agent.iterations
+                    tasks += 1
+                    agent.reset()
+                elapsed = time.perf_counter() - started
+            finally:
+                agent.executor.system_tools.close()
+
+        results[f"loop.{provider}.iterations_per_s"] = metric(done / elapsed, "it/s", "higher")
+        results[f"loop.{provider}.ms_per_iteration"] = metric(elapsed * 1000 / done, "ms", "lower")
+        results[f"loop.{provider}.ms_per_task"] = metric(elapsed * 1000 / tasks, "ms", "lower")
+    return results
+
+
+# --- parser ---
+
+def bench_parser(sizes: List[int], chunk: int, repeat: int) -> Dict[str, dict]:
+    results = {}
+    for size in sizes:
+        r = bench_size(size, chunk, repeat)
+        results[f"parser.{size}kb.full_us_per_kb"] = metric(r["full_us_per_kb"], "µs/KB", "lower")
+        results[f"parser.{size}kb.stream_us_per_kb"] = metric(r["stream_us_per_kb"], "µs/KB", "lower")
+    return results
+
+
+# --- tools ---
+
+def make_workspace(root: str, files: int, per_dir: int = 200):
+    """
+    Workspace sintetica di `files` file in directory da `per_dir`, su due
+    livelli. Un marker permette di riusarla tra un'esecuzione e l'altra.
+    """
+    marker = os.path.join(root, ".bench_files")
+    try:
+        with open(marker) as f:
+            if int(f.read()) == files:
+                return
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(root, ignore_errors=True)
+
+    line = "    total = compute_value(items[index], factor=2) + offset\n"
+    dirs = (files + per_dir - 1) // per_dir
+    for d in range(dirs):
+        directory = os.path.join(root, f"pkg_{d // 100:03d}", f"mod_{d % 100:02d}")
+        os.makedirs(directory, exist_ok=True)
+        for i in range(d * per_dir, min((d + 1) * per_dir, files)):
+            # Un file su mille contiene la stringa cercata
+            needle = "def needle_function():\n" if i % 1000 == 0 else ""
+            with open(os.path.join(directory, f"file_{i}.py"), "w", encoding="utf-8") as f:
+                f.write(f"# file {i}\n{needle}{line * 20}")
+    with open(os.path.join(root, "big.log"), "w", encoding="utf-8") as f:
+        for i in range(200000):
+            f.write(f"{i:07d} INFO request served in {i % 97} ms\n")
+    with open(marker, "w") as f:
+        f.write(str(files))
+
+
+def timed(func: Callable[[], object], repeat: int) -> float:
+    """Millisecondi della ripetizione più veloce"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+        if getattr(result, "success", True) is False:
+            raise RuntimeError(result.error)
+    return best * 1000
+
+
+def bench_tools(files: int, repeat: int, data_dir: Optional[str]) -> Dict[str, dict]:
+    root = os.path.join(data_dir or tempfile.gettempdir(), f"agent-bench-{files}")
+    started = time.perf_counter()
+    make_workspace(root, files)
+    print(f"📂 Workspace sintetica: {files} file in {root} ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    tools = FileTools(root, safe_mode=True)
+    results = {}
+    prefix = f"tools.{files}"
+
+    # Prima chiamata (cache e indice da costruire) e chiamate successive
+    results[f"{prefix}.search_content_cold_ms"] = metric(
+        timed(lambda: tools.search("needle_function", ".", "content"), 1), "ms", "lower")
+    results[f"{prefix}.search_content_ms"] = metric(
+        timed(lambda: tools.search("needle_function", ".", "content"), repeat), "ms", "lower")
+    results[f"{prefix}.tree_cold_ms"] = metric(timed(lambda: tools.tree(".", 3), 1), "ms", "lower")
+    results[f"{prefix}.tree_ms"] = metric(timed(lambda: tools.tree(".", 3), repeat), "ms", "lower")
+    results[f"{prefix}.list_dir_ms"] = metric(
+        timed(lambda: tools.list_dir("pkg_000/mod_00"), repeat), "ms", "lower")
+    results[f"{prefix}.search_name_ms"] = metric(
+        timed(lambda: tools.search(r"file_99\d\.py$", ".", "name"), repeat), "ms", "lower")
+    results[f"{prefix}.read_file_tail_ms"] = metric(
+        timed(lambda: tools.read_file("big.log", tail=50), repeat), "ms", "lower")
+    results[f"{prefix}.read_file_grep_ms"] = metric(
+        timed(lambda: tools.read_file("big.log", grep="served in 96 ms"), repeat), "ms", "lower")
+    return results
+
+
+# --- startup ---
+
+def bench_startup(providers: List[str], load_delay: float) -> Dict[str, dict]:
+    """
+    Avvio come in main.py: il loader lavora in background mentre "l'utente"
+    scrive il primo task (simulato con un'attesa pari a metà del caricamento)
+    """
+    results = {}
+    for provider in providers:
+        missing = missing_module(PROVIDER_MODULES[provider])
+        if missing:
+            print(f"⏭️  startup/{provider}: modulo '{missing}' non installato", file=sys.stderr)
+            continue
+
+        with temp_dir("bench-startup-") as workspace, \
+                MockLLMServer(["[DONE]\nsummary: ok\n[/DONE]"], load_delay=load_delay) as server:
+            config = mock_config(provider, server, workspace, stream=True)
+            loader = AgentLoader(config).start()
+            agent = loader.get_agent()
+            try:
+                loader.wait_probe()
+                if loader.probe_error is not None:
+                    raise RuntimeError(loader.probe_error)
+                time.sleep(load_delay / 2)
+
+                submitted = time.perf_counter()
+                first_token = None
+                for output in agent.run("Termina subito"):
+                    if first_token is None and output.startswith("[DONE]"):
+                        first_token = time.perf_counter() - submitted
+                loader.wait_warm()
+            finally:
+                agent.executor.system_tools.close()
+
+        prefix = f"startup.{provider}"
+        results[f"{prefix}.agent_s"] = metric(loader.timings["agent_s"], "s", "lower")
+        results[f"{prefix}.probe_s"] = metric(loader.timings["probe_s"], "s", "lower")
+        results[f"{prefix}.warmup_s"] = metric(loader.timings["warmup_s"], "s", "lower")
+        results[f"{prefix}.first_token_s"] = metric(first_token, "s", "lower")
+    return results
+
+
+# --- memory ---
+
+def bench_memory(iterations: int) -> Dict[str, dict]:
+    missing = missing_module(PROVIDER_MODULES["ollama"])
+    if missing:
+        print(f"⏭️  memory: modulo '{missing}' non installato", file=sys.stderr)
+        return {}
+
+    # Letture ripetute che non terminano mai il task
+    script = [
+        "[READ_FILE]\npath: src/module_1.py\n[/READ_FILE]",
+        "[SEARCH]\npattern: compute_3\npath: src\nmode: content\n[/SEARCH]",
+        "[LIST_DIR]\npath: src\n[/LIST_DIR]",
+    ]
+    with temp_dir("bench-memory-") as workspace, MockLLMServer(script) as server:
+        make_project(workspace)
+        agent = Agent(mock_config("ollama", server, workspace, stream=True))
+        agent.max_iterations = iterations
+        samples = []
+        tracemalloc.start()
+        try:
+            for output in agent.run("Sessione lunga"):
+                if output.startswith("📊 Contesto"):
+                    current, _ = tracemalloc.get_traced_memory()
+                    chars = sum(len(m["content"]) for m in agent.messages)
+                    samples.append((current, chars, len(agent.messages)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            agent.executor.system_tools.close()
+
+    # Pendenza (minimi quadrati) sulla seconda metà della sessione: la
+    # compattazione del contesto produce un andamento a dente di sega, e a
+    # regime la crescita dovrebbe essere ~0
+    steady = [current for current, _, _ in samples[len(samples) // 2:]]
+    mean_x = (len(steady) - 1) / 2
+    mean_y = sum(steady) / len(steady)
+    growth = (
+        sum((x - mean_x) * (y - mean_y) for x, y in enumerate(steady))
+        / max(sum((x - mean_x) ** 2 for x in range(len(steady))), 1)
+    )
+    return {
+        "memory.messages_final": metric(samples[-1][2], "msg", "lower"),
+        "memory.messages_chars_final": metric(samples[-1][1], "char", "lower"),
+        "memory.growth_bytes_per_iteration": metric(growth, "B/it", "lower", noise=1024),
+        "memory.peak_mb": metric(peak / 1024 / 1024, "MB", "lower"),
+    }
+
+
+# --- Confronto ---
+
+def compare(metrics: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Stampa le differenze rispetto alla baseline e ritorna le metriche peggiorate"""
+    regressions = []
+    print(f"\n{'metrica':<48}{'baseline':>14}{'attuale':>14}{'delta':>10}")
+    for name, current in metrics.items():
+        old = baseline.get(name)
+        if old is None or not old["value"]:
+            continue
+        delta = (current["value"] - old["value"]) / abs(old["value"]) * 100
+        worse = delta < -tolerance if current["better"] == "higher" else delta > tolerance
+        worse = worse and abs(current["value"] - old["value"]) > current.get("noise", 0)
+        flag = "  ⚠️" if worse else ""
+        print(f"{name:<48}{old['value']:>14.3f}{current['value']:>14.3f}{delta:>+9.1f}%{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the agent (offline)")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--providers", nargs="+", choices=sorted(PROVIDER_MODULES), default=["ollama", "lmstudio"],
+                        help="Mock backends for the loop benchmark")
+    parser.add_argument("--iterations", type=int, default=200, help="Agent iterations for the loop benchmark")
+    parser.add_argument("--no-stream", action="store_true", help="Loop benchmark without token streaming")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 1024], help="Parser payload sizes in KB")
+    parser.add_argument("--chunk", type=int, default=4, help="Characters per streamed parser chunk")
+    parser.add_argument("--files", type=int, default=10000, help="Files in the synthetic workspace")
+    parser.add_argument("--data-dir", type=str, help="Where synthetic workspaces are kept (default: temp dir)")
+    parser.add_argument("--load-delay", type=float, default=1.0,
+                        help="Simulated model load time for the startup benchmark (s)")
+    parser.add_argument("--memory-iterations", type=int, default=300, help="Iterations of the long session")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions (best is kept)")
+    parser.add_argument("--output", type=str, help="Write results as JSON")
+    parser.add_argument("--baseline", type=str, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="Allowed regression in percent")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(sorted(unknown))}")
+    selected = args.benchmarks or BENCHMARKS
+    metrics: Dict[str, dict] = {}
+    if "loop" in selected:
+        metrics.update(bench_loop(args.providers, args.iterations, not args.no_stream))
+    if "parser" in selected:
+        metrics.update(bench_parser(args.sizes, args.chunk, args.repeat))
+    if "tools" in selected:
+        metrics.update(bench_tools(args.files, args.repeat, args.data_dir))
+    if "startup" in selected:
+        metrics.update(bench_startup(args.providers, args.load_delay))
+    if "memory" in selected:
+        metrics.update(bench_memory(args.memory_iterations))
+
+    print(f"{'metrica':<48}{'valore':>14}  unità")
+    for name, m in metrics.items():
+        print(f"{name:<48}{m['value']:>14.3f}  {m['unit']}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": vars(args),
+            },
+            "metrics": metrics,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Metriche confrontabili solo a parità di parametri (es. --files, --iterations)
+        ignored = ("benchmarks", "output", "baseline", "tolerance")
+        old_args = baseline.get("meta", {}).get("args", {})
+        changed = [k for k, v in vars(args).items() if k not in ignored and k in old_args and old_args[k] != v]
+        if changed:
+            print(f"\n⚠️  Parametri diversi dalla baseline: {', '.join(changed)}")
+        regressions = compare(metrics, baseline["metrics"], args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} metriche peggiorate oltre il {args.tolerance}%")
+            sys.exit(1)
+        print("\n✅ Nessuna regressione")
+
+
+if __name__ == "__main__":
+    main()
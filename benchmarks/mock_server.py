@@ -0,0 +1,263 @@
+"""
+Server LLM finto per i benchmark: risponde come Ollama (/api/chat) e come
+le API OpenAI (/v1/chat/completions), in streaming e non, riproducendo
+risposte scritte in anticipo. Gira in un thread dello stesso processo e
+non richiede rete esterna.
+
+Se la richiesta contiene `tools` e la risposta è un JSON
+{"commands": [{"tool": ..., "arguments": {...}}]} (lo stesso formato della
+modalità json), le chiamate vengono restituite come `tool_calls`.
+
+    with MockLLMServer(["[LIST_DIR]\\npath: .\\n[/LIST_DIR]", ...]) as server:
+        config.ollama_base_url = server.url
+        config.lmstudio_base_url = server.url + "/v1"
+"""
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Union
+
+# Risposta fissa oppure funzione dei messaggi ricevuti
+Script = Union[List[str], Callable[[list], str]]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server: "MockLLMServer" = self.server.mock
+        if self.path.rstrip("/").endswith("/api/tags"):
+            data = {"models": [{"name": f"{name}:latest"} for name in server.models]}
+        elif self.path.rstrip("/").endswith("/models"):
+            data = {"object": "list", "data": [
+                {"id": name, "object": "model", "created": 0, "owned_by": "mock"} for name in server.models
+            ]}
+        else:
+            self.send_error(404)
+            return
+        self._send(json.dumps(data).encode(), "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server: "MockLLMServer" = self.server.mock
+        server.load_model()
+        if not request.get("messages") or (request.get("max_tokens") or 2) <= 1:
+            # Precaricamento (chat vuota di Ollama, 1 token di LM Studio): non consuma lo script
+            with server._lock:
+                server.warmups += 1
+            content = "ok" if request.get("messages") else ""
+        else:
+            content = server.next_response(request["messages"])
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+
+        if self.path.rstrip("/").endswith("/api/chat"):
+            self._ollama(request, content, prompt_tokens, completion_tokens)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._openai(request, content, prompt_tokens, completion_tokens)
+        else:
+            self.send_error(404)
+
+    # --- Risposte ---
+
+    @staticmethod
+    def _tool_calls(request: dict, content: str) -> Optional[list]:
+        """Risposta JSON {"commands": [...]} come chiamate native, se la richiesta ha `tools`"""
+        if not request.get("tools"):
+            return None
+        try:
+            commands = json.loads(content)["commands"]
+            return [(c["tool"], c.get("arguments", {})) for c in commands]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def _send(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _pieces(self, content: str):
+        """Il testo a pezzi, con la latenza configurata"""
+        server: "MockLLMServer" = self.server.mock
+        if server.first_token_delay:
+            time.sleep(server.first_token_delay)
+        size = server.chunk_chars
+        for i in range(0, len(content), size):
+            if i and server.token_delay:
+                time.sleep(server.token_delay)
+            yield content[i:i + size]
+
+    def _ollama(self, request: dict, content: str, prompt_tokens: int, completion_tokens: int):
+        model = request.get("model", "mock")
+        usage = {"prompt_eval_count": prompt_tokens, "eval_count": completion_tokens}
+        if not request.get("stream", True):
+            for _ in self._pieces(content):
+                pass
+            message = {"role": "assistant", "content": content}
+            calls = self._tool_calls(request, content)
+            if calls is not None:
+                message = {"role": "assistant", "content": "", "tool_calls": [
+                    {"function": {"name": name, "arguments": arguments}} for name, arguments in calls
+                ]}
+            data = {"model": model, "message": message, "done": True, **usage}
+            self._send(json.dumps(data).encode(), "application/json")
+            return
+
+        self._start_chunked("application/x-ndjson")
+        try:
+            for piece in self._pieces(content):
+                line = {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+                self._chunk(json.dumps(line).encode() + b"\n")
+            done = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True, **usage}
+            self._chunk(json.dumps(done).encode() + b"\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # Il client ha chiuso lo stream appena il comando era completo
+            self.close_connection = True
+
+    def _openai(self, request: dict, content: str, prompt_tokens: int, completion_tokens: int):
+        model = request.get("model", "mock")
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": model}
+        if not request.get("stream"):
+            for _ in self._pieces(content):
+                pass
+            message = {"role": "assistant", "content": content}
+            calls = self._tool_calls(request, content)
+            if calls is not None:
+                message = {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": f"call_{i}", "type": "function",
+                     "function": {"name": name, "arguments": json.dumps(arguments)}}
+                    for i, (name, arguments) in enumerate(calls)
+                ]}
+            choices = [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if calls is not None else "stop",
+            }]
+            # Parametro n: le altre scelte sono le risposte successive dello script
+            server: "MockLLMServer" = self.server.mock
+            for index in range(1, request.get("n") or 1):
+                choices.append({
+                    "index": index,
+                    "message": {"role": "assistant", "content": server.next_response(request["messages"])},
+                    "finish_reason": "stop",
+                })
+            data = dict(base, object="chat.completion", usage=usage, choices=choices)
+            self._send(json.dumps(data).encode(), "application/json")
+            return
+
+        self._start_chunked("text/event-stream")
+        try:
+            for piece in self._pieces(content):
+                chunk = dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "delta": {"content": piece}, "finish_reason": None,
+                }])
+                self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            final = dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "delta": {}, "finish_reason": "stop",
+            }])
+            self._chunk(f"data: {json.dumps(final)}\n\n".encode())
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._chunk(f"data: {json.dumps(dict(base, object='chat.completion.chunk', choices=[], usage=usage))}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Client che chiude la connessione keep-alive o lo stream a metà: normale
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class MockLLMServer:
+    """
+    Server HTTP locale con risposte scritte in anticipo. Con una lista le
+    risposte vengono riprodotte in ciclo; con una funzione la risposta
+    dipende dai messaggi della richiesta.
+    """
+
+    def __init__(self, script: Script, chunk_chars: int = 16, first_token_delay: float = 0.0,
+                 token_delay: float = 0.0, load_delay: float = 0.0, models: List[str] = ("mock",),
+                 host: str = "127.0.0.1", port: int = 0):
+        self.script = script
+        self.chunk_chars = max(1, chunk_chars)
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        # Caricamento del modello simulato, pagato dalla prima richiesta POST
+        self.load_delay = load_delay
+        self.models = list(models)
+        self.requests = 0
+        self.warmups = 0
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def load_model(self):
+        with self._load_lock:
+            if not self._loaded:
+                time.sleep(self.load_delay)
+                self._loaded = True
+
+    def next_response(self, messages: list) -> str:
+        with self._lock:
+            index = self.requests
+            self.requests += 1
+        if callable(self.script):
+            return self.script(messages)
+        return self.script[index % len(self.script)]
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser dei comandi.
+
+Misura il tempo di CommandParser.parse_all (risposta intera) e di
+StreamParser.feed (risposta a pezzi, come in streaming) su CREATE_FILE
+di dimensione crescente. Se il parser è lineare il tempo per KB resta
+costante al crescere della dimensione.
+
+    python benchmarks/parser_bench.py
+    python benchmarks/parser_bench.py --sizes 64 256 1024 --chunk 8 --json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from executor import CommandParser, StreamParser
+
+
+def make_response(size_kb: int) -> str:
+    """Risposta con un CREATE_FILE di circa size_kb KB di codice"""
+    line = "    result = compute_value(items[index], factor=2) + offset  # [x]\n"
+    body = line * (size_kb * 1024 // len(line) + 1)
+    return (
+        "Creo il file richiesto.\n"
+        "[CREATE_FILE]\n"
+        "path: generated/module.py\n"
+        "content:\n"
+        f"{body}"
+        "[/CREATE_FILE]\n"
+    )
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_size(size_kb: int, chunk: int, repeat: int) -> dict:
+    response = make_response(size_kb)
+    
+    def full():
+        assert CommandParser.parse_all(response)
+    
+    def streamed():
+        parser = StreamParser()
+        commands = []
+        for i in range(0, len(response), chunk):
+            commands += parser.feed(response[i:i + chunk])
+        assert commands + parser.close()
+    
+    full_s = best_of(full, repeat)
+    stream_s = best_of(streamed, repeat)
+    return {
+        "size_kb": size_kb,
+        "bytes": len(response),
+        "full_ms": full_s * 1000,
+        "stream_ms": stream_s * 1000,
+        "full_us_per_kb": full_s * 1e6 / size_kb,
+        "stream_us_per_kb": stream_s * 1e6 / size_kb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parser dei comandi")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 64, 256, 1024, 4096],
+                        help="Dimensioni del payload in KB")
+    parser.add_argument("--chunk", type=int, default=4, help="Caratteri per pezzo in streaming")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni (si tiene la migliore)")
+    parser.add_argument("--json", action="store_true", help="Output in formato JSON")
+    args = parser.parse_args()
+    
+    results = [bench_size(size, args.chunk, args.repeat) for size in args.sizes]
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    
+    print(f"{'KB':>8} {'full ms':>10} {'µs/KB':>8} {'stream ms':>10} {'µs/KB':>8}")
+    for r in results:
+        print(f"{r['size_kb']:>8} {r['full_ms']:>10.2f} {r['full_us_per_kb']:>8.2f} "
+              f"{r['stream_ms']:>10.2f} {r['stream_us_per_kb']:>8.2f}")
+    
+    # Rapporto tra costo per KB sul payload più grande e su quello più piccolo:
+    # ~1 indica scalabilità lineare
+    first, last = results[0], results[-1]
+    print(f"\nScalabilità (µs/KB max / µs/KB min): "
+          f"full {last['full_us_per_kb'] / first['full_us_per_kb']:.2f}, "
+          f"stream {last['stream_us_per_kb'] / first['stream_us_per_kb']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
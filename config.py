@@ -17,10 +17,69 @@ class Config:
     
     # Ollama
     ollama_base_url: str = "http://localhost:11434"
+    ollama_keep_alive: str = "30m"  # Tiene il modello (e la cache KV) in memoria
+    ollama_num_ctx: Optional[int] = None  # None = default del modello
+    ollama_pool_size: int = 4  # Connessioni keep-alive nel pool
+    ollama_connect_timeout: float = 5.0
+    ollama_read_timeout: float = 300.0
+    ollama_max_retries: int = 3  # Retry su errori 5xx e connessione rifiutata
 
     # LM Studio (Nuova aggiunta)
     lmstudio_base_url: str = "http://localhost:1234/v1"
     
+    # All'avvio: health check del backend e precaricamento del modello in background
+    prewarm: bool = True
+    
+    # Router (provider "router"): backend {"provider", "base_url"?, "model"?, "fallback"?}
+    router_backends: list = None
+    router_failure_threshold: int = 3  # Errori consecutivi prima di escludere un backend
+    router_cooldown: float = 30.0  # Secondi di esclusione prima di riprovare
+    router_sticky: bool = True  # Ogni sessione resta sul suo backend (cache KV riutilizzata)
+    
+    # Streaming della risposta (i comandi partono appena il tag si chiude)
+    stream: bool = True
+    
+    # Una rilettura invariata (READ_FILE, LIST_DIR, TREE) rimanda al turno in
+    # cui il risultato è già stato inviato invece di ripeterlo per intero
+    dedup_results: bool = True
+    
+    # Campionamento speculativo (solo formato a tag): N risposte candidate in
+    # parallelo, vince la prima con comandi validi. 1 = disattivato
+    speculative_samples: int = 1
+    # "on_failure": N candidati solo dopo una risposta non valida; "always": sempre
+    speculative_policy: str = "on_failure"
+    
+    # Formato dei comandi: tags (testo), native (function calling del provider),
+    # json (output vincolato da uno schema; Ollama, LM Studio, OpenAI)
+    tool_mode: str = "tags"
+    
+    # Più comandi per risposta: letture in parallelo, modifiche in ordine
+    multi_command: bool = False
+    max_parallel_tools: int = 4
+    
+    # Timeout predefinito di EXECUTE in secondi (sovrascrivibile con `timeout:`)
+    execute_timeout: int = 30
+    # Shell bash persistente tra i comandi (cd e variabili restano validi)
+    persistent_shell: bool = True
+    
+    # Contesto: budget di token del prompt per provider (None = valori predefiniti)
+    context_budgets: dict = None
+    context_keep_last: int = 3  # Ultimi scambi mai compattati
+    context_compact_ratio: float = 0.6  # Compatta fino a questa frazione del budget
+    
+    # Cache delle risposte su disco: None (off), readwrite, record, replay
+    response_cache_mode: Optional[str] = None
+    response_cache_dir: str = "./.agent_cache/responses"
+    response_cache_max_mb: int = 200
+    
+    # Journal delle sessioni su disco (ripresa con --resume)
+    session_journal: bool = True
+    sessions_dir: str = "./.agent_sessions"
+    
+    # Tracing: span JSONL di chat/parsing/tool e riepilogo p50/p95 a fine task
+    trace_file: Optional[str] = None
+    trace_summary: bool = False
+    
     # Sicurezza
     safe_mode: bool = True  # Chiede conferma per operazioni pericolose
     allowed_directories: list = None  # None = tutte
@@ -34,8 +93,25 @@ class Config:
         self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         self.groq_api_key = os.getenv("GROQ_API_KEY")
         
+        if self.context_budgets is None:
+            self.context_budgets = {
+                "lmstudio": 8192,
+                "ollama": 8192,
+                "openai": 100000,
+                "anthropic": 150000,
+                "groq": 24000,
+            }
+        
         if self.allowed_directories is None:
             self.allowed_directories = [os.path.abspath(self.workspace)]
         
         # Crea workspace se non esiste
-        os.makedirs(self.workspace, exist_ok=True)
\ No newline at end of file
+        os.makedirs(self.workspace, exist_ok=True)
+    
+    @property
+    def context_budget(self) -> int:
+        """Budget di token per il provider selezionato"""
+        if self.provider == "router" and self.router_backends:
+            # Con il failover la sessione può finire sul backend più piccolo
+            return min(self.context_budgets.get(b["provider"], 8192) for b in self.router_backends)
+        return self.context_budgets.get(self.provider, 8192)
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""Gestione della finestra di contesto dell'agente"""
+
+import hashlib
+from functools import lru_cache
+from typing import List, Optional
+from prompts import CONTINUE_PROMPT, MULTI_CONTINUE_PROMPT
+from executor import CommandParser
+
+# Intestazioni dei messaggi che contengono output dei tool
+FEEDBACK_HEADERS = (
+    CONTINUE_PROMPT.split("{result}")[0],
+    MULTI_CONTINUE_PROMPT.split("{results}")[0],
+)
+
+ELIDED_MARKER = "[Output omesso per limiti di contesto"
+SUMMARY_HEADER = "Riepilogo della conversazione precedente:"
+
+
+def _load_encoder():
+    """Tokenizer tiktoken se installato, altrimenti stima da caratteri"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_encoder = _load_encoder()
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text: str) -> int:
+    """Numero (stimato) di token di un testo"""
+    if _encoder is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    # Stima grossolana: ~4 caratteri per token
+    return len(text) // 4 + 1
+
+
+class ContextManager:
+    """
+    Mantiene Agent.messages entro il budget di token del provider.
+
+    Il prompt di sistema e gli ultimi `keep_last` scambi restano intatti.
+    Se il budget viene superato, gli output dei tool più vecchi vengono
+    sostituiti da uno stub con lunghezza e hash; se non basta, i turni più
+    vecchi vengono riassunti in un unico messaggio. Se anche così la coda
+    protetta non entra nel budget, come ultima risorsa vengono sostituiti
+    da stub anche i suoi output dei tool, tranne l'ultimo.
+
+    La compattazione scende fino a `compact_ratio * budget` e non appena
+    sotto il budget: così il prefisso dei messaggi resta identico per molti
+    turni e la cache dei prompt del provider continua a funzionare.
+    """
+
+    # Token aggiuntivi per messaggio (ruolo, separatori)
+    MESSAGE_OVERHEAD = 4
+    # Righe massime conservate nel riepilogo dei turni compattati
+    MAX_SUMMARY_LINES = 60
+
+    def __init__(self, budget: int, keep_last: int = 3, compact_ratio: float = 0.6):
+        self.budget = budget
+        self.keep_last = keep_last
+        self.compact_ratio = compact_ratio
+        self.last_tokens = 0   # token inviati nell'ultimo turno
+        self.total_tokens = 0  # token inviati in tutta la sessione
+        self.compactions = 0   # volte in cui la cronologia è stata compattata
+
+    def count(self, messages: List[dict]) -> int:
+        """Token totali di una lista di messaggi"""
+        return sum(count_tokens(m["content"]) + self.MESSAGE_OVERHEAD for m in messages)
+
+    def prepare(self, messages: List[dict]) -> int:
+        """Compatta i messaggi se serve e registra i token che verranno inviati"""
+        if self.compact(messages):
+            self.compactions += 1
+        self.last_tokens = self.count(messages)
+        self.total_tokens += self.last_tokens
+        return self.last_tokens
+
+    def compact(self, messages: List[dict]) -> bool:
+        """Compatta i messaggi sul posto. Ritorna True se qualcosa è cambiato"""
+        tokens = self.count(messages)
+        if tokens <= self.budget:
+            return False
+        target = int(self.budget * self.compact_ratio)
+
+        # Zona compattabile: tutto tranne il system prompt e la coda protetta
+        tail_start = max(1, len(messages) - self.keep_last * 2)
+
+        # 1) Output dei tool più vecchi -> stub con hash
+        tokens, changed = self._elide_range(messages, 1, tail_start, tokens, target)
+
+        # 2) Turni più vecchi -> un unico riepilogo (solo se c'è qualcosa di nuovo da riassumere,
+        #    altrimenti messages[1] verrebbe riscritto a ogni turno)
+        if tokens > target and self._summarizable(messages[1:tail_start]):
+            summary = self._summarize(messages[1:tail_start])
+            tail = messages[tail_start:]
+            if tail and tail[0]["role"] == "user":
+                # Mantiene l'alternanza user/assistant richiesta da alcuni provider;
+                # alla compattazione successiva il messaggio unito viene di nuovo separato
+                tail[0] = {"role": "user", "content": f"{summary}\n\n{tail[0]['content']}"}
+                messages[1:] = tail
+                tail_start = 1
+            else:
+                messages[1:] = [{"role": "user", "content": summary}] + tail
+                tail_start = 2
+            tokens = self.count(messages)
+            changed = True
+
+        # 3) Ultima risorsa: output dei tool nella coda protetta, tranne l'ultimo
+        if tokens > target:
+            tokens, elided = self._elide_range(messages, tail_start, len(messages) - 1, tokens, target)
+            changed = changed or elided
+        return changed
+
+    def _elide_range(self, messages: List[dict], start: int, stop: int, tokens: int, target: int):
+        """Sostituisce con stub gli output dei tool in messages[start:stop] finché non si scende a target"""
+        changed = False
+        for i in range(start, stop):
+            if tokens <= target:
+                break
+            msg = messages[i]
+            summary, content = self._split_summary(msg["content"])
+            header = self._feedback_header({"role": msg["role"], "content": content})
+            if header is None or ELIDED_MARKER in content:
+                continue
+
+            stub = self._elide(content, header)
+            if summary is not None:
+                stub = f"{summary}\n\n{stub}"
+            tokens += count_tokens(stub) - count_tokens(msg["content"])
+            messages[i] = {"role": msg["role"], "content": stub}
+            changed = True
+        return tokens, changed
+
+    @classmethod
+    def _summarizable(cls, messages: List[dict]) -> bool:
+        """False se la zona è solo il riepilogo di una compattazione precedente"""
+        if not messages:
+            return False
+        if len(messages) > 1:
+            return True
+        summary, content = cls._split_summary(messages[0]["content"])
+        return summary is None or bool(content)
+
+    @staticmethod
+    def _split_summary(content: str):
+        """Separa un riepilogo dal messaggio a cui è stato unito: (riepilogo o None, resto)"""
+        if not content.startswith(SUMMARY_HEADER):
+            return None, content
+        summary, _, rest = content.partition("\n\n")
+        return summary, rest
+
+    @staticmethod
+    def _feedback_header(msg: dict) -> Optional[str]:
+        if msg["role"] != "user":
+            return None
+        for header in FEEDBACK_HEADERS:
+            if msg["content"].startswith(header):
+                return header
+        return None
+
+    @staticmethod
+    def _elide(content: str, header: str) -> str:
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+        return f"{header}{ELIDED_MARKER}: {len(content)} caratteri, sha1 {digest}]\n"
+
+    @classmethod
+    def _summarize(cls, messages: List[dict]) -> str:
+        """Riepilogo estrattivo: richieste dell'utente e comandi eseguiti"""
+        lines = []
+        for msg in messages:
+            summary, content = cls._split_summary(msg["content"])
+            if summary is not None:
+                # Riepilogo di una compattazione precedente: si conservano le righe,
+                # il messaggio a cui era stato unito si riassume come gli altri
+                lines.extend(l for l in summary.splitlines()[1:] if l.startswith("- "))
+                if not content:
+                    continue
+            if msg["role"] == "assistant":
+                for command, params in CommandParser.parse_all(content):
+                    target = params.get("path") or params.get("command") or params.get("pattern") or ""
+                    lines.append(f"- Comando {command} {' '.join(str(target).split())}".rstrip())
+            elif cls._feedback_header({"role": msg["role"], "content": content}) is None:
+                request = " ".join(content.split())
+                if len(request) > 200:
+                    request = request[:200] + "…"
+                lines.append(f"- Richiesta utente: {request}")
+
+        return "\n".join([SUMMARY_HEADER] + lines[-cls.MAX_SUMMARY_LINES:])
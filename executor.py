@@ -1,108 +1,348 @@
 """Parser ed esecutore dei comandi dell'agente"""
 
+import os
 import re
-from typing import Optional, Tuple, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, Optional, Tuple, Dict, Any, List
 from tools import FileTools, SystemTools, ToolResult
+from tracing import Tracer
 
 class CommandParser:
     """Parser per i comandi dell'agente"""
     
-    # Modifica: Usa \s* invece di \n per tollerare spazi o a capo dopo i tag
-    # Modifica: Usa re.DOTALL implicito nella compilazione o nel search
+    # Pattern dei parametri, applicati al solo corpo tra [TAG] e [/TAG].
+    # I blocchi vengono individuati da StreamParser in un'unica passata lineare.
     COMMANDS = {
-        'CREATE_FILE': r'\[CREATE_FILE\]\s*path:\s*(.+?)\s+content:\s*(.*?)\[/CREATE_FILE\]',
-        'READ_FILE': r'\[READ_FILE\]\s*path:\s*(.+?)\s*\[/READ_FILE\]',
-        'EDIT_FILE': r'\[EDIT_FILE\]\s*path:\s*(.+?)\s+old_content:\s*(.*?)\s+new_content:\s*(.*?)\[/EDIT_FILE\]',
-        'DELETE_FILE': r'\[DELETE_FILE\]\s*path:\s*(.+?)\s*\[/DELETE_FILE\]',
-        'APPEND_FILE': r'\[APPEND_FILE\]\s*path:\s*(.+?)\s+content:\s*(.*?)\[/APPEND_FILE\]',
-        'CREATE_DIR': r'\[CREATE_DIR\]\s*path:\s*(.+?)\s*\[/CREATE_DIR\]',
-        'LIST_DIR': r'\[LIST_DIR\]\s*path:\s*(.+?)\s*\[/LIST_DIR\]',
-        'DELETE_DIR': r'\[DELETE_DIR\]\s*path:\s*(.+?)\s*\[/DELETE_DIR\]',
-        'EXECUTE': r'\[EXECUTE\]\s*command:\s*(.+?)\s*\[/EXECUTE\]',
-        'SEARCH': r'\[SEARCH\]\s*pattern:\s*(.+?)(?:\s+path:\s*(.+?))?\s*\[/SEARCH\]',
-        'TREE': r'\[TREE\](?:\s*path:\s*(.+?))?(?:\s+depth:\s*(\d+))?\s*\[/TREE\]',
-        'RESPOND': r'\[RESPOND\]\s*(.*?)\[/RESPOND\]',
-        'DONE': r'\[DONE\]\s*(.*?)\[/DONE\]',
+        'CREATE_FILE': r'\s*path:\s*(.+?)\s+content:\s*(.*)',
+        'READ_FILE': r'\s*path:\s*(.+?)(?:\s+(lines|bytes|head|tail|grep):\s*(.+?))?\s*',
+        'EDIT_FILE': r'\s*path:\s*(.+?)\s+(?:old_content:\s*(.*?)\s+new_content:\s*(.*)|diff:[ \t]*\r?\n(.*))',
+        'DELETE_FILE': r'\s*path:\s*(.+?)\s*',
+        'APPEND_FILE': r'\s*path:\s*(.+?)\s+content:\s*(.*)',
+        'CREATE_DIR': r'\s*path:\s*(.+?)\s*',
+        'LIST_DIR': r'\s*path:\s*(.+?)\s*',
+        'DELETE_DIR': r'\s*path:\s*(.+?)\s*',
+        # timeout solo su una riga a sé dopo il comando: "echo timeout: 5" è un comando
+        'EXECUTE': r'\s*command:\s*(.+?)(?:[ \t]*\r?\n\s*timeout:[ \t]*(\d+))?\s*',
+        'RESTART_SHELL': r'(.*)',
+        'JOB_START': r'\s*command:\s*(.+?)\s*',
+        'JOB_STATUS': r'(?:\s*id:\s*(\d+))?\s*',
+        'JOB_TAIL': r'\s*id:\s*(\d+)(?:\s+lines:\s*(\d+))?\s*',
+        'JOB_WAIT': r'\s*id:\s*(\d+)(?:\s+timeout:\s*(\d+))?\s*',
+        'JOB_KILL': r'\s*id:\s*(\d+)\s*',
+        'SEARCH': r'\s*pattern:\s*(.+?)(?:\s+path:\s*(.+?))?(?:\s+mode:\s*(name|content))?(?:\s+max_results:\s*(\d+))?\s*',
+        'TREE': r'(?:\s*path:\s*(.+?))?(?:\s+depth:\s*(\d+))?\s*',
+        'RESPOND': r'(.*)',
+        'DONE': r'(.*)',
+    }
+    
+    # re.DOTALL permette al punto (.) di matchare anche i newlines
+    # re.IGNORECASE rende le keyword case-insensitive
+    _PATTERNS = {
+        name: re.compile(pattern, re.DOTALL | re.IGNORECASE)
+        for name, pattern in COMMANDS.items()
     }
     
     @classmethod
     def parse(cls, response: str) -> Optional[Tuple[str, Dict[str, Any]]]:
-        """Parsa la risposta dell'AI e estrae il comando"""
+        """Parsa la risposta dell'AI e estrae il primo comando"""
+        commands = cls.parse_all(response)
+        return commands[0] if commands else None
+    
+    @classmethod
+    def parse_all(cls, response: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Estrae tutti i comandi nell'ordine in cui compaiono"""
+        parser = StreamParser()
+        return parser.feed(response) + parser.close()
+    
+    @classmethod
+    def build(cls, cmd_name: str, body: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Costruisce il comando dal corpo di un blocco [TAG]...[/TAG]"""
+        match = cls._PATTERNS[cmd_name].fullmatch(body)
+        if not match:
+            return None
+        groups = match.groups()
         
-        # Pulizia base: a volte i modelli locali mettono spazi prima del tag
-        response = response.strip()
+        try:
+            if cmd_name == 'CREATE_FILE':
+                return cmd_name, {'path': groups[0].strip(), 'content': groups[1].strip()}
+            elif cmd_name == 'READ_FILE':
+                params = {'path': groups[0].strip()}
+                if groups[1]:
+                    # Lettura parziale: lines, bytes, head, tail o grep
+                    params[groups[1].lower()] = groups[2].strip()
+                return cmd_name, params
+            elif cmd_name == 'EDIT_FILE':
+                if groups[3] is not None:
+                    # Il diff non va strippato: le righe di contesto iniziano con uno spazio
+                    return cmd_name, {'path': groups[0].strip(), 'diff': groups[3].rstrip()}
+                return cmd_name, {
+                    'path': groups[0].strip(),
+                    'old_content': groups[1].strip(), # Rimuove spazi extra inizio/fine
+                    'new_content': groups[2].strip()
+                }
+            elif cmd_name == 'DELETE_FILE':
+                return cmd_name, {'path': groups[0].strip()}
+            elif cmd_name == 'APPEND_FILE':
+                return cmd_name, {'path': groups[0].strip(), 'content': groups[1]}
+            elif cmd_name == 'CREATE_DIR':
+                return cmd_name, {'path': groups[0].strip()}
+            elif cmd_name == 'LIST_DIR':
+                return cmd_name, {'path': groups[0].strip()}
+            elif cmd_name == 'DELETE_DIR':
+                return cmd_name, {'path': groups[0].strip()}
+            elif cmd_name == 'EXECUTE':
+                params = {'command': groups[0].strip()}
+                if groups[1]:
+                    params['timeout'] = int(groups[1])
+                return cmd_name, params
+            elif cmd_name == 'RESTART_SHELL':
+                return cmd_name, {}
+            elif cmd_name == 'JOB_START':
+                return cmd_name, {'command': groups[0].strip()}
+            elif cmd_name == 'JOB_STATUS':
+                return cmd_name, {'id': int(groups[0]) if groups[0] else None}
+            elif cmd_name == 'JOB_TAIL':
+                return cmd_name, {'id': int(groups[0]), 'lines': int(groups[1]) if groups[1] else 50}
+            elif cmd_name == 'JOB_WAIT':
+                params = {'id': int(groups[0])}
+                if groups[1]:
+                    params['timeout'] = int(groups[1])
+                return cmd_name, params
+            elif cmd_name == 'JOB_KILL':
+                return cmd_name, {'id': int(groups[0])}
+            elif cmd_name == 'SEARCH':
+                return cmd_name, {
+                    'pattern': groups[0].strip(),
+                    'path': groups[1].strip() if groups[1] else '.',
+                    'mode': groups[2].lower() if groups[2] else 'name',
+                    'max_results': int(groups[3]) if groups[3] else None
+                }
+            elif cmd_name == 'TREE':
+                return cmd_name, {
+                    'path': groups[0].strip() if groups[0] else '.',
+                    'depth': int(groups[1]) if groups[1] else 3
+                }
+            elif cmd_name == 'RESPOND':
+                return cmd_name, {'message': groups[0].strip()}
+            elif cmd_name == 'DONE':
+                return cmd_name, {'summary': groups[0].strip()}
+        except Exception as e:
+            print(f"Errore durante il parsing dei gruppi per {cmd_name}: {e}")
+        
+        return None
 
-        for cmd_name, pattern in cls.COMMANDS.items():
-            # re.DOTALL permette al punto (.) di matchare anche i newlines
-            # re.IGNORECASE rende i tag case-insensitive
-            match = re.search(pattern, response, re.DOTALL | re.IGNORECASE)
-            if match:
-                groups = match.groups()
+
+class StreamParser:
+    """
+    Parser incrementale a stati: riceve la risposta a pezzi e restituisce
+    i comandi appena il loro tag di chiusura è completo.
+    
+    Ogni carattere viene esaminato una sola volta: tra un pezzo e il
+    successivo si conserva solo l'eventuale tag spezzato a metà, mentre il
+    corpo del comando aperto viene accumulato in una lista e unito alla chiusura.
+    """
+    
+    # "[/" + nome più lungo + "]"
+    _MAX_TAG = max(len(name) for name in CommandParser.COMMANDS) + 3
+    
+    def __init__(self):
+        self._fed = 0          # caratteri ricevuti finora
+        self._tail = ""        # testo non ancora risolto (tag spezzato)
+        self._tag = None       # comando aperto in attesa di chiusura
+        self._close = ""       # tag di chiusura atteso
+        self._body = []        # pezzi del corpo del comando aperto
+        self._body_start = 0   # posizione assoluta di inizio del corpo
+        self.end_position = 0  # posizione subito dopo l'ultimo comando completato
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Aggiunge un pezzo di risposta e ritorna i comandi completati"""
+        base = self._fed - len(self._tail)
+        self._fed += len(chunk)
+        text, self._tail = self._tail + chunk, ""
+        return self._scan(text, base)
+    
+    def close(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Segnala la fine della risposta e ritorna gli ultimi comandi"""
+        if self._tag is None:
+            self._tail = ""
+            return []
+        
+        # Tag aperto e mai chiuso (es. citato nel testo): si rianalizza
+        # il testo successivo all'apertura come se il tag non ci fosse
+        text = "".join(self._body) + self._tail
+        base = self._body_start
+        self._tag, self._body, self._tail = None, [], ""
+        return self._scan(text, base) + self.close()
+    
+    def _scan(self, text: str, base: int) -> List[Tuple[str, Dict[str, Any]]]:
+        commands = []
+        pos = 0
+        
+        while pos < len(text):
+            if self._tag is None:
+                start = text.find('[', pos)
+                if start == -1:
+                    break
+                end = text.find(']', start + 1, start + self._MAX_TAG)
+                if end == -1:
+                    if len(text) - start < self._MAX_TAG:
+                        # Possibile tag spezzato: si riprende al prossimo pezzo
+                        self._tail = text[start:]
+                        break
+                    pos = start + 1
+                    continue
+                
+                name = text[start + 1:end].upper()
+                if name in CommandParser.COMMANDS:
+                    self._tag = name
+                    self._close = f"[/{name}]"
+                    self._body = []
+                    self._body_start = base + end + 1
+                    pos = end + 1
+                else:
+                    pos = start + 1
+            else:
+                start = text.find('[/', pos)
+                if start == -1:
+                    # Un '[' finale potrebbe essere l'inizio del tag di chiusura
+                    cut = len(text) - 1 if text.endswith('[') else len(text)
+                    self._append_body(text[pos:cut])
+                    self._tail = text[cut:]
+                    break
+                
+                end = start + len(self._close)
+                if end > len(text):
+                    self._append_body(text[pos:start])
+                    self._tail = text[start:]
+                    break
                 
-                try:
-                    if cmd_name == 'CREATE_FILE':
-                        return cmd_name, {'path': groups[0].strip(), 'content': groups[1].strip()}
-                    elif cmd_name == 'READ_FILE':
-                        return cmd_name, {'path': groups[0].strip()}
-                    elif cmd_name == 'EDIT_FILE':
-                        return cmd_name, {
-                            'path': groups[0].strip(),
-                            'old_content': groups[1].strip(), # Rimuove spazi extra inizio/fine
-                            'new_content': groups[2].strip()
-                        }
-                    elif cmd_name == 'DELETE_FILE':
-                        return cmd_name, {'path': groups[0].strip()}
-                    elif cmd_name == 'APPEND_FILE':
-                        return cmd_name, {'path': groups[0].strip(), 'content': groups[1]}
-                    elif cmd_name == 'CREATE_DIR':
-                        return cmd_name, {'path': groups[0].strip()}
-                    elif cmd_name == 'LIST_DIR':
-                        return cmd_name, {'path': groups[0].strip()}
-                    elif cmd_name == 'DELETE_DIR':
-                        return cmd_name, {'path': groups[0].strip()}
-                    elif cmd_name == 'EXECUTE':
-                        return cmd_name, {'command': groups[0].strip()}
-                    elif cmd_name == 'SEARCH':
-                        return cmd_name, {
-                            'pattern': groups[0].strip(),
-                            'path': groups[1].strip() if groups[1] else '.'
-                        }
-                    elif cmd_name == 'TREE':
-                        return cmd_name, {
-                            'path': groups[0].strip() if groups[0] else '.',
-                            'depth': int(groups[1]) if groups[1] else 3
-                        }
-                    elif cmd_name == 'RESPOND':
-                        return cmd_name, {'message': groups[0].strip()}
-                    elif cmd_name == 'DONE':
-                        return cmd_name, {'summary': groups[0].strip()}
-                except Exception as e:
-                    print(f"Errore durante il parsing dei gruppi per {cmd_name}: {e}")
+                if text[start:end].upper() != self._close:
+                    self._append_body(text[pos:start + 2])
+                    pos = start + 2
                     continue
+                
+                self._append_body(text[pos:start])
+                body = "".join(self._body)
+                command = CommandParser.build(self._tag, body)
+                self._tag = None
+                self._body = []
+                if command:
+                    commands.append(command)
+                    self.end_position = base + end
+                    pos = end
+                    continue
+                
+                # Blocco non valido (es. il tag citato nel testo): si riprende
+                # subito dopo il tag di apertura scartato, non dopo la chiusura
+                text = body + text[start:]
+                base = self._body_start
+                pos = 0
         
-        return None
+        return commands
+    
+    def _append_body(self, text: str):
+        if text:
+            self._body.append(text)
 
 
 class CommandExecutor:
     """Esegue i comandi parsati"""
     
-    def __init__(self, workspace: str, safe_mode: bool = True):
-        self.file_tools = FileTools(workspace, safe_mode)
-        self.system_tools = SystemTools(workspace, safe_mode)
+    # Comandi che non modificano nulla: possono girare in parallelo
+    READ_ONLY_COMMANDS = ('READ_FILE', 'LIST_DIR', 'TREE', 'SEARCH', 'JOB_STATUS', 'JOB_TAIL')
+    # Comandi che eseguono processi nella workspace, o ne attendono la fine, e possono modificare qualunque file
+    SHELL_COMMANDS = ('EXECUTE', 'JOB_START', 'JOB_WAIT', 'JOB_KILL')
+    # Letture il cui risultato, se invariato, rimanda al turno in cui è già stato inviato
+    DEDUP_COMMANDS = ('READ_FILE', 'LIST_DIR', 'TREE')
+    
+    # Una sola richiesta di conferma alla volta sul terminale
+    _confirm_lock = threading.Lock()
+    
+    def __init__(self, workspace: str, safe_mode: bool = True, max_workers: int = 4,
+                 execute_timeout: int = 30, persistent_shell: bool = False):
+        self.file_tools = FileTools(workspace, safe_mode, search_workers=max_workers)
+        self.system_tools = SystemTools(workspace, safe_mode, execute_timeout, persistent_shell)
         self.safe_mode = safe_mode
+        self.max_workers = max_workers
+        # Senza terminale (batch) le azioni da confermare vengono rifiutate
+        self.interactive = True
+        # Span di esecuzione e conferme (spento finché l'Agent non ne imposta uno)
+        self.tracer = Tracer()
+        # Turno corrente dell'agente, per i rimandi ai risultati già inviati
+        self.turn = 0
+        # False: ogni lettura restituisce sempre il risultato completo
+        self.dedup_results = True
     
     def execute(self, command: str, params: Dict[str, Any]) -> Tuple[ToolResult, bool]:
         """
         Esegue un comando e ritorna (risultato, is_done)
         """
+        with self.tracer.span("execute", command=command) as span:
+            if self.dedup_results and command in self.DEDUP_COMMANDS:
+                result = self._dispatch_dedup(command, params, span)
+            else:
+                result = self._dispatch(command, params)
+            self._trace_result(span, result[0])
+            return result
+    
+    def _dispatch_dedup(self, command: str, params: Dict[str, Any], span) -> Tuple[ToolResult, bool]:
+        """
+        Esegue una lettura; se il risultato è identico a uno già inviato al
+        modello restituisce solo un rimando al turno in cui è stato inviato
+        """
+        results = self.file_tools.results
+        try:
+            full_path = self.file_tools._resolve_path(params.get('path', '.'))
+            # La firma del file evita di rileggerlo; le directory vanno sempre ricalcolate
+            signature = results.signature(full_path) if command == 'READ_FILE' else None
+        except OSError:
+            return self._dispatch(command, params)
+        
+        key = (command, full_path) + tuple(sorted((k, str(v)) for k, v in params.items() if k != 'path'))
+        turn = results.lookup(key, signature)
+        if turn is None:
+            result = self._dispatch(command, params)
+            if not result[0].success:
+                return result
+            turn = results.store(key, full_path, signature, result[0].output, self.turn)
+            if turn is None:
+                return result
+        
+        span.set(unchanged_since=turn)
+        unchanged = "file invariato" if command == 'READ_FILE' else "directory invariata"
+        return ToolResult(
+            True, f"♻️ {command} {params.get('path', '.')}: {unchanged}, identico al risultato già ricevuto al turno {turn}"
+        ), False
+    
+    @staticmethod
+    def _trace_result(span, result: ToolResult):
+        span.set(
+            success=result.success,
+            output_bytes=len((result.error or result.output or "").encode("utf-8"))
+        )
+    
+    def _dispatch(self, command: str, params: Dict[str, Any]) -> Tuple[ToolResult, bool]:
+        if command in self.SHELL_COMMANDS:
+            # Un comando shell può modificare qualunque file: cache delle directory e indice da riallineare
+            self.file_tools.external_change()
         
         if command == 'CREATE_FILE':
             return self.file_tools.create_file(params['path'], params['content']), False
         
         elif command == 'READ_FILE':
-            return self.file_tools.read_file(params['path']), False
+            return self.file_tools.read_file(
+                params['path'],
+                lines=params.get('lines'),
+                byte_range=params.get('bytes'),
+                head=params.get('head'),
+                tail=params.get('tail'),
+                grep=params.get('grep')
+            ), False
         
         elif command == 'EDIT_FILE':
+            if 'diff' in params:
+                return self.file_tools.apply_diff(params['path'], params['diff']), False
             return self.file_tools.edit_file(
                 params['path'], params['old_content'], params['new_content']
             ), False
@@ -130,13 +370,35 @@ class CommandExecutor:
         
         elif command == 'EXECUTE':
             cmd = params['command']
-            if self.safe_mode and self.system_tools.is_dangerous(cmd):
-                if not self._confirm(f"Eseguire comando potenzialmente pericoloso?\n{cmd}"):
-                    return ToolResult(False, "❌ Operazione annullata dall'utente"), False
-            return self.system_tools.execute(cmd), False
+            if not self._allow_execute(cmd):
+                return ToolResult(False, "❌ Operazione annullata dall'utente"), False
+            return self.system_tools.execute(cmd, params.get('timeout')), False
+        
+        elif command == 'RESTART_SHELL':
+            return self.system_tools.restart_shell(), False
+        
+        elif command == 'JOB_START':
+            cmd = params['command']
+            if not self._allow_execute(cmd):
+                return ToolResult(False, "❌ Operazione annullata dall'utente"), False
+            return self.system_tools.job_start(cmd), False
+        
+        elif command == 'JOB_STATUS':
+            return self.system_tools.job_status(params['id']), False
+        
+        elif command == 'JOB_TAIL':
+            return self.system_tools.job_tail(params['id'], params['lines']), False
+        
+        elif command == 'JOB_WAIT':
+            return self.system_tools.job_wait(params['id'], params.get('timeout')), False
+        
+        elif command == 'JOB_KILL':
+            return self.system_tools.job_kill(params['id']), False
         
         elif command == 'SEARCH':
-            return self.file_tools.search(params['pattern'], params['path']), False
+            return self.file_tools.search(
+                params['pattern'], params['path'], params.get('mode', 'name'), params.get('max_results')
+            ), False
         
         elif command == 'TREE':
             return self.file_tools.tree(params['path'], params['depth']), False
@@ -149,8 +411,85 @@ class CommandExecutor:
         
         return ToolResult(False, "", f"Comando sconosciuto: {command}"), False
     
+    def execute_stream(self, command: str, params: Dict[str, Any]) -> Generator[str, None, Tuple[ToolResult, bool]]:
+        """
+        Come execute(), ma per EXECUTE yield le righe di output mentre il
+        comando è in esecuzione. Ritorna (risultato, is_done)
+        """
+        if command != 'EXECUTE':
+            return self.execute(command, params)
+        
+        with self.tracer.span("execute", command=command) as span:
+            cmd = params['command']
+            if not self._allow_execute(cmd):
+                result = ToolResult(False, "❌ Operazione annullata dall'utente")
+            else:
+                self.file_tools.external_change()
+                result = yield from self.system_tools.execute_stream(cmd, params.get('timeout'))
+            self._trace_result(span, result)
+            return result, False
+    
+    def _allow_execute(self, cmd: str) -> bool:
+        """Chiede conferma per i comandi pericolosi in safe mode"""
+        if self.safe_mode and self.system_tools.is_dangerous(cmd):
+            return self._confirm(f"Eseguire comando potenzialmente pericoloso?\n{cmd}")
+        return True
+    
+    def execute_batch(self, commands: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[ToolResult, bool]]:
+        """
+        Esegue più comandi della stessa risposta e ritorna i risultati nell'ordine
+        originale. Le letture girano in parallelo su un pool di thread; le
+        modifiche girano in ordine, ciascuna dopo le letture precedenti sugli
+        stessi path. [DONE] interrompe i comandi successivi.
+        """
+        results: List[Optional[Tuple[ToolResult, bool]]] = [None] * len(commands)
+        pending = []  # (indice, path, future) delle letture in corso
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for i, (command, params) in enumerate(commands):
+                path = self._command_path(command, params)
+                
+                if command in self.READ_ONLY_COMMANDS:
+                    # Le modifiche precedenti sono già concluse: la lettura può partire
+                    pending.append((i, path, pool.submit(self.execute, command, params)))
+                    continue
+                
+                # Prima di modificare, attende le letture in corso sugli stessi path
+                for j, read_path, future in pending:
+                    if self._paths_overlap(path, read_path):
+                        results[j] = future.result()
+                pending = [p for p in pending if results[p[0]] is None]
+                
+                results[i] = self.execute(command, params)
+                if results[i][1]:
+                    break
+            
+            for j, _, future in pending:
+                results[j] = future.result()
+        
+        return [r for r in results if r is not None]
+    
+    @staticmethod
+    def _command_path(command: str, params: Dict[str, Any]) -> Optional[str]:
+        """Path toccato dal comando (None = potenzialmente tutta la workspace)"""
+        if command == 'EXECUTE' or 'path' not in params:
+            return None
+        return os.path.normpath(params['path'])
+    
+    @staticmethod
+    def _paths_overlap(a: Optional[str], b: Optional[str]) -> bool:
+        """True se uno dei due path contiene l'altro"""
+        if a is None or b is None or a == '.' or b == '.':
+            return True
+        return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+    
     def _confirm(self, message: str) -> bool:
         """Chiede conferma all'utente"""
-        print(f"\n⚠️  {message}")
-        response = input("Confermi? (s/n): ").strip().lower()
-        return response in ('s', 'si', 'sì', 'y', 'yes')
\ No newline at end of file
+        if not self.interactive:
+            return False
+        with self._confirm_lock, self.tracer.span("confirm") as span:
+            print(f"\n⚠️  {message}")
+            response = input("Confermi? (s/n): ").strip().lower()
+            accepted = response in ('s', 'si', 'sì', 'y', 'yes')
+            span.set(accepted=accepted)
+        return accepted
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""Snapshot in cache delle directory della workspace, per TREE e LIST_DIR"""
+
+import os
+import hashlib
+import fnmatch
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from search_index import SKIP_DIRS
+
+# File di sistema mai mostrati in TREE
+DEFAULT_IGNORED_FILES = ("*.pyc", "*.pyo", ".DS_Store", "Thumbs.db")
+
+
+class IgnoreRules:
+    """
+    Regole di esclusione per TREE: directory predefinite (VCS, dipendenze,
+    cache) più il `.gitignore` nella radice della workspace.
+
+    Del formato gitignore è supportato il sottoinsieme comune: glob, `/`
+    finale per le sole directory, `/` iniziale o interno per i path ancorati
+    alla radice, `**/` iniziale e `!` per le negazioni. Vale l'ultima regola
+    che corrisponde.
+
+    `ignored` usa le regole già caricate: `reload()` va chiamato una volta
+    prima di ogni visita (un TREE), non per ogni elemento.
+    """
+
+    def __init__(self, workspace: str):
+        self.workspace = os.path.abspath(workspace)
+        self.gitignore_path = os.path.join(self.workspace, ".gitignore")
+        self._mtime_ns = None
+        self._rules: List[Tuple[str, bool, bool, bool]] = []  # (glob, negato, solo dir, ancorato)
+
+    @property
+    def version(self) -> Optional[int]:
+        """Identifica le regole caricate (mtime del .gitignore)"""
+        return self._mtime_ns
+
+    def reload(self):
+        """Rilegge il .gitignore se è cambiato"""
+        try:
+            mtime_ns = os.stat(self.gitignore_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns:
+            return
+        self._mtime_ns = mtime_ns
+        self._rules = []
+        if mtime_ns is None:
+            return
+
+        with open(self.gitignore_path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                line = line.rstrip("\n").rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                negated = line.startswith("!")
+                if negated:
+                    line = line[1:]
+                dir_only = line.endswith("/")
+                line = line.rstrip("/")
+                if line.startswith("**/"):
+                    line = line[3:]
+                anchored = "/" in line
+                if line:
+                    self._rules.append((line.lstrip("/"), negated, dir_only, anchored))
+
+    def ignored(self, relpath: str, is_dir: bool) -> bool:
+        """True se il path (relativo alla workspace, con /) va escluso"""
+        name = relpath.rsplit("/", 1)[-1]
+        if is_dir and name in SKIP_DIRS:
+            return True
+        if not is_dir and any(fnmatch.fnmatch(name, glob) for glob in DEFAULT_IGNORED_FILES):
+            return True
+
+        result = False
+        for glob, negated, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatch(relpath if anchored else name, glob):
+                result = not negated
+        return result
+
+
+class Entry(NamedTuple):
+    """Elemento di una directory: solo ciò che non cambia finché l'mtime della directory è lo stesso"""
+    name: str
+    path: str
+    is_dir: bool
+
+
+class DirectoryCache:
+    """
+    Contenuto delle directory (nomi e tipo degli elementi) in cache,
+    validato con l'mtime della directory: l'mtime cambia quando si creano,
+    eliminano o rinominano elementi, quindi una directory invariata non
+    viene riletta.
+
+    Le dimensioni dei file non cambiano l'mtime della directory (scritture
+    da editor esterni, job in background): per questo non vengono
+    memorizzate e `size()` le legge ogni volta con os.stat. I tool di
+    scrittura dell'agente invalidano comunque la directory interessata.
+
+    Insieme allo snapshot si conservano le decisioni di IgnoreRules sugli
+    elementi, finché non cambiano la directory o il .gitignore.
+    """
+
+    def __init__(self):
+        # path -> (mtime_ns, elementi, {versione delle regole: elementi ignorati})
+        self._snapshots: Dict[str, Tuple[int, List[Entry], Dict[Optional[int], List[bool]]]] = {}
+        self._lock = threading.Lock()
+
+    def _snapshot(self, full_path: str) -> Tuple[int, List[Entry], Dict[Optional[int], List[bool]]]:
+        mtime_ns = os.stat(full_path).st_mtime_ns
+        with self._lock:
+            cached = self._snapshots.get(full_path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached
+
+        with os.scandir(full_path) as it:
+            entries = sorted(
+                (Entry(entry.name, entry.path, self._scan_is_dir(entry)) for entry in it),
+                key=lambda entry: entry.name
+            )
+        snapshot = (mtime_ns, entries, {})
+        with self._lock:
+            self._snapshots[full_path] = snapshot
+        return snapshot
+
+    def entries(self, full_path: str) -> List[Entry]:
+        """Elementi della directory ordinati per nome"""
+        return self._snapshot(full_path)[1]
+
+    def filtered(self, full_path: str, relprefix: str, rules: IgnoreRules) -> List[Tuple[Entry, bool]]:
+        """
+        Elementi della directory con la decisione di `rules` (True se
+        ignorato). `relprefix` è il path della directory relativo alla
+        workspace, con / finale ("" per la radice); le regole devono essere
+        già caricate (`IgnoreRules.reload`)
+        """
+        _, entries, decisions = self._snapshot(full_path)
+        ignored = decisions.get(rules.version)
+        if ignored is None:
+            ignored = [rules.ignored(relprefix + entry.name, entry.is_dir) for entry in entries]
+            with self._lock:
+                # Solo le decisioni delle regole attuali
+                decisions.clear()
+                decisions[rules.version] = ignored
+        return list(zip(entries, ignored))
+
+    def invalidate(self, full_path: str):
+        """Scarta la directory del path modificato (e il path stesso, se directory)"""
+        full_path = os.path.abspath(full_path)
+        with self._lock:
+            self._snapshots.pop(full_path, None)
+            self._snapshots.pop(os.path.dirname(full_path), None)
+            # Directory eliminata: anche le sottodirectory in cache sono obsolete
+            prefix = full_path + os.sep
+            for path in [p for p in self._snapshots if p.startswith(prefix)]:
+                del self._snapshots[path]
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    @staticmethod
+    def _scan_is_dir(entry: os.DirEntry) -> bool:
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    @staticmethod
+    def is_dir(entry: Entry) -> bool:
+        return entry.is_dir
+
+    @staticmethod
+    def size(entry: Entry) -> Optional[int]:
+        """Dimensione attuale del file (mai in cache)"""
+        try:
+            return os.stat(entry.path).st_size
+        except OSError:
+            return None
+
+
+class ResultCache:
+    """
+    Risultati di READ_FILE, LIST_DIR e TREE già inviati al modello nella
+    sessione, per chiave (comando, path, parametri). Serve a riconoscere le
+    riletture di qualcosa che non è cambiato: il risultato completo è già
+    nella conversazione, basta rimandare al turno in cui è stato inviato.
+
+    Di un file si conserva la firma (inode, dimensione, mtime_ns): se
+    coincide la lettura non viene nemmeno ripetuta. Per le directory la firma
+    non basta (una modifica in una sottodirectory non cambia l'mtime della
+    radice), quindi il risultato viene ricalcolato, con DirectoryCache è
+    economico, e confrontato con l'hash di quello precedente.
+
+    I tool di scrittura dell'agente invalidano il path modificato, le
+    directory che lo contengono e, se è una directory, il suo contenuto.
+    Quando la conversazione viene compattata vanno scartati (`forget`) i
+    risultati dei turni il cui feedback è stato omesso o riassunto: quello
+    a cui si rimanda non c'è più. Gli altri restano validi.
+
+    I risultati nuovi restano in sospeso finché l'agente non li aggiunge
+    davvero alla conversazione (`commit`); se il turno si chiude senza
+    feedback, ad esempio con [DONE], vanno scartati (`discard`).
+    """
+
+    def __init__(self):
+        # chiave -> (path, firma, hash del risultato, turno)
+        self._entries: Dict[tuple, Tuple[str, Optional[tuple], str, int]] = {}
+        self._pending: Dict[tuple, Tuple[str, Optional[tuple], str, int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    @staticmethod
+    def signature(full_path: str) -> tuple:
+        st = os.stat(full_path)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def lookup(self, key: tuple, signature: Optional[tuple]) -> Optional[int]:
+        """Turno del risultato in cache se la firma coincide (None senza firma)"""
+        if signature is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != signature:
+                return None
+            self.hits += 1
+            return entry[3]
+
+    def store(self, key: tuple, full_path: str, signature: Optional[tuple], output: str, turn: int) -> Optional[int]:
+        """
+        Registra un risultato appena calcolato. Se è identico a quello in
+        cache ritorna il turno originale (e il risultato non va rimandato),
+        altrimenti lo mette in sospeso con il turno corrente e ritorna None
+        """
+        digest = hashlib.sha1(output.encode("utf-8", errors="replace")).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == digest:
+                self._entries[key] = (full_path, signature, digest, entry[3])
+                self.hits += 1
+                return entry[3]
+            self._pending[key] = (full_path, signature, digest, turn)
+            return None
+
+    def commit(self):
+        """I risultati in sospeso sono stati inviati al modello"""
+        with self._lock:
+            self._entries.update(self._pending)
+            self._pending.clear()
+
+    def discard(self):
+        """I risultati in sospeso non sono stati inviati al modello"""
+        with self._lock:
+            self._pending.clear()
+
+    def forget(self, turns: Set[int]):
+        """Scarta i risultati inviati nei turni indicati (non più nella conversazione)"""
+        if not turns:
+            return
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[3] in turns]:
+                del self._entries[key]
+
+    def invalidate(self, full_path: str):
+        """Scarta i risultati sul path modificato, sulle directory che lo contengono e sul suo contenuto"""
+        full_path = os.path.abspath(full_path)
+        prefix = full_path + os.sep
+        with self._lock:
+            for entries in (self._entries, self._pending):
+                for key in [k for k, entry in entries.items()
+                            if entry[0] == full_path
+                            or entry[0].startswith(prefix)
+                            or full_path.startswith(entry[0].rstrip(os.sep) + os.sep)]:
+                    del entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
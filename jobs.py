@@ -0,0 +1,146 @@
+"""Job in background per i comandi lunghi (test, build, server)"""
+
+import os
+import time
+import atexit
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from shell import kill_tree
+
+
+@dataclass
+class Job:
+    id: int
+    command: str
+    process: subprocess.Popen
+    log_path: str
+    started: float
+    ended: Optional[float] = None
+    killed: bool = False
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.poll()
+
+
+class JobManager:
+    """
+    Avvia comandi shell in background e ne tiene traccia per id.
+
+    L'output (stdout e stderr) va direttamente su file in `.agent_jobs/`:
+    la memoria non cresce con l'output, e la coda si legge dal fondo del file.
+    I job ancora attivi vengono terminati all'uscita del processo.
+    """
+
+    JOBS_DIR = ".agent_jobs"
+    # Byte massimi letti dal fondo del log per JOB_TAIL
+    TAIL_BYTES = 64 * 1024
+
+    def __init__(self, workspace: str, max_jobs: int = 8):
+        self.workspace = os.path.abspath(workspace)
+        self.jobs_dir = os.path.join(self.workspace, self.JOBS_DIR)
+        self.max_jobs = max_jobs
+        self.jobs: Dict[int, Job] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _running(self) -> List[Job]:
+        return [job for job in self.jobs.values() if job.returncode is None]
+
+    def get(self, job_id: int) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Job {job_id} non trovato")
+        return job
+
+    def start(self, command: str) -> Job:
+        """Avvia un comando in background"""
+        with self._lock:
+            if len(self._running()) >= self.max_jobs:
+                raise RuntimeError(f"Troppi job attivi (massimo {self.max_jobs}): attendine o terminane uno")
+
+            job_id = self._next_id
+            self._next_id += 1
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            log_path = os.path.join(self.jobs_dir, f"{job_id}.log")
+            with open(log_path, "wb") as log:
+                process = subprocess.Popen(
+                    command,
+                    shell=True,
+                    cwd=self.workspace,
+                    stdin=subprocess.DEVNULL,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    # Gruppo di processi dedicato: JOB_KILL termina anche i figli
+                    start_new_session=os.name != "nt"
+                )
+            job = Job(job_id, command, process, log_path, time.time())
+            self.jobs[job_id] = job
+        threading.Thread(target=self._watch, args=(job,), daemon=True).start()
+        return job
+
+    @staticmethod
+    def _watch(job: Job):
+        """Registra l'istante di fine del job"""
+        job.process.wait()
+        job.ended = time.time()
+
+    def wait(self, job_id: int, timeout: float) -> Job:
+        """Attende la fine del job per al massimo `timeout` secondi"""
+        job = self.get(job_id)
+        try:
+            job.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        return job
+
+    def kill(self, job_id: int) -> Job:
+        """Termina il job e i processi che ha avviato"""
+        job = self.get(job_id)
+        if job.returncode is None:
+            kill_tree(job.process)
+            job.process.wait()
+            job.killed = True
+        return job
+
+    def tail(self, job_id: int, lines: int = 50) -> Tuple[List[str], int]:
+        """Ultime `lines` righe del log e dimensione totale del log in byte"""
+        job = self.get(job_id)
+        try:
+            with open(job.log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                start = max(0, size - self.TAIL_BYTES)
+                f.seek(start)
+                data = f.read()
+        except OSError:
+            return [], 0
+
+        text = data.decode("utf-8", errors="replace").splitlines()
+        if start > 0:
+            # La prima riga letta è quasi sicuramente troncata
+            text = text[1:]
+        return text[-lines:], size
+
+    def describe(self, job: Job) -> str:
+        """Riga di stato del job"""
+        returncode = job.returncode
+        if returncode is None:
+            return f"🟢 Job {job.id} in esecuzione da {time.time() - job.started:.0f}s: {job.command}"
+
+        elapsed = (job.ended or time.time()) - job.started
+        if job.killed:
+            return f"⛔ Job {job.id} terminato su richiesta dopo {elapsed:.0f}s: {job.command}"
+        icon = "✅" if returncode == 0 else "❌"
+        return f"{icon} Job {job.id} terminato (exit {returncode}) dopo {elapsed:.0f}s: {job.command}"
+
+    def close(self):
+        """Termina tutti i job ancora attivi"""
+        # Chiuso esplicitamente: l'handler di uscita non deve più tenere in vita il manager
+        atexit.unregister(self.close)
+        for job in list(self.jobs.values()):
+            if job.returncode is None:
+                kill_tree(job.process)
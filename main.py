@@ -5,9 +5,11 @@ AI Agent Terminal - Sistema agentico per AI
 
 import os
 import sys
+import time
 import argparse
 from config import Config
-from agent import Agent
+from agent import StreamToken
+from startup import AgentLoader
 
 # Colori ANSI
 class Colors:
@@ -35,10 +37,32 @@ def print_banner():
     print(f"{Colors.YELLOW}Type 'exit', 'quit' or 'esci' to stop.{Colors.END}\n")
 
 def main():
+    started = time.perf_counter()
     parser = argparse.ArgumentParser(description="AI Agent Terminal")
     parser.add_argument("--provider", type=str, help="AI Provider (ollama, openai, lmstudio, etc)")
     parser.add_argument("--model", type=str, help="Model name")
     parser.add_argument("--safe-mode", action="store_true", help="Enable safe mode")
+    parser.add_argument("--no-stream", action="store_true", help="Disable token streaming")
+    parser.add_argument("--multi", action="store_true", help="Allow multiple commands per reply")
+    parser.add_argument("--tool-mode", choices=["tags", "native", "json"],
+                        help="How the model sends commands: bracket tags, native tool calls or schema-constrained JSON")
+    parser.add_argument("--samples", type=int,
+                        help="Request N candidate replies in parallel and keep the first one that parses (tags mode)")
+    parser.add_argument("--sample-policy", choices=["always", "on_failure"],
+                        help="Sample N candidates on every request, or only after a malformed reply (default)")
+    parser.add_argument("--cache", choices=["readwrite", "record", "replay"],
+                        help="Cache provider responses on disk")
+    parser.add_argument("--cache-dir", type=str, help="Response cache directory")
+    parser.add_argument("--resume", type=str, metavar="SESSION",
+                        help="Resume a saved session (id or 'last')")
+    parser.add_argument("--trace", type=str, metavar="FILE",
+                        help="Write a JSONL trace of model, parser and tool timings")
+    parser.add_argument("--trace-summary", action="store_true",
+                        help="Print a latency/token summary after each task")
+    parser.add_argument("--router", type=str, metavar="BACKENDS",
+                        help="Balance across backends, e.g. 'ollama=http://a:11434,lmstudio=http://b:1234/v1,fallback:openai'")
+    parser.add_argument("--no-prewarm", action="store_true",
+                        help="Skip the backend health check and model preload at startup")
     
     args = parser.parse_args()
     
@@ -52,6 +76,33 @@ def main():
         config.model = args.model
     if args.safe_mode:
         config.safe_mode = True
+    if args.no_stream:
+        config.stream = False
+    if args.multi:
+        config.multi_command = True
+    if args.tool_mode:
+        config.tool_mode = args.tool_mode
+    if args.samples:
+        config.speculative_samples = args.samples
+    if args.sample_policy:
+        config.speculative_policy = args.sample_policy
+    if args.cache:
+        config.response_cache_mode = args.cache
+    if args.cache_dir:
+        config.response_cache_dir = args.cache_dir
+    if args.trace:
+        config.trace_file = args.trace
+    if args.trace_summary:
+        config.trace_summary = True
+    if args.no_prewarm:
+        config.prewarm = False
+    if args.router:
+        from router import parse_backends
+        config.provider = "router"
+        config.router_backends = parse_backends(args.router)
+    
+    # Agent, health check e caricamento del modello partono mentre si mostra il banner
+    loader = AgentLoader(config, started).start()
         
     print_banner()
     print(f"🔧 Provider:  {Colors.BOLD}{config.provider}{Colors.END}")
@@ -60,14 +111,38 @@ def main():
     
     if config.provider == "lmstudio":
         print(f"📡 URL:       {Colors.BOLD}{config.lmstudio_base_url}{Colors.END}")
+    elif config.provider == "router":
+        for backend in config.router_backends or []:
+            target = backend.get("base_url") or backend["provider"]
+            role = " (fallback)" if backend.get("fallback") else ""
+            print(f"📡 Backend:   {Colors.BOLD}{backend['provider']} {target}{role}{Colors.END}")
         
     print("-" * 60)
     
+    agent = None
     try:
-        agent = Agent(config)
+        agent = loader.get_agent()
+        if args.resume:
+            count = agent.resume(args.resume)
+            print(f"♻️  Sessione ripresa: {Colors.BOLD}{agent.journal.session_id}{Colors.END} ({count} messaggi)")
+        elif agent.journal is not None:
+            print(f"💾 Sessione:  {Colors.BOLD}{agent.journal.session_id}{Colors.END}")
+        
+        if config.prewarm:
+            # Un backend irraggiungibile si vede subito, non al primo task
+            loader.wait_probe(timeout=3)
+            print(loader.probe_report())
+        warm_reported = not config.prewarm
+        first_task = True
         
         while True:
             try:
+                if not warm_reported and loader.warm:
+                    warm_reported = True
+                    report = loader.warmup_report()
+                    if report:
+                        print(report)
+                
                 user_input = input(f"\n{Colors.GREEN}You ➤ {Colors.END}")
                 
                 if user_input.lower() in ['exit', 'quit', 'esci']:
@@ -79,9 +154,21 @@ def main():
                     
                 print(f"\n{Colors.CYAN}Thinking...{Colors.END}")
                 
+                submitted = time.perf_counter()
                 for output in agent.run(user_input):
+                    if first_task and (isinstance(output, StreamToken) or output.startswith("\n🤖 AI:\n")):
+                        # Tempo al primo token del primo task, da confrontare tra versioni
+                        first_task = False
+                        ready = loader.timings.get("warmup_s")
+                        print(f"{Colors.CYAN}⏱️  Primo token dopo {time.perf_counter() - submitted:.2f}s "
+                              f"(Agent pronto a {loader.timings['agent_s']}s"
+                              f"{f', modello a {ready}s' if ready is not None else ''} dall'avvio){Colors.END}")
+                    
+                    # I token in streaming vanno stampati sulla stessa riga
+                    if isinstance(output, StreamToken):
+                        print(f"{Colors.BLUE}{output}{Colors.END}", end="", flush=True)
                     # Stampa output colorato in base al contenuto
-                    if "❌" in output:
+                    elif "❌" in output:
                         print(f"{Colors.RED}{output}{Colors.END}")
                     elif "⚙️" in output:
                         print(f"{Colors.YELLOW}{output}{Colors.END}")
@@ -97,6 +184,9 @@ def main():
     except Exception as e:
         print(f"\n{Colors.RED}Fatal Error: {e}{Colors.END}")
         sys.exit(1)
+    finally:
+        if agent is not None:
+            agent.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
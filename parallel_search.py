@@ -0,0 +1,96 @@
+"""Ricerca parallela nella workspace: sottoalberi distribuiti su un pool di thread"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+from search_index import SKIP_DIRS, ordered_map
+
+
+def normalize_roots(roots: List[str]) -> List[str]:
+    """Radici senza duplicati e senza quelle contenute in un'altra radice (nell'ordine dato)"""
+    roots = [os.path.abspath(root) for root in roots]
+    kept = []
+    for root in roots:
+        nested = any(root.startswith(other.rstrip(os.sep) + os.sep) for other in roots if other != root)
+        if not nested and root not in kept:
+            kept.append(root)
+    return kept
+
+
+class NameSearch:
+    """
+    Ricerca di file per nome su una o più radici.
+
+    Ogni sottodirectory di primo livello è un task del pool; ogni task si
+    ferma dopo `max_results` match, e i task successivi non partono una
+    volta raggiunto il limite complessivo.
+    """
+
+    def __init__(self, workspace: str, max_workers: int = 4):
+        self.workspace = os.path.abspath(workspace)
+        self.max_workers = max_workers
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.workspace).replace(os.sep, "/")
+
+    @staticmethod
+    def _tasks(roots: List[str]) -> Iterator[Tuple[str, bool]]:
+        """(directory, ricorsivo): i file di ogni radice, poi le sue sottodirectory"""
+        for root in roots:
+            yield root, False
+            try:
+                with os.scandir(root) as it:
+                    subdirs = sorted(
+                        entry.path for entry in it
+                        if entry.name not in SKIP_DIRS and entry.is_dir(follow_symlinks=False)
+                    )
+            except OSError:
+                continue
+            for subdir in subdirs:
+                yield subdir, True
+
+    def _scan(self, regex: re.Pattern, directory: str, recursive: bool, limit: int) -> Tuple[List[str], int]:
+        """Match (ordinati) e file esaminati in una directory o in un sottoalbero"""
+        matches = []
+        scanned = 0
+        stack = [directory]
+        while stack and len(matches) < limit:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and entry.name not in SKIP_DIRS:
+                            subdirs.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+                scanned += 1
+                if regex.search(entry.name):
+                    matches.append(self._relpath(entry.path))
+                    if len(matches) >= limit:
+                        break
+            # Ordine di visita depth-first, alfabetico
+            stack.extend(reversed(subdirs))
+        return matches, scanned
+
+    def search(self, pattern: str, roots: List[str], max_results: int) -> Iterator[Tuple[List[str], int]]:
+        """
+        Yield (match, file esaminati) per ogni task, nell'ordine dei path;
+        chi consuma può fermarsi appena ha abbastanza risultati.
+        """
+        regex = re.compile(pattern, re.IGNORECASE)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            yield from ordered_map(
+                pool,
+                lambda task: self._scan(regex, task[0], task[1], max_results),
+                self._tasks(roots),
+                self.max_workers * 2
+            )
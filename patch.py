@@ -0,0 +1,211 @@
+"""Applicazione di diff unificati (più hunk) con contesto approssimato"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+# "@@ -12,5 +12,6 @@", ma anche "@@ -12 @@" o "@@" da solo
+_HUNK_HEADER = re.compile(r"^@@\s*(?:-(\d+)(?:,(\d+))?)?(?:\s+\+(\d+)(?:,(\d+))?)?")
+
+
+class PatchError(ValueError):
+    """Il diff non è valido o un hunk non trova corrispondenza nel file"""
+
+
+@dataclass
+class Hunk:
+    old_start: Optional[int] = None  # riga di partenza (1-based) dall'header @@, se presente
+    ops: List[Tuple[str, str]] = field(default_factory=list)  # (" " contesto, "-" rimossa, "+" aggiunta; testo)
+
+    @property
+    def old_lines(self) -> List[str]:
+        return [text for op, text in self.ops if op != "+"]
+
+    def context_span(self) -> Tuple[int, int]:
+        """Righe di contesto all'inizio e alla fine dell'hunk"""
+        lead = 0
+        while lead < len(self.ops) and self.ops[lead][0] == " ":
+            lead += 1
+        trail = 0
+        while trail < len(self.ops) - lead and self.ops[-1 - trail][0] == " ":
+            trail += 1
+        return lead, trail
+
+
+@dataclass
+class AppliedHunk:
+    line: int          # riga (1-based) dove è stato applicato
+    offset: int        # distanza dalla posizione indicata nell'header
+    fuzzy: bool        # applicato ignorando spazi o riducendo il contesto
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """
+    Hunk di un diff unificato per un singolo file. Le intestazioni ---/+++
+    sono opzionali, così come i numeri di riga negli header @@ (un `@@`
+    da solo separa gli hunk). Le righe vuote valgono come contesto vuoto.
+    """
+    hunks: List[Hunk] = []
+    current: Optional[Hunk] = None
+    seen_file_header = False
+    # Righe ancora attese dall'hunk aperto (vecchie, nuove); None se l'header non ha i conteggi
+    remaining: Optional[List[int]] = [0, 0]
+
+    for line in diff.replace("\r\n", "\n").split("\n"):
+        # Dentro un hunk "--- x" è la rimozione della riga "-- x": è un'intestazione
+        # solo prima del primo @@ o dopo che l'hunk ha esaurito le sue righe
+        in_hunk = current is not None and (remaining is None or remaining[0] > 0 or remaining[1] > 0)
+        if not in_hunk:
+            if line.startswith("--- ") or line.startswith("+++ "):
+                if line.startswith("--- ") and seen_file_header and hunks:
+                    raise PatchError("Il diff contiene più file: usa un EDIT_FILE per ciascun file")
+                seen_file_header = True
+                continue
+            if line.startswith(("diff ", "index ")):
+                continue
+        if line.startswith("\\ "):
+            continue
+
+        header = _HUNK_HEADER.match(line)
+        if header:
+            old_start, old_count, new_start, new_count = header.groups()
+            current = Hunk(int(old_start) if old_start else None)
+            hunks.append(current)
+            if old_start and new_start:
+                # Conteggio omesso = 1 riga
+                remaining = [int(old_count or 1), int(new_count or 1)]
+            else:
+                remaining = None
+            continue
+
+        if current is None:
+            # Diff senza header @@: un unico hunk senza posizione
+            current = Hunk()
+            hunks.append(current)
+
+        if line.startswith(("-", "+")):
+            current.ops.append((line[0], line[1:]))
+        else:
+            # " contesto" oppure riga vuota (lo spazio iniziale si perde spesso)
+            current.ops.append((" ", line[1:] if line.startswith(" ") else line))
+        if remaining is not None:
+            op = current.ops[-1][0]
+            if op != "+":
+                remaining[0] -= 1
+            if op != "-":
+                remaining[1] -= 1
+
+    for hunk in hunks:
+        # Le righe vuote finali sono quasi sempre un artefatto del blocco di testo
+        while hunk.ops and hunk.ops[-1] == (" ", ""):
+            hunk.ops.pop()
+
+    hunks = [hunk for hunk in hunks if hunk.ops]
+    if not hunks:
+        raise PatchError("Il diff non contiene hunk")
+    return hunks
+
+
+def _find(lines: List[str], pattern: List[str], start: int, expected: int,
+          same: Callable[[str, str], bool]) -> Optional[int]:
+    """Posizione di `pattern` in `lines` da `start` in poi, la più vicina a `expected`"""
+    if not pattern:
+        return None
+    best = None
+    last = len(lines) - len(pattern)
+    for pos in range(start, last + 1):
+        if all(same(lines[pos + k], pattern[k]) for k in range(len(pattern))):
+            if best is None or abs(pos - expected) < abs(best - expected):
+                best = pos
+            elif pos > expected:
+                # Le posizioni successive sono solo più lontane
+                break
+    return best
+
+
+def _exact(a: str, b: str) -> bool:
+    return a == b
+
+
+def _loose(a: str, b: str) -> bool:
+    return " ".join(a.split()) == " ".join(b.split())
+
+
+def _replacement(ops: List[Tuple[str, str]], matched: List[str]) -> List[str]:
+    """Righe nuove: il contesto resta quello del file, anche se trovato ignorando gli spazi"""
+    new = []
+    i = 0
+    for op, text in ops:
+        if op == "+":
+            new.append(text)
+            continue
+        if op == " ":
+            new.append(matched[i])
+        i += 1
+    return new
+
+
+def apply_hunks(lines: List[str], hunks: List[Hunk], max_fuzz: int = 2) -> Tuple[List[str], List[AppliedHunk]]:
+    """
+    Applica tutti gli hunk in un solo passaggio e ritorna le nuove righe.
+    Per ogni hunk si cerca, nell'ordine: corrispondenza esatta, corrispondenza
+    ignorando gli spazi, poi lo stesso togliendo fino a `max_fuzz` righe di
+    contesto per lato. Se un hunk non trova posto non viene modificato nulla.
+    """
+    result = list(lines)
+    applied = []
+    offset = 0     # righe aggiunte/rimosse dagli hunk precedenti
+    min_pos = 0    # gli hunk vanno applicati in ordine, senza sovrapposizioni
+
+    for number, hunk in enumerate(hunks, 1):
+        expected = (hunk.old_start - 1 if hunk.old_start else min_pos) + offset
+        expected = max(expected, min_pos)
+
+        if not hunk.old_lines:
+            # Solo aggiunte: l'header indica la riga dopo cui inserire
+            added = [text for _, text in hunk.ops]
+            pos = hunk.old_start + offset if hunk.old_start is not None else len(result)
+            pos = min(max(pos, min_pos), len(result))
+            result[pos:pos] = added
+            applied.append(AppliedHunk(pos + 1, 0, False))
+            offset += len(added)
+            min_pos = pos + len(added)
+            continue
+
+        lead, trail = hunk.context_span()
+        match = None
+        for fuzz in range(max_fuzz + 1):
+            cut_lead, cut_trail = min(fuzz, lead), min(fuzz, trail)
+            if fuzz and not (cut_lead or cut_trail):
+                break
+            ops = hunk.ops[cut_lead:len(hunk.ops) - cut_trail]
+            old = [text for op, text in ops if op != "+"]
+            for same in (_exact, _loose):
+                pos = _find(result, old, min_pos, expected + cut_lead, same)
+                if pos is not None:
+                    match = (pos, cut_lead, ops, len(old), fuzz > 0 or same is _loose)
+                    break
+            if match:
+                break
+
+        if match is None:
+            preview = "\n".join(hunk.old_lines[:3])
+            raise PatchError(f"Hunk {number} non trovato nel file. Righe attese:\n{preview}")
+
+        pos, cut_lead, ops, old_count, fuzzy = match
+        new = _replacement(ops, result[pos:pos + old_count])
+        result[pos:pos + old_count] = new
+        original = pos - cut_lead - offset
+        applied.append(AppliedHunk(pos + 1, original - (hunk.old_start - 1) if hunk.old_start else 0, fuzzy))
+        offset += len(new) - old_count
+        min_pos = pos + len(new)
+
+    return result, applied
+
+
+def apply_unified_diff(content: str, diff: str, max_fuzz: int = 2) -> Tuple[str, List[AppliedHunk]]:
+    """Applica un diff unificato al contenuto di un file"""
+    newline = "\r\n" if "\r\n" in content else "\n"
+    lines = content.replace("\r\n", "\n").split("\n")
+    new_lines, applied = apply_hunks(lines, parse_unified_diff(diff), max_fuzz)
+    return newline.join(new_lines), applied
@@ -0,0 +1,187 @@
+"""Cache su disco delle risposte dei provider, per rieseguire sessioni identiche"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Iterator, Optional, Union
+from agent import AIProvider
+from tool_calling import ToolCalls
+
+
+class CachedProvider(AIProvider):
+    """
+    Wrapper di un AIProvider che salva le risposte su disco.
+
+    La chiave è data da provider, modello, temperature e hash della lista di
+    messaggi normalizzata. Modalità:
+      - readwrite: usa la cache se presente, altrimenti chiama il modello e salva
+      - record:    chiama sempre il modello e sovrascrive la cache
+      - replay:    usa solo la cache; una richiesta non registrata è un errore
+    Le voci meno usate di recente vengono eliminate oltre `max_size_mb`.
+    """
+
+    MODES = ("readwrite", "record", "replay")
+
+    def __init__(self, provider: AIProvider, provider_name: str, cache_dir: str,
+                 mode: str = "readwrite", max_size_mb: int = 200):
+        if mode not in self.MODES:
+            raise ValueError(f"Modalità cache sconosciuta: {mode} (valide: {', '.join(self.MODES)})")
+
+        self.provider = provider
+        self.provider_name = provider_name
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.mode = mode
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+
+    def _key(self, messages: list, tool_mode: Optional[str] = None) -> str:
+        """Hash stabile della richiesta (la modalità strumenti cambia la risposta)"""
+        normalized = [
+            {"role": m["role"], "content": m["content"].replace("\r\n", "\n").strip()}
+            for m in messages
+        ]
+        request = {
+            "provider": self.provider_name,
+            "model": getattr(self.provider, "model", None),
+            "temperature": getattr(self.provider, "temperature", None),
+            "messages": normalized,
+        }
+        if tool_mode:
+            request["tool_mode"] = tool_mode
+        data = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self) -> Iterator[str]:
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _load(self, key: str) -> Optional[Union[str, dict]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # L'mtime fa da timestamp di ultimo utilizzo per l'eviction LRU
+        os.utime(path)
+        return entry["response"]
+
+    def _store(self, key: str, response: Union[str, dict]):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "provider": self.provider_name,
+            "model": getattr(self.provider, "model", None),
+            "created": time.time(),
+            "response": response,
+        }
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+        with self._lock:
+            if os.path.exists(path):
+                self._size -= os.path.getsize(path)
+            # Scrittura atomica: un replay concorrente non legge mai un file a metà
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._size += len(data)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Elimina le voci usate meno di recente fino al 90% del limite"""
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        for path in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                continue
+
+    def _lookup(self, key: str) -> Optional[Union[str, dict]]:
+        if self.mode != "record":
+            cached = self._load(key)
+            if cached is not None:
+                self.hits += 1
+                self.last_usage = None
+                return cached
+
+        self.misses += 1
+        if self.mode == "replay":
+            raise LookupError(f"Risposta non presente in cache (replay): {key[:12]}")
+        return None
+
+    def probe(self) -> Optional[str]:
+        if self.mode == "replay":
+            return "replay dalla cache, backend non necessario"
+        return self.provider.probe()
+
+    def warmup(self):
+        if self.mode != "replay":
+            self.provider.warmup()
+
+    def chat(self, messages: list) -> str:
+        key = self._key(messages)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        response = self.provider.chat(messages)
+        self.last_usage = self.provider.last_usage
+        self._store(key, response)
+        return response
+
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        key = self._key(messages, f"{mode}:multi" if multi else mode)
+        cached = self._lookup(key)
+        if cached is not None:
+            return ToolCalls.from_dict(cached)
+
+        calls = self.provider.chat_tools(messages, mode, multi)
+        self.last_usage = self.provider.last_usage
+        # I comandi vengono salvati così come sono: il testo a tag non basta a ricostruirli
+        self._store(key, calls.to_dict())
+        return calls
+
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        key = self._key(messages)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        completed = False
+        stream = self.provider.chat_stream(messages)
+        try:
+            for token in stream:
+                chunks.append(token)
+                yield token
+            completed = True
+        except GeneratorExit:
+            # Stream interrotto dall'agente dopo il primo comando completo:
+            # il testo ricevuto è esattamente quello che l'agente ha usato
+            completed = True
+            raise
+        finally:
+            stream.close()
+            self.last_usage = self.provider.last_usage
+            if completed and chunks:
+                self._store(key, "".join(chunks))
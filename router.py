@@ -0,0 +1,364 @@
+"""Router tra più backend: bilanciamento per latenza, circuit breaker, failover"""
+
+import copy
+import time
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from config import Config
+from agent import AIProvider
+from tool_calling import ToolCalls
+
+
+def parse_backends(spec: str) -> List[dict]:
+    """
+    'ollama=http://a:11434,lmstudio=http://b:1234/v1,fallback:openai' ->
+    lista di backend per Config.router_backends. Il prefisso `fallback:`
+    indica un backend usato solo quando tutti gli altri non sono disponibili
+    """
+    backends = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        fallback = part.startswith("fallback:")
+        if fallback:
+            part = part[len("fallback:"):]
+        provider, _, base_url = part.partition("=")
+        backend = {"provider": provider, "fallback": fallback}
+        if base_url:
+            backend["base_url"] = base_url
+        backends.append(backend)
+    return backends
+
+
+@dataclass
+class Backend:
+    """Stato condiviso di un backend tra tutte le sessioni"""
+    name: str
+    provider: AIProvider
+    fallback: bool = False
+    latency: Optional[float] = None    # EWMA dei secondi per una risposta completa (chiamate non in streaming)
+    ttft: Optional[float] = None       # EWMA dei secondi al primo token (streaming)
+    in_flight: int = 0
+    failures: int = 0                  # errori consecutivi
+    open_until: float = 0.0            # circuito aperto (backend escluso) fino a questo istante
+    trial: bool = False                # half-open: una sola richiesta di prova alla volta
+    calls: int = 0
+    errors: int = 0
+
+
+class BackendPool:
+    """
+    Backend condivisi dalle sessioni dello stesso processo (batch, sessioni
+    concorrenti): latenze, richieste in corso e circuit breaker valgono per
+    tutti. Le statistiche sono protette da un lock; le chiamate no.
+    """
+
+    # Peso della nuova misura nella media mobile esponenziale
+    ALPHA = 0.3
+
+    _shared: Dict[tuple, "BackendPool"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, backends: List[Backend], failure_threshold: int = 3, cooldown: float = 30.0):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, key: tuple, factory: Callable[[], "BackendPool"]) -> "BackendPool":
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = factory()
+            return cls._shared[key]
+
+    def acquire(self, preferred: Optional[Backend], exclude: List[Backend],
+                sticky_factor: float, metric: str = "latency") -> Optional[Backend]:
+        """
+        Sceglie il backend per una richiesta e ne incrementa le richieste in
+        corso. Punteggio: latenza media x (richieste in corso + 1), con la
+        misura del tipo di chiamata (`metric`: "latency" per le risposte
+        complete, "ttft" per il primo token in streaming); i backend mai
+        misurati hanno punteggio 0 (vanno provati). Il backend della sessione
+        resta preferito finché non è più di `sticky_factor` volte peggiore del
+        migliore tra quelli misurati: un backend ancora da provare non basta
+        a spostare una sessione. I fallback si usano solo se non c'è altro.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for backend in self.backends:
+                if backend in exclude:
+                    continue
+                if backend.open_until > now:
+                    continue
+                if backend.open_until and backend.trial:
+                    # Half-open: la richiesta di prova è già in corso
+                    continue
+                candidates.append(backend)
+
+            primary = [b for b in candidates if not b.fallback]
+            candidates = primary or candidates
+            if not candidates:
+                return None
+
+            def score(backend: Backend) -> float:
+                return (getattr(backend, metric) or 0.0) * (backend.in_flight + 1)
+
+            best = min(candidates, key=score)
+            measured = [b for b in candidates if getattr(b, metric) is not None]
+            if preferred in candidates and (
+                not measured or score(preferred) <= score(min(measured, key=score)) * sticky_factor
+            ):
+                best = preferred
+
+            if best.open_until:
+                best.trial = True
+            best.in_flight += 1
+            best.calls += 1
+            return best
+
+    def release(self, backend: Backend, latency: Optional[float], error: bool, metric: str = "latency"):
+        """Registra l'esito: aggiorna la latenza (`metric`) o il circuit breaker"""
+        with self._lock:
+            backend.in_flight -= 1
+            backend.trial = False
+            if error:
+                backend.errors += 1
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold or backend.open_until:
+                    # Soglia superata, o prova fallita in half-open: circuito aperto
+                    backend.open_until = time.monotonic() + self.cooldown
+                return
+            backend.failures = 0
+            backend.open_until = 0.0
+            if latency is not None:
+                average = getattr(backend, metric)
+                if average is not None:
+                    latency = average + self.ALPHA * (latency - average)
+                setattr(backend, metric, latency)
+
+    def cancel(self, backend: Backend):
+        """
+        Richiesta finita senza esito (funzione non supportata, interruzione
+        prima della risposta): libera lo slot senza toccare il circuit breaker,
+        così un backend half-open resta da riprovare
+        """
+        with self._lock:
+            backend.in_flight -= 1
+            backend.trial = False
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "backend": b.name,
+                "latency_s": round(b.latency, 3) if b.latency is not None else None,
+                "ttft_s": round(b.ttft, 3) if b.ttft is not None else None,
+                "in_flight": b.in_flight,
+                "calls": b.calls,
+                "errors": b.errors,
+                "open": b.open_until > now,
+                "fallback": b.fallback,
+            } for b in self.backends]
+
+
+class RouterProvider(AIProvider):
+    """
+    AIProvider che distribuisce le chiamate su un pool di backend.
+
+    Ogni sessione (un RouterProvider per Agent) resta sul backend scelto
+    alla prima richiesta, così la cache KV/del prompt del backend viene
+    riutilizzata; cambia backend solo se questo fallisce, ha il circuito
+    aperto o è diventato molto più lento degli altri. Un errore passa al
+    backend successivo (in streaming solo se non è ancora arrivato nessun
+    token); dopo `failure_threshold` errori consecutivi il backend viene
+    escluso per `cooldown` secondi, poi riprovato con una sola richiesta.
+    """
+
+    # Il backend della sessione si abbandona solo se è più di 3 volte peggiore del migliore
+    STICKY_FACTOR = 3.0
+
+    def __init__(self, pool: BackendPool, sticky: bool = True, model: str = "router"):
+        self.pool = pool
+        self.sticky = sticky
+        self.current: Optional[Backend] = None
+        self.model = model
+
+    @classmethod
+    def from_config(cls, config: Config, create: Callable[[Config], AIProvider]) -> "RouterProvider":
+        """Router sui backend di `config.router_backends`, creati con `create` (es. Agent._create_provider)"""
+        if not config.router_backends:
+            raise ValueError("router_backends non configurato (es. --router ollama=http://host:11434,...)")
+
+        def build() -> BackendPool:
+            backends = []
+            for spec in config.router_backends:
+                backend_config = cls._backend_config(config, spec)
+                name = spec.get("name") or cls._backend_name(backend_config)
+                backends.append(Backend(name, create(backend_config), fallback=spec.get("fallback", False)))
+            return BackendPool(backends, config.router_failure_threshold, config.router_cooldown)
+
+        key = tuple(tuple(sorted(spec.items())) for spec in config.router_backends) + (config.model,)
+        return cls(BackendPool.shared(key, build), config.router_sticky, config.model)
+
+    @staticmethod
+    def _backend_config(config: Config, spec: dict) -> Config:
+        overrides = {"provider": spec["provider"], "model": spec.get("model", config.model)}
+        if "base_url" in spec:
+            if spec["provider"] == "ollama":
+                overrides["ollama_base_url"] = spec["base_url"]
+            elif spec["provider"] == "lmstudio":
+                overrides["lmstudio_base_url"] = spec["base_url"]
+        # I tentativi su un altro backend sostituiscono i retry del singolo provider
+        overrides["ollama_max_retries"] = 0
+        return replace(config, **overrides)
+
+    @staticmethod
+    def _backend_name(config: Config) -> str:
+        if config.provider == "ollama":
+            return f"ollama:{config.ollama_base_url}"
+        if config.provider == "lmstudio":
+            return f"lmstudio:{config.lmstudio_base_url}"
+        return config.provider
+
+    def _acquire(self, tried: List[Backend], metric: str = "latency") -> Backend:
+        backend = self.pool.acquire(self.current if self.sticky else None, tried, self.STICKY_FACTOR, metric)
+        if backend is None:
+            raise RuntimeError("Nessun backend disponibile (tutti in errore o con il circuito aperto)")
+        self.current = backend
+        return backend
+
+    def _call(self, call: Callable[[AIProvider], Any]) -> Any:
+        """Una chiamata non in streaming, con failover sugli altri backend"""
+        tried: List[Backend] = []
+        while True:
+            backend = self._acquire(tried)
+            tried.append(backend)
+            # Copia per chiamata: il provider è condiviso tra le sessioni del pool
+            # e last_usage di una sessione non deve finire in un'altra
+            provider = copy.copy(backend.provider)
+            started = time.monotonic()
+            latency = None
+            error = False
+            try:
+                response = call(provider)
+                latency = time.monotonic() - started
+            except NotImplementedError:
+                # Funzione non supportata dal backend: non è un guasto
+                raise
+            except Exception:
+                error = True
+                if self._exhausted(tried):
+                    raise
+                continue
+            finally:
+                # Anche con KeyboardInterrupt la richiesta non è più in corso
+                if error or latency is not None:
+                    self.pool.release(backend, latency, error)
+                else:
+                    self.pool.cancel(backend)
+            self.last_usage = provider.last_usage
+            return response
+
+    def chat(self, messages: list) -> str:
+        return self._call(lambda provider: provider.chat(messages))
+
+    def chat_tools(self, messages: list, mode: str, multi: bool = False) -> ToolCalls:
+        return self._call(lambda provider: provider.chat_tools(messages, mode, multi))
+
+    def chat_n(self, messages: list, n: int) -> List[str]:
+        return self._call(lambda provider: provider.chat_n(messages, n))
+
+    def chat_stream(self, messages: list) -> Iterator[str]:
+        tried: List[Backend] = []
+        while True:
+            backend = self._acquire(tried, "ttft")
+            tried.append(backend)
+            provider = copy.copy(backend.provider)
+            started = time.monotonic()
+            latency = None
+            error = False
+            stream = None
+            try:
+                stream = provider.chat_stream(messages)
+                for token in stream:
+                    if latency is None:
+                        # Il tempo al primo token non dipende dalla lunghezza della risposta
+                        latency = time.monotonic() - started
+                    yield token
+                if latency is None:
+                    # Risposta vuota ma completa
+                    latency = time.monotonic() - started
+            except GeneratorExit:
+                # Interrotto dall'agente dopo il primo comando completo: non è un errore
+                raise
+            except Exception:
+                error = True
+                if latency is not None or self._exhausted(tried):
+                    # Token già inviati all'agente: la risposta non si può ripetere altrove
+                    raise
+                continue
+            finally:
+                if stream is not None:
+                    stream.close()
+                if error:
+                    self.pool.release(backend, None, True, "ttft")
+                elif latency is not None:
+                    self.pool.release(backend, latency, False, "ttft")
+                else:
+                    # Interrotto prima del primo token: nessun esito da registrare
+                    self.pool.cancel(backend)
+                self.last_usage = provider.last_usage
+            return
+
+    def _exhausted(self, tried: List[Backend]) -> bool:
+        return len(tried) >= len(self.pool.backends)
+
+    def probe(self) -> Optional[str]:
+        """Verifica tutti i backend; errore solo se nessuno risponde"""
+        ok = []
+        errors = []
+        for backend in self.pool.backends:
+            try:
+                backend.provider.probe()
+                ok.append(backend.name)
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+        if not ok:
+            raise RuntimeError("; ".join(errors))
+        report = f"{len(ok)}/{len(self.pool.backends)} backend raggiungibili"
+        return f"{report} (non raggiungibili: {'; '.join(errors)})" if errors else report
+
+    def warmup(self):
+        """Precarica il modello su tutti i backend non di fallback, in parallelo"""
+        threads = [
+            threading.Thread(target=self._warmup_backend, args=(backend,), daemon=True)
+            for backend in self.pool.backends if not backend.fallback
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @staticmethod
+    def _warmup_backend(backend: Backend):
+        try:
+            backend.provider.warmup()
+        except Exception:
+            # Un backend spento verrà escluso dal circuit breaker alla prima richiesta
+            pass
+
+    def report(self) -> str:
+        """Stato dei backend, una riga ciascuno"""
+        lines = []
+        for s in self.pool.stats():
+            latency = f"{s['latency_s']}s" if s["latency_s"] is not None else "n/d"
+            ttft = f"{s['ttft_s']}s" if s["ttft_s"] is not None else "n/d"
+            state = "🔴 escluso" if s["open"] else "🟢"
+            role = " (fallback)" if s["fallback"] else ""
+            lines.append(f"{state} {s['backend']}{role}: latenza {latency}, primo token {ttft}, "
+                         f"{s['calls']} chiamate, {s['errors']} errori, {s['in_flight']} in corso")
+        return "\n".join(lines)
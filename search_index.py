@@ -0,0 +1,428 @@
+"""Indice persistente del contenuto dei file della workspace (trigrammi)"""
+
+import os
+import re
+import sys
+import json
+import time
+import itertools
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Directory mai indicizzate (dipendenze, VCS, cache)
+SKIP_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv",
+    ".mypy_cache", ".pytest_cache", ".tox", ".agent_index", ".agent_cache",
+    ".agent_jobs", ".agent_sessions", ".agent_batch",
+}
+
+# Caratteri con significato speciale nelle regex
+_REGEX_META = set(".^$*+?{}[]()|\\")
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrammi (case-insensitive) di un testo"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Sequenze letterali che ogni match della regex deve contenere.
+    Servono solo a restringere i file candidati: nel dubbio si ritorna [].
+    """
+    if "|" in pattern:
+        return []
+
+    literals = []
+    current = ""
+    depth = 0  # dentro un gruppo i letterali potrebbero essere opzionali
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            if nxt.isalnum():
+                # Classe (\w, \d, ...) o riferimento: interrompe il letterale
+                literals.append(current)
+                current = ""
+            elif depth == 0:
+                current += nxt
+            i += 2
+            continue
+
+        if ch in "?*{":
+            # Il carattere precedente è opzionale
+            literals.append(current[:-1])
+            current = ""
+            if ch == "{":
+                i = pattern.find("}", i) if "}" in pattern[i:] else len(pattern)
+        elif ch == "[":
+            # Classe di caratteri: si salta fino alla chiusura
+            literals.append(current)
+            current = ""
+            close = pattern.find("]", i + 2)
+            i = close if close != -1 else len(pattern)
+        elif ch in _REGEX_META:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth = max(0, depth - 1)
+            literals.append(current)
+            current = ""
+        elif depth == 0:
+            current += ch
+        i += 1
+    literals.append(current)
+
+    return [lit for lit in literals if len(lit) >= 3]
+
+
+def ordered_map(pool: Executor, func: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Come pool.map, ma con al massimo `window` task in volo: se chi consuma i
+    risultati si ferma (limite raggiunto) il lavoro restante non viene avviato.
+    I risultati arrivano nell'ordine degli item.
+    """
+    items = iter(items)
+    pending = deque(pool.submit(func, item) for item in itertools.islice(items, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(pool.submit(func, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class ContentIndex:
+    """
+    Indice invertito trigramma -> file, salvato in `.agent_index/` nella workspace.
+
+    L'indice si aggiorna in modo incrementale confrontando mtime e dimensione
+    dei file; i tool di scrittura dell'agente lo aggiornano direttamente.
+    Il confronto con il disco (una visita di tutta la workspace) non si fa a
+    ogni ricerca: solo all'apertura, dopo un comando shell o un job
+    (`mark_stale`) e comunque ogni `REFRESH_INTERVAL` secondi, per le
+    modifiche fatte da fuori (editor). Nel frattempo la ricerca controlla
+    mtime e dimensione dei file candidati: se uno è cambiato, o se non c'è
+    nessun risultato, riallinea l'indice e ripete la ricerca, così un
+    "nessun risultato" vale sempre per il contenuto attuale del disco.
+    Il file su disco è una riga di intestazione JSON (file, id, numero di id
+    per trigramma) seguita dalle posting list in binario: niente pickle, il
+    file sta nella workspace e chiunque ci lavori può riscriverlo. Un file
+    illeggibile o incoerente vale come indice vuoto.
+    Un file modificato riceve un nuovo id e quello vecchio viene scartato:
+    le posting list possono contenere id obsoleti, filtrati in ricerca, e
+    vengono ricostruite quando gli id obsoleti superano quelli validi.
+    """
+
+    VERSION = 2
+    INDEX_DIR = ".agent_index"
+    BINARY_SNIFF = 8192
+    REFRESH_INTERVAL = 30.0
+
+    def __init__(self, workspace: str, max_file_size_mb: int = 10):
+        self.workspace = os.path.abspath(workspace)
+        self.max_file_size = max_file_size_mb * 1024 * 1024
+        self.index_path = os.path.join(self.workspace, self.INDEX_DIR, "content.idx")
+
+        self.files: Dict[str, Tuple[int, int, int]] = {}  # relpath -> (id, mtime_ns, size)
+        self.paths: Dict[int, str] = {}                    # id valido -> relpath
+        self.postings: Dict[str, array] = {}               # trigramma -> id
+        self.next_id = 0
+        self.dirty = False
+        self._stale = True          # il disco può essere cambiato dall'ultimo refresh
+        self._refreshed_at = 0.0
+        self._lock = threading.RLock()
+        self._load()
+
+    # --- Persistenza ---
+
+    def _load(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                header = json.loads(f.readline())
+                payload = f.read()
+            files, postings, next_id = self._decode(header, payload)
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            # Mancante, danneggiato o di un'altra versione: si ricostruisce
+            return
+        self.files = files
+        self.postings = postings
+        self.next_id = next_id
+        self.paths = {entry[0]: path for path, entry in self.files.items()}
+
+    def _decode(self, header: dict, payload: bytes):
+        """(files, postings, next_id) dal contenuto del file; ValueError se non è coerente"""
+        if (header["version"] != self.VERSION or header["itemsize"] != array("I").itemsize
+                or header["byteorder"] != sys.byteorder):
+            raise ValueError("indice di un'altra versione o piattaforma")
+        next_id = int(header["next_id"])
+        files = {}
+        for path, (file_id, mtime_ns, size) in header["files"].items():
+            if not isinstance(path, str) or not 0 <= int(file_id) < next_id:
+                raise ValueError("voce non valida")
+            files[path] = (int(file_id), int(mtime_ns), int(size))
+
+        ids = array("I")
+        ids.frombytes(payload)
+        postings = {}
+        offset = 0
+        for gram, count in header["postings"].items():
+            if not isinstance(count, int) or count <= 0:
+                raise ValueError("posting list non valida")
+            postings[gram] = ids[offset:offset + count]
+            offset += count
+        if offset != len(ids):
+            raise ValueError("posting list troncate")
+        return files, postings, next_id
+
+    def save(self):
+        """Salva l'indice su disco (scrittura atomica)"""
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            header = {
+                "version": self.VERSION,
+                "itemsize": array("I").itemsize,
+                "byteorder": sys.byteorder,
+                "next_id": self.next_id,
+                "files": self.files,
+                "postings": {gram: len(ids) for gram, ids in self.postings.items()},
+            }
+            with open(tmp_path, "wb") as f:
+                # ensure_ascii: l'intestazione non contiene a capo e finisce alla prima riga
+                f.write(json.dumps(header, ensure_ascii=True, separators=(",", ":")).encode("ascii") + b"\n")
+                for ids in self.postings.values():
+                    ids.tofile(f)
+            os.replace(tmp_path, self.index_path)
+            self.dirty = False
+
+    # --- Aggiornamento ---
+
+    def _relpath(self, full_path: str) -> str:
+        return os.path.relpath(full_path, self.workspace).replace(os.sep, "/")
+
+    def _read_text(self, full_path: str, size: int) -> Optional[str]:
+        """Contenuto testuale del file, None se binario o troppo grande"""
+        if size > self.max_file_size:
+            return None
+        try:
+            with open(full_path, "rb") as f:
+                # Controllo binario sui primi byte, prima di leggere tutto il file
+                head = f.read(self.BINARY_SNIFF)
+                if b"\0" in head:
+                    return None
+                data = head + f.read()
+        except OSError:
+            return None
+        return data.decode("utf-8", errors="ignore")
+
+    def _forget(self, relpath: str):
+        entry = self.files.pop(relpath, None)
+        if entry is not None:
+            self.paths.pop(entry[0], None)
+            self.dirty = True
+
+    def _add(self, relpath: str, full_path: str, st: os.stat_result):
+        self._forget(relpath)
+        file_id = self.next_id
+        self.next_id += 1
+        self.files[relpath] = (file_id, st.st_mtime_ns, st.st_size)
+        self.paths[file_id] = relpath
+        self.dirty = True
+
+        text = self._read_text(full_path, st.st_size)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(file_id)
+
+    def update_file(self, full_path: str):
+        """Reindicizza un file appena scritto dall'agente"""
+        with self._lock:
+            relpath = self._relpath(full_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                self._forget(relpath)
+                return
+            self._add(relpath, full_path, st)
+
+    def remove_path(self, full_path: str):
+        """Rimuove un file o tutti i file sotto una directory"""
+        with self._lock:
+            relpath = self._relpath(full_path)
+            prefix = relpath + "/"
+            for path in [p for p in self.files if p == relpath or p.startswith(prefix)]:
+                self._forget(path)
+
+    def _walk(self):
+        """(relpath, full_path, stat) di tutti i file indicizzabili"""
+        stack = [self.workspace]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield self._relpath(entry.path), entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    def mark_stale(self):
+        """File modificati al di fuori dei tool di scrittura (comando shell, job)"""
+        self._stale = True
+
+    def refresh_if_needed(self) -> bool:
+        """Refresh solo se l'indice può non essere allineato al disco. Ritorna True se è stato fatto"""
+        if not self._stale and time.monotonic() - self._refreshed_at < self.REFRESH_INTERVAL:
+            return False
+        self.refresh()
+        return True
+
+    def refresh(self) -> int:
+        """Allinea l'indice al disco. Ritorna il numero di file reindicizzati"""
+        with self._lock:
+            self._stale = False
+            self._refreshed_at = time.monotonic()
+            seen = set()
+            updated = 0
+            for relpath, full_path, st in self._walk():
+                seen.add(relpath)
+                entry = self.files.get(relpath)
+                if entry is None or entry[1] != st.st_mtime_ns or entry[2] != st.st_size:
+                    self._add(relpath, full_path, st)
+                    updated += 1
+
+            for relpath in [p for p in self.files if p not in seen]:
+                self._forget(relpath)
+
+            if self.next_id > 2 * max(len(self.files), 1000):
+                self._rebuild()
+            return updated
+
+    def _rebuild(self):
+        """Rimuove gli id obsoleti dalle posting list"""
+        valid = self.paths
+        for gram in list(self.postings):
+            kept = array("I", (file_id for file_id in self.postings[gram] if file_id in valid))
+            if kept:
+                self.postings[gram] = kept
+            else:
+                del self.postings[gram]
+        self.dirty = True
+
+    # --- Ricerca ---
+
+    def candidates(self, pattern: str, root: str = "") -> List[str]:
+        """File che possono contenere il pattern (ordinati per path)"""
+        with self._lock:
+            ids: Optional[Set[int]] = None
+            for literal in required_literals(pattern):
+                for gram in trigrams(literal):
+                    postings = set(self.postings.get(gram, ()))
+                    ids = postings if ids is None else ids & postings
+                    if not ids:
+                        return []
+
+            if ids is None:
+                # Nessun letterale utile: tutti i file sono candidati
+                paths = list(self.files)
+            else:
+                paths = [self.paths[i] for i in ids if i in self.paths]
+
+        prefix = root.rstrip("/") + "/" if root not in ("", ".") else ""
+        return sorted(p for p in paths if p.startswith(prefix))
+
+    def _match_file(self, regex: re.Pattern, relpath: str) -> Tuple[str, List[str], List[int]]:
+        """(relpath, righe, indici delle righe che corrispondono)"""
+        full_path = os.path.join(self.workspace, relpath)
+        entry = self.files.get(relpath)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            self._stale = True
+            return relpath, [], []
+        if entry is None or entry[1] != st.st_mtime_ns or entry[2] != st.st_size:
+            # Modificato da fuori dopo l'ultimo refresh: l'indice non è più affidabile
+            self._stale = True
+        text = self._read_text(full_path, st.st_size)
+        if text is None:
+            return relpath, [], []
+        lines = text.splitlines()
+        return relpath, lines, [i for i, line in enumerate(lines) if regex.search(line)]
+
+    def search(self, pattern: str, roots: List[str], max_results: int = 50, context: int = 1,
+               max_chars: int = 8000, max_workers: int = 4) -> Tuple[List[str], int, int, int]:
+        """
+        Righe che corrispondono alla regex, con `context` righe attorno.
+        I file candidati vengono verificati in parallelo, nell'ordine dei path;
+        la verifica si ferma al raggiungimento dei limiti.
+        Ritorna (blocchi di output, match trovati, file con match, file esaminati).
+        """
+        regex = re.compile(pattern, re.IGNORECASE)
+        refreshed = self.refresh_if_needed()
+        self.save()
+        result = self._search(regex, pattern, roots, max_results, context, max_chars, max_workers)
+        if not refreshed and (self._stale or result[1] == 0):
+            # Candidati cambiati su disco o nessun risultato: si verifica sul disco attuale
+            self.refresh()
+            self.save()
+            result = self._search(regex, pattern, roots, max_results, context, max_chars, max_workers)
+        return result
+
+    def _search(self, regex: re.Pattern, pattern: str, roots: List[str], max_results: int, context: int,
+                max_chars: int, max_workers: int) -> Tuple[List[str], int, int, int]:
+        candidates = []
+        seen = set()
+        for root in roots:
+            for relpath in self.candidates(pattern, root):
+                if relpath not in seen:
+                    seen.add(relpath)
+                    candidates.append(relpath)
+
+        blocks = []
+        total_chars = 0
+        matches = 0
+        matched_files = 0
+        scanned = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = ordered_map(pool, lambda relpath: self._match_file(regex, relpath), candidates, max_workers * 2)
+            for relpath, lines, hits in results:
+                scanned += 1
+                if not hits:
+                    continue
+                matched_files += 1
+
+                for i in hits:
+                    if matches >= max_results or total_chars >= max_chars:
+                        results.close()
+                        return blocks, matches, matched_files, scanned
+                    start, end = max(0, i - context), min(len(lines), i + context + 1)
+                    block = "\n".join(
+                        f"{relpath}{':' if j == i else '-'}{j + 1}{':' if j == i else '-'} {lines[j][:300]}"
+                        for j in range(start, end)
+                    )
+                    blocks.append(block)
+                    total_chars += len(block)
+                    matches += 1
+
+        return blocks, matches, matched_files, scanned
@@ -0,0 +1,248 @@
+"""Journal delle sessioni su disco, per riprendere una conversazione dopo un riavvio"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class SessionJournal:
+    """
+    Journal append-only di una sessione, in `<sessions_dir>/<id>/`:
+      - journal.jsonl: messaggi, comandi eseguiti ed esiti, un record per riga
+      - blobs.dat:     testi lunghi (output dei tool, file), salvati una volta
+                       sola per hash e referenziati come [hash, offset, lunghezza]
+      - snapshot.json: lista dei messaggi correnti e posizione nel journal,
+                       riscritta ogni `snapshot_every` turni
+
+    I messaggi si sincronizzano per differenza: se il ContextManager ha
+    compattato la cronologia, un record `truncate` riporta la lista al primo
+    messaggio cambiato e i successivi vengono riscritti (per hash, quindi
+    senza duplicare i blob). La ripresa legge lo snapshot, la coda del
+    journal scritta dopo e solo i blob dei messaggi correnti: il tempo non
+    dipende dalla lunghezza della sessione.
+    """
+
+    JOURNAL = "journal.jsonl"
+    BLOBS = "blobs.dat"
+    SNAPSHOT = "snapshot.json"
+    # Testi più corti restano direttamente nel journal
+    INLINE_CHARS = 256
+
+    def __init__(self, sessions_dir: str, session_id: Optional[str] = None, snapshot_every: int = 20):
+        self.sessions_dir = os.path.abspath(sessions_dir)
+        self.session_id = session_id or time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.path = os.path.join(self.sessions_dir, self.session_id)
+        self.snapshot_every = snapshot_every
+        self.turns = 0
+        self._records: List[dict] = []        # record dei messaggi persistiti
+        self._blob_index: Optional[Dict[str, list]] = None
+        self._lock = threading.Lock()
+
+    # --- Apertura ---
+
+    @classmethod
+    def list_sessions(cls, sessions_dir: str) -> List[str]:
+        """Id delle sessioni salvate, dalla più vecchia alla più recente"""
+        try:
+            entries = [e for e in os.scandir(sessions_dir) if e.is_dir()]
+        except OSError:
+            return []
+        return [e.name for e in sorted(entries, key=lambda e: e.stat().st_mtime)]
+
+    @classmethod
+    def open(cls, sessions_dir: str, session_id: str, snapshot_every: int = 20) -> Tuple["SessionJournal", List[dict]]:
+        """Riapre una sessione ('last' = la più recente). Ritorna (journal, messaggi)"""
+        if session_id == "last":
+            sessions = cls.list_sessions(sessions_dir)
+            if not sessions:
+                raise FileNotFoundError(f"Nessuna sessione salvata in {sessions_dir}")
+            session_id = sessions[-1]
+
+        journal = cls(sessions_dir, session_id, snapshot_every)
+        if not os.path.exists(os.path.join(journal.path, cls.JOURNAL)):
+            raise FileNotFoundError(f"Sessione non trovata: {session_id}")
+        journal._truncate_partial_line()
+        return journal, journal._load()
+
+    def _truncate_partial_line(self):
+        """
+        Scarta l'ultima riga se incompleta (interruzione a metà scrittura):
+        altrimenti i record aggiunti dopo seguirebbero una riga non valida e
+        la lettura, che si ferma lì, li perderebbe alla ripresa successiva
+        """
+        with open(os.path.join(self.path, self.JOURNAL), "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(pos - 4096, 0)
+                f.seek(start)
+                newline = f.read(pos - start).rfind(b"\n")
+                if newline != -1:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def _load(self) -> List[dict]:
+        records: List[dict] = []
+        offset = 0
+        try:
+            with open(os.path.join(self.path, self.SNAPSHOT), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            records = snapshot["messages"]
+            offset = snapshot["journal_offset"]
+            self.turns = snapshot["turns"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        for record in self._read_journal(offset):
+            if record["t"] == "truncate":
+                del records[record["n"]:]
+            elif record["t"] == "msg":
+                records.append(record)
+            elif record["t"] == "turn":
+                self.turns = record["n"]
+
+        self._records = records
+        return [{"role": r["role"], "content": self._text(r["c"])} for r in records]
+
+    def _read_journal(self, offset: int) -> Iterator[dict]:
+        with open(os.path.join(self.path, self.JOURNAL), "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Ultima riga troncata da un'interruzione: si ignora
+                    return
+
+    # --- Blob ---
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _blobs(self) -> Dict[str, list]:
+        """Indice hash -> [hash, offset, lunghezza], ricostruito alla prima scrittura"""
+        if self._blob_index is None:
+            self._blob_index = {}
+            try:
+                for record in self._read_journal(0):
+                    if record["t"] == "blob":
+                        self._blob_index[record["ref"][0]] = record["ref"]
+            except OSError:
+                pass
+        return self._blob_index
+
+    def _ref(self, text: str, pending: List[dict]) -> Any:
+        """Testo corto inline, altrimenti riferimento al blob (scritto se nuovo)"""
+        if len(text) <= self.INLINE_CHARS:
+            return text
+        digest = self._hash(text)
+        ref = self._blobs().get(digest)
+        if ref is None:
+            data = text.encode("utf-8")
+            with open(os.path.join(self.path, self.BLOBS), "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            ref = [digest, offset, len(data)]
+            self._blob_index[digest] = ref
+            pending.append({"t": "blob", "ref": ref})
+        return ref
+
+    def _text(self, value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        _, offset, length = value
+        with open(os.path.join(self.path, self.BLOBS), "rb") as f:
+            f.seek(offset)
+            return f.read(length).decode("utf-8")
+
+    # --- Scrittura ---
+
+    def _append(self, records: List[dict]):
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(os.path.join(self.path, self.JOURNAL), "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _sync_messages(self, messages: List[dict], pending: List[dict]):
+        """Aggiunge a `pending` i record che allineano il journal ai messaggi correnti"""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+            pending.append({"t": "meta", "created": time.time()})
+
+        # Primo messaggio cambiato rispetto a quanto già salvato
+        current = [(m["role"], self._hash(m["content"])) for m in messages]
+        keep = 0
+        while (keep < len(self._records) and keep < len(current)
+               and (self._records[keep]["role"], self._records[keep]["h"]) == current[keep]):
+            keep += 1
+        if keep < len(self._records):
+            pending.append({"t": "truncate", "n": keep})
+            del self._records[keep:]
+        for message, (role, digest) in zip(messages[keep:], current[keep:]):
+            record = {"t": "msg", "role": role, "h": digest, "c": self._ref(message["content"], pending)}
+            pending.append(record)
+            self._records.append(record)
+
+    def sync(self, messages: List[dict]):
+        """Salva i messaggi correnti (nessuna scrittura se invariati)"""
+        with self._lock:
+            pending: List[dict] = []
+            self._sync_messages(messages, pending)
+            self._append(pending)
+
+    def record_turn(self, messages: List[dict], commands: List[Tuple[str, Dict[str, Any]]] = (),
+                    results: list = ()):
+        """Registra i messaggi correnti e i comandi del turno appena eseguito"""
+        with self._lock:
+            pending: List[dict] = []
+            self._sync_messages(messages, pending)
+
+            # Comandi ed esiti: cronologia completa, non riletta alla ripresa
+            self.turns += 1
+            for (command, params), (result, _) in zip(commands, results):
+                pending.append({
+                    "t": "cmd",
+                    "turn": self.turns,
+                    "command": command,
+                    "params": {
+                        key: self._ref(value, pending) if isinstance(value, str) else value
+                        for key, value in params.items()
+                    },
+                    "ok": result.success,
+                    "out": self._ref(result.error if result.error else result.output, pending),
+                })
+            pending.append({"t": "turn", "n": self.turns})
+            self._append(pending)
+
+            if self.turns % self.snapshot_every == 0:
+                self._snapshot()
+
+    def _snapshot(self):
+        """Riscrive lo snapshot dei messaggi correnti (scrittura atomica)"""
+        snapshot = {
+            "journal_offset": os.path.getsize(os.path.join(self.path, self.JOURNAL)),
+            "turns": self.turns,
+            "messages": self._records,
+        }
+        path = os.path.join(self.path, self.SNAPSHOT)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def history(self) -> Iterator[dict]:
+        """Comandi eseguiti nella sessione, con parametri ed esito (letti su richiesta)"""
+        for record in self._read_journal(0):
+            if record["t"] == "cmd":
+                record["params"] = {k: self._text(v) if isinstance(v, list) else v for k, v in record["params"].items()}
+                record["out"] = self._text(record["out"])
+                yield record
@@ -0,0 +1,163 @@
+"""Shell persistente per EXECUTE: directory, variabili e virtualenv restano tra i comandi"""
+
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from typing import Generator, Optional, Tuple
+
+
+def pump_lines(name: str, pipe, lines: queue.Queue):
+    """Legge un pipe riga per riga e mette (nome, riga) in coda; None a fine stream"""
+    try:
+        for line in pipe:
+            lines.put((name, line))
+    except (OSError, ValueError):
+        pass
+    finally:
+        lines.put((name, None))
+
+
+def kill_tree(process: subprocess.Popen):
+    """Termina il processo e i suoi figli (gruppo di processi dedicato su POSIX)"""
+    try:
+        if os.name != "nt":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+
+class ShellSession:
+    """
+    Processo bash di lunga durata collegato tramite pipe.
+
+    Ogni comando viene scritto sullo stdin della shell seguito da un sentinel
+    univoco che riporta l'exit code: le righe prima del sentinel sono l'output
+    del comando. Lo stdin del comando è /dev/null, così non può consumare i
+    comandi successivi. Al timeout la shell viene terminata e riavviata al
+    comando successivo, perdendo directory corrente e variabili.
+    """
+
+    def __init__(self, workspace: str, shell: Optional[str] = None):
+        self.workspace = os.path.abspath(workspace)
+        self.shell = shell or shutil.which("bash")
+        self.process: Optional[subprocess.Popen] = None
+        self._lines: Optional[queue.Queue] = None
+        self._token = uuid.uuid4().hex
+        self._count = 0
+
+    @staticmethod
+    def available() -> bool:
+        """La shell persistente richiede bash (non disponibile su Windows)"""
+        return os.name != "nt" and shutil.which("bash") is not None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Avvia una nuova shell nella workspace"""
+        self.process = subprocess.Popen(
+            [self.shell, "--noprofile", "--norc"],
+            cwd=self.workspace,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            start_new_session=True
+        )
+        # Coda nuova a ogni avvio: le righe di una shell terminata non si mescolano
+        self._lines = queue.Queue()
+        for name, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            threading.Thread(target=pump_lines, args=(name, pipe, self._lines), daemon=True).start()
+
+    def close(self):
+        """Termina la shell e tutti i processi avviati da essa"""
+        if self.process is None:
+            return
+        kill_tree(self.process)
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.process = None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def run(self, command: str, timeout: float) -> Generator[Tuple[str, str], None, Optional[int]]:
+        """
+        Esegue un comando e yield (stream, riga) man mano che l'output arriva.
+        Ritorna l'exit code, None in caso di timeout (la shell viene terminata).
+        """
+        if not self.alive:
+            self.start()
+
+        self._count += 1
+        marker = f"__AGENT_DONE_{self._token}_{self._count}__"
+        script = (
+            f"{{ {command}\n}} < /dev/null\n"
+            f"echo \"{marker} $?\"\n"
+            f"echo \"{marker}\" >&2\n"
+        )
+        try:
+            self.process.stdin.write(script)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # Shell terminata nel frattempo: si riparte con una nuova
+            self.restart()
+            self.process.stdin.write(script)
+            self.process.stdin.flush()
+
+        deadline = time.monotonic() + timeout
+        pending = {"stdout", "stderr"}
+        returncode = None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    name, line = self._lines.get(timeout=min(remaining, 0.1))
+                except queue.Empty:
+                    continue
+
+                if line is None:
+                    # La shell è uscita (es. `exit` nel comando)
+                    pending.discard(name)
+                    if not pending:
+                        returncode = self.process.wait()
+                    continue
+
+                line = line.rstrip("\n")
+                index = line.find(marker)
+                if index == -1:
+                    yield name, line
+                    continue
+
+                # Output senza newline finale: il sentinel segue sulla stessa riga
+                if index:
+                    yield name, line[:index]
+                pending.discard(name)
+                if name == "stdout":
+                    returncode = int(line[index + len(marker):].strip() or 0)
+        finally:
+            # Timeout o lettura interrotta: la shell è in uno stato sconosciuto
+            if pending:
+                self.close()
+
+        return returncode
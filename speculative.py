@@ -0,0 +1,184 @@
+"""
+Campionamento speculativo: più risposte candidate in parallelo, vince la
+prima con comandi validi. Una risposta malformata non costa più un intero
+turno di correzione in sequenza.
+"""
+
+import copy
+import time
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from agent import AIProvider
+from executor import StreamParser
+
+# Politiche: "always" (N candidati a ogni richiesta), "on_failure" (N solo
+# dopo una risposta senza comandi validi, finché non ne arriva una valida)
+SAMPLE_POLICIES = ("always", "on_failure")
+
+
+@dataclass
+class Candidate:
+    index: int
+    response: str = ""
+    usage: Optional[dict] = None
+    elapsed: Optional[float] = None     # secondi alla risposta completa (None se interrotta)
+    valid: bool = False
+    error: Optional[Exception] = None
+
+
+@dataclass
+class Sample:
+    """Esito di un round: la risposta scelta e cosa è successo agli altri candidati"""
+    response: str
+    usage: Optional[dict]
+    winner: Optional[int]               # indice del candidato valido (None se nessuno)
+    candidates: int
+    malformed: int                      # candidati completati senza comandi validi
+    cancelled: int                      # candidati interrotti dopo la vittoria
+    wall_s: float
+    saved_s: float                      # stima del tempo risparmiato rispetto ai tentativi in sequenza
+
+    def report(self) -> str:
+        if self.winner is None:
+            return f"🎲 {self.candidates} candidati in {self.wall_s:.1f}s: nessuno con comandi validi"
+        return (
+            f"🎲 {self.candidates} candidati in {self.wall_s:.1f}s: vince il #{self.winner + 1}, "
+            f"{self.malformed} non validi, {self.cancelled} interrotti "
+            f"(~{self.saved_s:.1f}s risparmiati rispetto ai tentativi in sequenza)"
+        )
+
+
+class SpeculativeSampler:
+    """
+    Chiede N risposte allo stesso prompt e restituisce la prima che
+    `parse` riconosce.
+
+    Se il provider supporta `chat_n` (parametro `n` di OpenAI) basta una
+    richiesta; altrimenti partono N stream in parallelo, ognuno su una copia
+    del provider (così `last_usage` non viene condiviso tra i thread). Il
+    primo candidato valido ferma gli altri: lo stream viene chiuso al token
+    successivo e il backend smette di generare. Senza multi-comando uno
+    stream si ferma da sé al primo comando completo, come in `Agent`.
+
+    Il tempo risparmiato è una stima: ogni candidato malformato completato
+    prima del vincitore avrebbe richiesto un turno in sequenza della stessa
+    durata.
+    """
+
+    def __init__(self, provider: AIProvider, parse: Callable[[str], list], samples: int,
+                 policy: str = "on_failure", multi_command: bool = False):
+        if policy not in SAMPLE_POLICIES:
+            raise ValueError(f"Politica di campionamento sconosciuta: {policy} (valide: {', '.join(SAMPLE_POLICIES)})")
+        self.provider = provider
+        self.parse = parse
+        self.samples = max(1, samples)
+        self.policy = policy
+        self.multi_command = multi_command
+        self._escalated = False
+        # Statistiche della sessione
+        self.stats = {"rounds": 0, "candidates": 0, "malformed": 0, "cancelled": 0,
+                      "wall_s": 0.0, "saved_s": 0.0}
+
+    def next_samples(self) -> int:
+        """Candidati per la prossima richiesta secondo la politica"""
+        if self.policy == "always" or self._escalated:
+            return self.samples
+        return 1
+
+    def update(self, parsed: bool):
+        """Esito del parsing dell'ultima risposta (per la politica on_failure)"""
+        self._escalated = not parsed
+
+    def sample(self, messages: list, n: Optional[int] = None) -> Sample:
+        n = n or self.samples
+        started = time.perf_counter()
+        try:
+            result = self._sample_n(messages, n, started)
+        except NotImplementedError:
+            result = self._sample_parallel(messages, n, started)
+
+        self.stats["rounds"] += 1
+        self.stats["candidates"] += result.candidates
+        self.stats["malformed"] += result.malformed
+        self.stats["cancelled"] += result.cancelled
+        self.stats["wall_s"] = round(self.stats["wall_s"] + result.wall_s, 3)
+        self.stats["saved_s"] = round(self.stats["saved_s"] + result.saved_s, 3)
+        return result
+
+    def _sample_n(self, messages: list, n: int, started: float) -> Sample:
+        """Una sola richiesta con N scelte: vince la prima valida nell'ordine restituito"""
+        responses = self.provider.chat_n(messages, n)
+        wall = time.perf_counter() - started
+        winner = next((i for i, response in enumerate(responses) if self.parse(response)), None)
+        if winner is None:
+            return Sample(responses[0], self.provider.last_usage, None, len(responses),
+                          len(responses), 0, wall, 0.0)
+        # In sequenza servivano winner + 1 richieste della stessa durata
+        return Sample(responses[winner], self.provider.last_usage, winner, len(responses),
+                      winner, 0, wall, winner * wall)
+
+    def _sample_parallel(self, messages: list, n: int, started: float) -> Sample:
+        stop = threading.Event()
+        done: "queue.Queue[Candidate]" = queue.Queue()
+        for index in range(n):
+            threading.Thread(
+                target=self._run_candidate, args=(index, messages, stop, done, started), daemon=True
+            ).start()
+
+        finished: List[Candidate] = []
+        winner: Optional[Candidate] = None
+        while len(finished) < n:
+            candidate = done.get()
+            finished.append(candidate)
+            if candidate.error is None and candidate.elapsed is not None:
+                candidate.valid = bool(self.parse(candidate.response))
+                if candidate.valid:
+                    winner = candidate
+                    break
+        # Gli stream ancora aperti si chiudono al prossimo token
+        stop.set()
+        wall = time.perf_counter() - started
+
+        completed = [c for c in finished if c.error is None and c.elapsed is not None]
+        malformed = [c for c in completed if not c.valid]
+        if winner is None:
+            if not completed:
+                raise finished[0].error
+            first = min(completed, key=lambda c: c.index)
+            return Sample(first.response, first.usage, None, n, len(malformed), 0, wall, 0.0)
+
+        cancelled = n - len(finished)
+        saved = sum(c.elapsed for c in malformed)
+        return Sample(winner.response, winner.usage, winner.index, n, len(malformed),
+                      cancelled, wall, saved)
+
+    def _run_candidate(self, index: int, messages: list, stop: threading.Event,
+                       done: "queue.Queue[Candidate]", started: float):
+        candidate = Candidate(index)
+        provider = copy.copy(self.provider)
+        parser = StreamParser()
+        response = ""
+        cancelled = False
+        try:
+            stream = provider.chat_stream(messages)
+            try:
+                for token in stream:
+                    if stop.is_set():
+                        cancelled = True
+                        break
+                    response += token
+                    if parser.feed(token) and not self.multi_command:
+                        # Comando completo: il resto della risposta non serve
+                        response = response[:parser.end_position]
+                        break
+            finally:
+                stream.close()
+            if not cancelled:
+                candidate.elapsed = time.perf_counter() - started
+            candidate.response = response
+            candidate.usage = provider.last_usage
+        except Exception as e:
+            candidate.error = e
+        done.put(candidate)
@@ -0,0 +1,113 @@
+"""Avvio rapido: Agent, health check e precaricamento del modello in background"""
+
+import time
+import threading
+from typing import Optional
+from config import Config
+from agent import Agent
+
+
+class AgentLoader:
+    """
+    Costruisce l'Agent in un thread mentre il terminale mostra il banner
+    (l'SDK viene importato solo per il provider scelto, dal suo
+    costruttore), poi verifica il backend (`probe`) e precarica il modello
+    (`warmup`): il caricamento del modello in Ollama/LM Studio avviene
+    mentre l'utente scrive il primo task, e un backend irraggiungibile
+    viene segnalato subito.
+
+    I tempi sono misurati dall'avvio del processo (o da `started`):
+      - agent_s:  Agent pronto (import dell'SDK del solo provider scelto)
+      - probe_s:  risposta dell'health check
+      - warmup_s: modello caricato
+    """
+
+    def __init__(self, config: Config, started: Optional[float] = None):
+        self.config = config
+        self.started = started if started is not None else time.perf_counter()
+        self.agent = None
+        self.error: Optional[Exception] = None       # costruzione dell'Agent fallita
+        self.probe_status: Optional[str] = None
+        self.probe_error: Optional[Exception] = None
+        self.warmup_error: Optional[Exception] = None
+        self.timings = {}
+        self._agent_ready = threading.Event()
+        self._probed = threading.Event()
+        self._warm = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="agent-loader", daemon=True)
+
+    def start(self) -> "AgentLoader":
+        self._thread.start()
+        return self
+
+    def _elapsed(self) -> float:
+        return round(time.perf_counter() - self.started, 3)
+
+    def _load(self):
+        try:
+            self.agent = Agent(self.config)
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.timings["agent_s"] = self._elapsed()
+            self._agent_ready.set()
+
+        if not self.config.prewarm:
+            self._probed.set()
+            self._warm.set()
+            return
+
+        provider = self.agent.provider
+        try:
+            with self.agent.tracer.span("startup.probe", provider=self.config.provider):
+                self.probe_status = provider.probe()
+        except Exception as e:
+            self.probe_error = e
+        finally:
+            self.timings["probe_s"] = self._elapsed()
+            self._probed.set()
+
+        if self.probe_error is None:
+            try:
+                with self.agent.tracer.span("startup.warmup", provider=self.config.provider):
+                    provider.warmup()
+            except Exception as e:
+                self.warmup_error = e
+            self.timings["warmup_s"] = self._elapsed()
+        self._warm.set()
+
+    def get_agent(self) -> Agent:
+        """Attende l'Agent; rilancia l'errore di costruzione"""
+        self._agent_ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.agent
+
+    def wait_probe(self, timeout: Optional[float] = None) -> bool:
+        """True se l'health check è concluso entro `timeout`"""
+        return self._probed.wait(timeout)
+
+    def wait_warm(self, timeout: Optional[float] = None) -> bool:
+        """True se il precaricamento è concluso entro `timeout`"""
+        return self._warm.wait(timeout)
+
+    @property
+    def warm(self) -> bool:
+        return self._warm.is_set()
+
+    def probe_report(self) -> str:
+        if not self._probed.is_set():
+            return "⏳ Backend: verifica in corso..."
+        if self.probe_error is not None:
+            return f"❌ Backend non raggiungibile: {self.probe_error}"
+        detail = f" ({self.probe_status})" if self.probe_status else ""
+        return f"✅ Backend raggiungibile in {self.timings['probe_s']}s{detail}"
+
+    def warmup_report(self) -> Optional[str]:
+        """None se il precaricamento non è stato tentato (backend irraggiungibile)"""
+        if "warmup_s" not in self.timings:
+            return None
+        if self.warmup_error is not None:
+            return f"⚠️ Precaricamento del modello fallito: {self.warmup_error}"
+        return f"🔥 Modello pronto in {self.timings['warmup_s']}s dall'avvio"
@@ -0,0 +1,274 @@
+"""
+Comandi dell'agente come strumenti nativi dei provider (function calling) o
+come output JSON vincolato da uno schema.
+
+I comandi da eseguire si costruiscono direttamente dagli argomenti
+strutturati (`to_command`): ripassarli dal testo a tag perderebbe dati
+(indentazione, a capo finali, "timeout:" dentro un comando, tag di chiusura
+nel contenuto). Il formato a tag ([READ_FILE] ...) serve solo per il testo
+della risposta salvato nella cronologia, così journal e ContextManager
+restano invariati.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Modalità: tags (solo testo), native (tools del provider), json (output vincolato da schema)
+TOOL_MODES = ("tags", "native", "json")
+
+_PATH = {"type": "string", "description": "Percorso relativo alla workspace"}
+
+# nome -> (descrizione, proprietà, obbligatori)
+TOOLS: Dict[str, Tuple[str, Dict[str, dict], List[str]]] = {
+    "CREATE_FILE": ("Crea un file (sovrascrive se esiste)", {
+        "path": _PATH,
+        "content": {"type": "string"},
+    }, ["path", "content"]),
+    "READ_FILE": ("Legge un file, per intero o in parte (usa al massimo una opzione)", {
+        "path": _PATH,
+        "lines": {"type": "string", "description": "Intervallo di righe, es. 100-200"},
+        "bytes": {"type": "string", "description": "Intervallo di byte, es. 0-4096"},
+        "head": {"type": "integer", "description": "Prime N righe"},
+        "tail": {"type": "integer", "description": "Ultime N righe"},
+        "grep": {"type": "string", "description": "Solo le righe che corrispondono alla regex"},
+    }, ["path"]),
+    "EDIT_FILE": ("Modifica un file: sostituisce old_content con new_content, oppure applica un diff unificato", {
+        "path": _PATH,
+        "old_content": {"type": "string"},
+        "new_content": {"type": "string"},
+        "diff": {"type": "string", "description": "Diff unificato con uno o più hunk @@"},
+    }, ["path"]),
+    "DELETE_FILE": ("Elimina un file", {"path": _PATH}, ["path"]),
+    "APPEND_FILE": ("Aggiunge contenuto in fondo a un file", {
+        "path": _PATH,
+        "content": {"type": "string"},
+    }, ["path", "content"]),
+    "CREATE_DIR": ("Crea una directory", {"path": _PATH}, ["path"]),
+    "LIST_DIR": ("Elenca il contenuto di una directory", {"path": _PATH}, ["path"]),
+    "DELETE_DIR": ("Elimina una directory e il suo contenuto", {"path": _PATH}, ["path"]),
+    "EXECUTE": ("Esegue un comando nella shell persistente", {
+        "command": {"type": "string"},
+        "timeout": {"type": "integer", "description": "Secondi massimi di esecuzione"},
+    }, ["command"]),
+    "RESTART_SHELL": ("Riavvia la shell persistente", {}, []),
+    "JOB_START": ("Avvia un comando lungo in background", {"command": {"type": "string"}}, ["command"]),
+    "JOB_STATUS": ("Stato di un job (o di tutti)", {"id": {"type": "integer"}}, []),
+    "JOB_TAIL": ("Ultime righe di output di un job", {
+        "id": {"type": "integer"},
+        "lines": {"type": "integer"},
+    }, ["id"]),
+    "JOB_WAIT": ("Attende la fine di un job", {
+        "id": {"type": "integer"},
+        "timeout": {"type": "integer"},
+    }, ["id"]),
+    "JOB_KILL": ("Termina un job", {"id": {"type": "integer"}}, ["id"]),
+    "SEARCH": ("Cerca file per nome o righe nel contenuto", {
+        "pattern": {"type": "string", "description": "Regex"},
+        "path": {"type": "string", "description": "Directory, anche più di una separate da virgola"},
+        "mode": {"type": "string", "enum": ["name", "content"]},
+        "max_results": {"type": "integer"},
+    }, ["pattern"]),
+    "TREE": ("Struttura ad albero di una directory", {
+        "path": _PATH,
+        "depth": {"type": "integer"},
+    }, []),
+    "RESPOND": ("Risponde all'utente senza eseguire operazioni", {"message": {"type": "string"}}, ["message"]),
+    "DONE": ("Dichiara il task completato", {"summary": {"type": "string"}}, ["summary"]),
+}
+
+# Parametri su più righe: vanno dopo "chiave:" a capo
+_MULTILINE = ("content", "old_content", "new_content", "diff")
+# Parametri del corpo libero di [RESPOND] e [DONE]
+_BODY = {"RESPOND": "message", "DONE": "summary"}
+
+
+def _parameters(name: str) -> dict:
+    _, properties, required = TOOLS[name]
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def openai_tools() -> List[dict]:
+    """Formato `tools` di OpenAI, Groq, LM Studio e Ollama"""
+    return [
+        {"type": "function", "function": {"name": name, "description": desc, "parameters": _parameters(name)}}
+        for name, (desc, _, _) in TOOLS.items()
+    ]
+
+
+def anthropic_tools() -> List[dict]:
+    return [
+        {"name": name, "description": desc, "input_schema": _parameters(name)}
+        for name, (desc, _, _) in TOOLS.items()
+    ]
+
+
+def response_schema(multi: bool = False) -> dict:
+    """Schema dell'output JSON: {"commands": [{"tool": NOME, "arguments": {...}}, ...]}"""
+    variants = [
+        {
+            "type": "object",
+            "properties": {"tool": {"const": name}, "arguments": _parameters(name)},
+            "required": ["tool", "arguments"],
+        }
+        for name in TOOLS
+    ]
+    commands = {"type": "array", "items": {"anyOf": variants}, "minItems": 1}
+    if not multi:
+        commands["maxItems"] = 1
+    return {"type": "object", "properties": {"commands": commands}, "required": ["commands"]}
+
+
+@dataclass
+class ToolCalls:
+    """Risposta di chat_tools"""
+    text: str                                                    # testo per la cronologia (formato a tag)
+    commands: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)  # comandi da eseguire
+    invalid: int = 0                                             # chiamate scartate
+
+    def to_dict(self) -> dict:
+        return {"text": self.text, "commands": [list(c) for c in self.commands], "invalid": self.invalid}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ToolCalls":
+        return cls(data["text"], [tuple(c) for c in data["commands"]], data["invalid"])
+
+
+def _arguments(name: str, arguments: Any) -> Tuple[str, Dict[str, Any]]:
+    """Nome normalizzato e argomenti validati (dict o stringa JSON)"""
+    name = name.upper()
+    if name not in TOOLS:
+        raise ValueError(f"strumento sconosciuto: {name}")
+    if isinstance(arguments, str):
+        arguments = json.loads(arguments) if arguments.strip() else {}
+    if not isinstance(arguments, dict):
+        raise ValueError(f"argomenti non validi per {name}")
+    # Un contenuto vuoto è valido (es. new_content per cancellare), un path vuoto no
+    arguments = {
+        key: value for key, value in arguments.items()
+        if value is not None and (value != "" or key in _MULTILINE)
+    }
+    missing = [key for key in TOOLS[name][2] if key not in arguments]
+    if missing:
+        raise ValueError(f"{name}: parametri mancanti {', '.join(missing)}")
+    if name == "EDIT_FILE" and "diff" not in arguments and "old_content" not in arguments:
+        raise ValueError("EDIT_FILE: servono old_content/new_content oppure diff")
+    return name, arguments
+
+
+def to_command(name: str, arguments: Any) -> Tuple[str, Dict[str, Any]]:
+    """
+    Comando (nome, parametri) con gli stessi parametri di CommandParser.build,
+    presi dagli argomenti senza modificarne il testo
+    """
+    name, args = _arguments(name, arguments)
+    text = lambda key, default=None: str(args[key]) if key in args else default
+    number = lambda key, default=None: int(args[key]) if key in args else default
+
+    if name in ("CREATE_FILE", "APPEND_FILE"):
+        return name, {"path": text("path").strip(), "content": text("content")}
+    if name == "READ_FILE":
+        params = {"path": text("path").strip()}
+        # CommandParser accetta una sola opzione di lettura parziale
+        for key in ("lines", "bytes", "head", "tail", "grep"):
+            if key in args:
+                params[key] = text(key)
+                break
+        return name, params
+    if name == "EDIT_FILE":
+        if "diff" in args:
+            return name, {"path": text("path").strip(), "diff": text("diff")}
+        return name, {"path": text("path").strip(), "old_content": text("old_content"),
+                      "new_content": text("new_content", "")}
+    if name in ("DELETE_FILE", "CREATE_DIR", "LIST_DIR", "DELETE_DIR"):
+        return name, {"path": text("path").strip()}
+    if name == "EXECUTE":
+        params = {"command": text("command")}
+        if "timeout" in args:
+            params["timeout"] = number("timeout")
+        return name, params
+    if name == "RESTART_SHELL":
+        return name, {}
+    if name == "JOB_START":
+        return name, {"command": text("command")}
+    if name == "JOB_STATUS":
+        return name, {"id": number("id")}
+    if name == "JOB_TAIL":
+        return name, {"id": number("id"), "lines": number("lines", 50)}
+    if name == "JOB_WAIT":
+        params = {"id": number("id")}
+        if "timeout" in args:
+            params["timeout"] = number("timeout")
+        return name, params
+    if name == "JOB_KILL":
+        return name, {"id": number("id")}
+    if name == "SEARCH":
+        mode = text("mode", "name").lower()
+        if mode not in ("name", "content"):
+            raise ValueError(f"SEARCH: mode non valido {mode}")
+        return name, {"pattern": text("pattern"), "path": text("path", "."), "mode": mode,
+                      "max_results": number("max_results")}
+    if name == "TREE":
+        return name, {"path": text("path", ".").strip(), "depth": number("depth", 3)}
+    if name == "RESPOND":
+        return name, {"message": text("message")}
+    return name, {"summary": text("summary")}
+
+
+def render_call(name: str, arguments: Any) -> str:
+    """Una chiamata (argomenti come dict o stringa JSON) nel formato a tag"""
+    name, arguments = _arguments(name, arguments)
+
+    keys = list(TOOLS[name][1])
+    if name == "READ_FILE":
+        # CommandParser accetta una sola opzione di lettura parziale
+        keys = ["path"] + [k for k in keys[1:] if k in arguments][:1]
+    elif name == "EDIT_FILE":
+        if "diff" in arguments:
+            keys = ["path", "diff"]
+        else:
+            keys = ["path", "old_content", "new_content"]
+            arguments.setdefault("new_content", "")
+
+    if name in _BODY:
+        body = str(arguments[_BODY[name]])
+    else:
+        lines = []
+        # Ordine dello schema, che è quello atteso dai pattern di CommandParser
+        for key in keys:
+            if key not in arguments:
+                continue
+            if key in _MULTILINE:
+                lines.append(f"{key}:\n{arguments[key]}")
+            else:
+                lines.append(f"{key}: {arguments[key]}")
+        body = "\n".join(lines)
+    return f"[{name}]\n{body}\n[/{name}]" if body else f"[{name}]\n[/{name}]"
+
+
+def render_calls(calls: Iterable[Tuple[str, Any]], text: Optional[str] = None) -> ToolCalls:
+    """Comandi delle chiamate valide e testo della risposta seguito dalle chiamate nel formato a tag"""
+    result = ToolCalls("")
+    parts = [text.strip()] if text and text.strip() else []
+    for name, arguments in calls:
+        try:
+            command = to_command(name, arguments)
+            parts.append(render_call(name, arguments))
+        except (ValueError, TypeError):
+            result.invalid += 1
+            continue
+        result.commands.append(command)
+    result.text = "\n".join(parts)
+    return result
+
+
+def render_json(content: str) -> ToolCalls:
+    """Output JSON vincolato ({"commands": [...]}) come comandi e testo a tag"""
+    try:
+        data = json.loads(content)
+        commands = data["commands"] if isinstance(data, dict) else data
+        calls = [(c["tool"], c.get("arguments", {})) for c in commands]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # JSON non valido: il testo passa comunque al parser dei tag
+        return ToolCalls(content, [], 1)
+    return render_calls(calls)
@@ -2,11 +2,25 @@
 
 import os
 import re
+import mmap
+import time
+import queue
+import bisect
+import threading
 import subprocess
 import shutil
+from array import array
+from collections import deque
 from pathlib import Path
-from typing import Tuple, Optional
+import tempfile
+from typing import Generator, List, Tuple, Optional
 from dataclasses import dataclass
+from search_index import ContentIndex
+from patch import PatchError, apply_unified_diff
+from parallel_search import NameSearch, normalize_roots
+from fs_snapshot import DirectoryCache, IgnoreRules, ResultCache
+from shell import ShellSession, pump_lines, kill_tree
+from jobs import JobManager
 
 @dataclass
 class ToolResult:
@@ -14,11 +28,99 @@ class ToolResult:
     output: str
     error: Optional[str] = None
 
+def _read_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Permessi dei file nuovi creati con scrittura atomica (letta una volta sola: os.umask non è thread-safe)
+_UMASK = _read_umask()
+
+
+class LineIndex:
+    """
+    Indice delle righe di un file, per blocchi: per ogni blocco di BLOCK_SIZE
+    byte conserva il numero di righe che lo precedono. Occupa pochi KB anche
+    per file di GB; la riga esatta si trova scandendo un solo blocco.
+    """
+    
+    BLOCK_SIZE = 1024 * 1024
+    
+    def __init__(self, mm: mmap.mmap):
+        self.size = len(mm)
+        self.block_lines = array('Q')  # newline prima dell'inizio di ogni blocco
+        count = 0
+        for start in range(0, self.size, self.BLOCK_SIZE):
+            self.block_lines.append(count)
+            count += mm[start:start + self.BLOCK_SIZE].count(b'\n')
+        # Un'ultima riga senza newline finale conta comunque
+        ends_with_newline = self.size > 0 and mm[self.size - 1:self.size] == b'\n'
+        self.line_count = count if ends_with_newline or self.size == 0 else count + 1
+    
+    def offset(self, mm: mmap.mmap, line: int) -> int:
+        """Offset in byte dell'inizio della riga (1-based)"""
+        if line <= 1:
+            return 0
+        if line > self.line_count:
+            return self.size
+        
+        # Blocco che contiene il (line-1)-esimo newline
+        target = line - 1
+        block = bisect.bisect_left(self.block_lines, target) - 1
+        pos = block * self.BLOCK_SIZE
+        for _ in range(target - self.block_lines[block]):
+            pos = mm.find(b'\n', pos) + 1
+        return pos
+
+
 class FileTools:
-    def __init__(self, workspace: str, safe_mode: bool = True, max_size_mb: int = 10):
+    # Caratteri massimi restituiti da una lettura parziale
+    MAX_RANGE_CHARS = 100_000
+    # Righe massime restituite da una lettura con grep
+    MAX_GREP_LINES = 200
+    # Elementi massimi mostrati per directory e in tutto l'albero di TREE
+    DIR_MAX_ENTRIES = 200
+    TREE_MAX_ENTRIES = 1000
+    # Risultati massimi di SEARCH se non indicato nel comando
+    SEARCH_MAX_RESULTS = 100
+    
+    def __init__(self, workspace: str, safe_mode: bool = True, max_size_mb: int = 10, search_workers: int = 4):
         self.workspace = os.path.abspath(workspace)
         self.safe_mode = safe_mode
         self.max_size_mb = max_size_mb
+        self.search_workers = search_workers
+        self._index = None
+        self._line_indexes = {}  # full_path -> (mtime_ns, size, LineIndex)
+        self.listings = DirectoryCache()
+        # Risultati delle letture già inviati al modello (deduplicati da CommandExecutor)
+        self.results = ResultCache()
+        self.ignore = IgnoreRules(self.workspace)
+    
+    @property
+    def index(self) -> ContentIndex:
+        """Indice del contenuto, caricato alla prima ricerca"""
+        if self._index is None:
+            self._index = ContentIndex(self.workspace, self.max_size_mb)
+        return self._index
+    
+    def _touch(self, full_path: str, removed: bool = False):
+        """Aggiorna l'indice e le cache delle directory e dei risultati dopo una scrittura dell'agente"""
+        self.listings.invalidate(full_path)
+        self.results.invalidate(full_path)
+        if self._index is None:
+            # Non ancora caricato: verrà allineato via mtime alla prossima ricerca
+            return
+        if removed:
+            self._index.remove_path(full_path)
+        else:
+            self._index.update_file(full_path)
+    
+    def external_change(self):
+        """Un comando shell o un job può modificare qualunque file: cache delle directory e indice non più affidabili"""
+        self.listings.clear()
+        if self._index is not None:
+            self._index.mark_stale()
     
     def _resolve_path(self, path: str) -> str:
         """Risolve il path relativo alla workspace"""
@@ -39,22 +141,31 @@ class FileTools:
             full_path = self._resolve_path(path)
             os.makedirs(os.path.dirname(full_path), exist_ok=True)
             
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            self._write_atomic(full_path, content)
+            self._touch(full_path)
             
             return ToolResult(True, f"✅ File creato: {path}")
         except Exception as e:
             return ToolResult(False, "", str(e))
     
-    def read_file(self, path: str) -> ToolResult:
-        """Legge un file"""
+    def read_file(self, path: str, lines: Optional[str] = None, byte_range: Optional[str] = None,
+                  head: Optional[int] = None, tail: Optional[int] = None,
+                  grep: Optional[str] = None) -> ToolResult:
+        """Legge un file, per intero o solo una parte (righe, byte, head, tail, grep)"""
         try:
             full_path = self._resolve_path(path)
             
+            if any(opt is not None for opt in (lines, byte_range, head, tail, grep)):
+                return self._read_partial(path, full_path, lines, byte_range, head, tail, grep)
+            
             # Check dimensione
             size_mb = os.path.getsize(full_path) / (1024 * 1024)
             if size_mb > self.max_size_mb:
-                return ToolResult(False, "", f"File troppo grande: {size_mb:.2f}MB")
+                return ToolResult(
+                    False, "",
+                    f"File troppo grande: {size_mb:.2f}MB "
+                    "(usa lines, bytes, head, tail o grep per leggerne una parte)"
+                )
             
             with open(full_path, 'r', encoding='utf-8') as f:
                 content = f.read()
@@ -63,6 +174,101 @@ class FileTools:
         except Exception as e:
             return ToolResult(False, "", str(e))
     
+    def _line_index(self, full_path: str, mm: mmap.mmap) -> LineIndex:
+        """Indice delle righe, ricalcolato solo se il file è cambiato"""
+        st = os.stat(full_path)
+        cached = self._line_indexes.get(full_path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        index = LineIndex(mm)
+        self._line_indexes[full_path] = (st.st_mtime_ns, st.st_size, index)
+        return index
+    
+    @staticmethod
+    def _parse_range(value: str, default_end: int, default_start: int = 1) -> Tuple[int, int]:
+        """
+        'a-b', 'a-', '-b' o 'a' -> (a, b) inclusivi. Le righe partono da 1, i byte da 0:
+
+        >>> FileTools._parse_range('-9', 99, default_start=0)
+        (0, 9)
+        >>> FileTools._parse_range('5-', 99)
+        (5, 99)
+        """
+        start, sep, end = value.partition('-')
+        start = int(start) if start.strip() else default_start
+        if not sep:
+            return start, start
+        return start, int(end) if end.strip() else default_end
+    
+    def _read_partial(self, path: str, full_path: str, lines: Optional[str], byte_range: Optional[str],
+                      head: Optional[int], tail: Optional[int], grep: Optional[str]) -> ToolResult:
+        """Lettura parziale tramite memory-mapping: la memoria usata non dipende dalla dimensione del file"""
+        if os.path.getsize(full_path) == 0:
+            return ToolResult(True, f"📄 {path} è vuoto")
+        
+        with open(full_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if grep is not None:
+                return self._grep_mapped(path, mm, grep)
+            
+            if byte_range is not None:
+                start, end = self._parse_range(byte_range, len(mm) - 1, default_start=0)
+                data = mm[max(start, 0):min(end + 1, len(mm))]
+                header = f"📄 {path} byte {start}-{min(end, len(mm) - 1)} di {len(mm)}"
+            else:
+                index = self._line_index(full_path, mm)
+                total = index.line_count
+                if head is not None:
+                    start, end = 1, int(head)
+                elif tail is not None:
+                    start, end = max(total - int(tail) + 1, 1), total
+                else:
+                    start, end = self._parse_range(lines, total)
+                end = min(end, total)
+                if start > end:
+                    return ToolResult(False, "", f"Intervallo di righe non valido: il file ha {total} righe")
+                data = mm[index.offset(mm, start):index.offset(mm, end + 1)]
+                header = f"📄 {path} righe {start}-{end} di {total}"
+        
+        content = data.decode('utf-8', errors='replace')
+        if len(content) > self.MAX_RANGE_CHARS:
+            content = content[:self.MAX_RANGE_CHARS]
+            header += f" (troncato a {self.MAX_RANGE_CHARS} caratteri)"
+        return ToolResult(True, f"{header}:\n```\n{content.rstrip(chr(10))}\n```")
+    
+    def _grep_mapped(self, path: str, mm: mmap.mmap, pattern: str) -> ToolResult:
+        """Righe che corrispondono al pattern, con numero di riga"""
+        regex = re.compile(pattern.encode('utf-8'), re.IGNORECASE | re.MULTILINE)
+        found = []
+        chars = 0
+        line_no = 1
+        counted_to = 0  # newline contati fino a questo offset
+        pos = 0
+        
+        while pos <= len(mm) and len(found) < self.MAX_GREP_LINES and chars < self.MAX_RANGE_CHARS:
+            match = regex.search(mm, pos)
+            if not match:
+                break
+            line_start = mm.rfind(b'\n', 0, match.start()) + 1
+            line_end = mm.find(b'\n', match.start())
+            if line_end == -1:
+                line_end = len(mm)
+            
+            line_no += mm[counted_to:line_start].count(b'\n')
+            counted_to = line_start
+            text = mm[line_start:line_end].decode('utf-8', errors='replace')[:500]
+            found.append(f"{line_no}: {text}")
+            chars += len(text)
+            # Una sola occorrenza per riga
+            pos = line_end + 1
+        
+        if not found:
+            return ToolResult(True, f"🔍 Nessuna riga di {path} corrisponde a '{pattern}'")
+        
+        header = f"🔍 Righe di {path} che corrispondono a '{pattern}' ({len(found)} risultati"
+        if len(found) >= self.MAX_GREP_LINES or chars >= self.MAX_RANGE_CHARS:
+            header += ", elenco troncato"
+        return ToolResult(True, header + "):\n" + "\n".join(found))
+    
     def edit_file(self, path: str, old_content: str, new_content: str) -> ToolResult:
         """Modifica un file sostituendo contenuto"""
         try:
@@ -76,13 +282,69 @@ class FileTools:
             
             new_file_content = content.replace(old_content, new_content, 1)
             
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(new_file_content)
+            self._write_atomic(full_path, new_file_content)
+            self._touch(full_path)
             
             return ToolResult(True, f"✏️ File modificato: {path}")
         except Exception as e:
             return ToolResult(False, "", str(e))
     
+    def apply_diff(self, path: str, diff: str) -> ToolResult:
+        """Modifica un file applicando un diff unificato (tutti gli hunk o nessuno)"""
+        try:
+            full_path = self._resolve_path(path)
+            
+            with open(full_path, 'r', encoding='utf-8', newline='') as f:
+                content = f.read()
+            
+            new_file_content, applied = apply_unified_diff(content, diff)
+            # newline='' in lettura e scrittura: le terminazioni di riga restano quelle del file
+            self._write_atomic(full_path, new_file_content, newline='')
+            self._touch(full_path)
+            
+            output = f"✏️ File modificato: {path} ({len(applied)} hunk applicati)"
+            notes = [
+                f"  ⚠️ hunk {i} alla riga {hunk.line}: contesto approssimato"
+                for i, hunk in enumerate(applied, 1) if hunk.fuzzy
+            ]
+            notes += [
+                f"  ↕️ hunk {i} alla riga {hunk.line} (spostato di {hunk.offset:+d} righe)"
+                for i, hunk in enumerate(applied, 1) if hunk.offset and not hunk.fuzzy
+            ]
+            if notes:
+                output += "\n" + "\n".join(notes)
+            return ToolResult(True, output)
+        except PatchError as e:
+            return ToolResult(False, "", f"{e}\nNessuna modifica applicata: rileggi il file e rigenera il diff")
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    @staticmethod
+    def _write_atomic(full_path: str, content: str, newline: Optional[str] = None):
+        """
+        Scrive su un file temporaneo nella stessa directory e lo rinomina sul
+        file finale: un'interruzione a metà non lascia mai un file troncato
+        """
+        directory = os.path.dirname(full_path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(full_path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline=newline) as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                # mkstemp crea il file con permessi 0600: si mantengono quelli originali
+                os.chmod(tmp_path, os.stat(full_path).st_mode & 0o7777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o666 & ~_UMASK)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
     def append_file(self, path: str, content: str) -> ToolResult:
         """Aggiunge contenuto a un file"""
         try:
@@ -90,6 +352,7 @@ class FileTools:
             
             with open(full_path, 'a', encoding='utf-8') as f:
                 f.write(content)
+            self._touch(full_path)
             
             return ToolResult(True, f"➕ Contenuto aggiunto a: {path}")
         except Exception as e:
@@ -100,6 +363,7 @@ class FileTools:
         try:
             full_path = self._resolve_path(path)
             os.remove(full_path)
+            self._touch(full_path, removed=True)
             return ToolResult(True, f"🗑️ File eliminato: {path}")
         except Exception as e:
             return ToolResult(False, "", str(e))
@@ -109,6 +373,8 @@ class FileTools:
         try:
             full_path = self._resolve_path(path)
             os.makedirs(full_path, exist_ok=True)
+            self.listings.invalidate(full_path)
+            self.results.invalidate(full_path)
             return ToolResult(True, f"📁 Directory creata: {path}")
         except Exception as e:
             return ToolResult(False, "", str(e))
@@ -117,21 +383,21 @@ class FileTools:
         """Lista contenuto directory"""
         try:
             full_path = self._resolve_path(path)
-            items = os.listdir(full_path)
+            entries = self.listings.entries(full_path)
             
-            output = f"📂 Contenuto di {path}:\n"
-            for item in sorted(items):
-                item_path = os.path.join(full_path, item)
-                if os.path.isdir(item_path):
-                    output += f"  📁 {item}/\n"
+            lines = [f"📂 Contenuto di {path}:"]
+            for entry in entries[:self.DIR_MAX_ENTRIES]:
+                if self.listings.is_dir(entry):
+                    lines.append(f"  📁 {entry.name}/")
                 else:
-                    size = os.path.getsize(item_path)
-                    output += f"  📄 {item} ({size} bytes)\n"
+                    lines.append(f"  📄 {entry.name} ({self.listings.size(entry)} bytes)")
             
-            if not items:
-                output += "  (vuota)\n"
+            if not entries:
+                lines.append("  (vuota)")
+            elif len(entries) > self.DIR_MAX_ENTRIES:
+                lines.append(f"  … e altri {len(entries) - self.DIR_MAX_ENTRIES} elementi")
             
-            return ToolResult(True, output)
+            return ToolResult(True, "\n".join(lines) + "\n")
         except Exception as e:
             return ToolResult(False, "", str(e))
     
@@ -140,6 +406,7 @@ class FileTools:
         try:
             full_path = self._resolve_path(path)
             shutil.rmtree(full_path)
+            self._touch(full_path, removed=True)
             return ToolResult(True, f"🗑️ Directory eliminata: {path}")
         except Exception as e:
             return ToolResult(False, "", str(e))
@@ -148,63 +415,168 @@ class FileTools:
         """Mostra albero directory"""
         try:
             full_path = self._resolve_path(path)
-            output = self._tree_recursive(full_path, "", depth)
+            relpath = os.path.relpath(full_path, self.workspace).replace(os.sep, "/")
+            self.ignore.reload()
+            lines = []
+            omitted = self._tree_recursive(full_path, "" if relpath == "." else relpath + "/", "", depth, lines)
+            if omitted:
+                lines.append(f"… albero troncato: {omitted} elementi non mostrati (limite {self.TREE_MAX_ENTRIES}), usa un path o una depth più specifici")
+            output = "\n".join(lines) + "\n" if lines else ""
             return ToolResult(True, f"🌳 Struttura di {path}:\n{output}")
         except Exception as e:
             return ToolResult(False, "", str(e))
     
-    def _tree_recursive(self, path: str, prefix: str, depth: int) -> str:
+    def _tree_recursive(self, path: str, relprefix: str, prefix: str, depth: int, lines: List[str]) -> int:
+        """
+        Aggiunge le righe dell'albero a `lines`; ritorna gli elementi omessi per il limite globale.
+        `relprefix` è il path di `path` relativo alla workspace, con / finale
+        """
         if depth < 0:
-            return ""
+            return 0
         
-        output = ""
         try:
-            items = sorted(os.listdir(path))
+            entries = self.listings.filtered(path, relprefix, self.ignore)
         except PermissionError:
-            return prefix + "  [Permission Denied]\n"
+            lines.append(prefix + "  [Permission Denied]")
+            return 0
         
-        for i, item in enumerate(items):
-            is_last = i == len(items) - 1
+        visible = []
+        for entry, ignored in entries:
+            is_dir = entry.is_dir
+            if ignored:
+                # Le directory ignorate (node_modules, .git, ...) si mostrano chiuse
+                if is_dir:
+                    visible.append((entry, is_dir, False))
+                continue
+            visible.append((entry, is_dir, True))
+        
+        hidden = max(len(visible) - self.DIR_MAX_ENTRIES, 0)
+        visible = visible[:self.DIR_MAX_ENTRIES]
+        omitted = 0
+        for i, (entry, is_dir, expand) in enumerate(visible):
+            if len(lines) >= self.TREE_MAX_ENTRIES:
+                return omitted + len(visible) - i + hidden
+            
+            is_last = i == len(visible) - 1 and not hidden
             current_prefix = "└── " if is_last else "├── "
-            item_path = os.path.join(path, item)
             
-            if os.path.isdir(item_path):
-                output += f"{prefix}{current_prefix}📁 {item}/\n"
+            if is_dir and expand:
+                lines.append(f"{prefix}{current_prefix}📁 {entry.name}/")
                 next_prefix = prefix + ("    " if is_last else "│   ")
-                output += self._tree_recursive(item_path, next_prefix, depth - 1)
+                omitted += self._tree_recursive(entry.path, f"{relprefix}{entry.name}/", next_prefix, depth - 1, lines)
+            elif is_dir:
+                lines.append(f"{prefix}{current_prefix}📁 {entry.name}/ (ignorata)")
             else:
-                output += f"{prefix}{current_prefix}📄 {item}\n"
+                lines.append(f"{prefix}{current_prefix}📄 {entry.name}")
         
-        return output
+        if hidden:
+            lines.append(f"{prefix}└── … e altri {hidden} elementi")
+        return omitted
     
-    def search(self, pattern: str, path: str = ".") -> ToolResult:
-        """Cerca file per pattern"""
+    def search(self, pattern: str, path: str = ".", mode: str = "name",
+               max_results: Optional[int] = None) -> ToolResult:
+        """
+        Cerca file per nome (mode=name) o righe per contenuto (mode=content).
+        `path` può contenere più radici separate da virgola.
+        """
+        max_results = max_results or self.SEARCH_MAX_RESULTS
+        started = time.perf_counter()
         try:
-            full_path = self._resolve_path(path)
-            matches = []
+            # Radici sovrapposte ("src,.") verrebbero esaminate due volte
+            roots = normalize_roots([self._resolve_path(p.strip()) for p in path.split(",") if p.strip()]) or [self.workspace]
+            if mode == "content":
+                return self._search_content(pattern, roots, max_results, started)
             
-            for root, dirs, files in os.walk(full_path):
-                for file in files:
-                    if re.search(pattern, file, re.IGNORECASE):
-                        rel_path = os.path.relpath(os.path.join(root, file), full_path)
-                        matches.append(rel_path)
+            matches = []
+            seen = set()
+            scanned = 0
+            for found, count in NameSearch(self.workspace, self.search_workers).search(pattern, roots, max_results):
+                scanned += count
+                found = [m for m in found if m not in seen]
+                seen.update(found)
+                matches.extend(found[:max_results - len(matches)])
+                if len(matches) >= max_results:
+                    break
+            stats = self._search_stats(scanned, started)
             
-            if matches:
-                output = f"🔍 File trovati per '{pattern}':\n"
-                for m in matches:
-                    output += f"  📄 {m}\n"
-            else:
-                output = f"🔍 Nessun file trovato per '{pattern}'"
+            if not matches:
+                return ToolResult(True, f"🔍 Nessun file trovato per '{pattern}' ({stats})")
             
-            return ToolResult(True, output)
+            lines = [f"🔍 File trovati per '{pattern}' ({stats}):"]
+            lines.extend(f"  📄 {m}" for m in matches)
+            if len(matches) >= max_results:
+                lines.append(f"  … limite di {max_results} risultati raggiunto, restringi il pattern o il path")
+            return ToolResult(True, "\n".join(lines) + "\n")
         except Exception as e:
             return ToolResult(False, "", str(e))
+    
+    def _search_content(self, pattern: str, roots: List[str], max_results: int, started: float) -> ToolResult:
+        """Cerca righe nel contenuto dei file usando l'indice persistente"""
+        relroots = [os.path.relpath(root, self.workspace).replace(os.sep, "/") for root in roots]
+        blocks, matches, files, scanned = self.index.search(
+            pattern, relroots, max_results=max_results, max_workers=self.search_workers
+        )
+        stats = self._search_stats(scanned, started)
+        
+        if not blocks:
+            return ToolResult(True, f"🔍 Nessuna riga trovata per '{pattern}' ({stats})")
+        
+        output = f"🔍 Righe trovate per '{pattern}' ({matches} risultati in {files} file, {stats}):\n"
+        output += "\n--\n".join(blocks)
+        return ToolResult(True, output)
+    
+    @staticmethod
+    def _search_stats(scanned: int, started: float) -> str:
+        return f"{scanned} file esaminati in {time.perf_counter() - started:.2f}s"
+
+
+class OutputBuffer:
+    """
+    Conserva le prime `head_lines` e le ultime `tail_lines` righe di un output:
+    la memoria resta limitata anche per comandi molto verbosi.
+    """
+    
+    def __init__(self, head_lines: int = 100, tail_lines: int = 200, max_line_chars: int = 2000):
+        self.head_lines = head_lines
+        self.max_line_chars = max_line_chars
+        self.head = []
+        self.tail = deque(maxlen=tail_lines)
+        self.dropped = 0
+    
+    def add(self, line: str):
+        if len(line) > self.max_line_chars:
+            line = line[:self.max_line_chars] + "…"
+        if len(self.head) < self.head_lines:
+            self.head.append(line)
+            return
+        if len(self.tail) == self.tail.maxlen:
+            self.dropped += 1
+        self.tail.append(line)
+    
+    def text(self) -> str:
+        lines = list(self.head)
+        if self.dropped:
+            lines.append(f"... [{self.dropped} righe omesse] ...")
+        lines.extend(self.tail)
+        return "\n".join(lines)
+    
+    def __bool__(self) -> bool:
+        return bool(self.head)
 
 
 class SystemTools:
-    def __init__(self, workspace: str, safe_mode: bool = True):
+    # Righe conservate all'inizio e alla fine dell'output di un comando
+    OUTPUT_HEAD_LINES = 100
+    OUTPUT_TAIL_LINES = 200
+    
+    def __init__(self, workspace: str, safe_mode: bool = True, default_timeout: int = 30,
+                 persistent_shell: bool = False):
         self.workspace = os.path.abspath(workspace)
         self.safe_mode = safe_mode
+        self.default_timeout = default_timeout
+        # Senza bash (es. Windows) ogni comando usa una shell nuova
+        self.shell = ShellSession(self.workspace) if persistent_shell and ShellSession.available() else None
+        self.jobs = JobManager(self.workspace)
         
         # Comandi pericolosi che richiedono conferma
         self.dangerous_patterns = [
@@ -225,30 +597,174 @@ class SystemTools:
                 return True
         return False
     
-    def execute(self, command: str, timeout: int = 30) -> ToolResult:
+    def execute(self, command: str, timeout: Optional[int] = None) -> ToolResult:
         """Esegue un comando shell"""
+        stream = self.execute_stream(command, timeout)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
+    
+    def execute_stream(self, command: str, timeout: Optional[int] = None) -> Generator[str, None, ToolResult]:
+        """
+        Esegue un comando shell e yield le righe di output man mano che arrivano.
+        Ritorna il ToolResult finale; in caso di timeout conserva l'output parziale.
+        """
+        timeout = timeout or self.default_timeout
+        buffers = {
+            'stdout': OutputBuffer(self.OUTPUT_HEAD_LINES, self.OUTPUT_TAIL_LINES),
+            'stderr': OutputBuffer(self.OUTPUT_HEAD_LINES, self.OUTPUT_TAIL_LINES),
+        }
+        if self.shell is not None:
+            lines = self.shell.run(command, timeout)
+        else:
+            lines = self._run_process(command, timeout)
+        
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=self.workspace,
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
-            
-            output = ""
-            if result.stdout:
-                output += f"📤 Output:\n{result.stdout}\n"
-            if result.stderr:
-                output += f"⚠️ Stderr:\n{result.stderr}\n"
-            if result.returncode != 0:
-                output += f"❌ Exit code: {result.returncode}"
-            else:
-                output += f"✅ Comando completato"
-            
-            return ToolResult(result.returncode == 0, output)
-        except subprocess.TimeoutExpired:
-            return ToolResult(False, "", f"Timeout dopo {timeout} secondi")
+            while True:
+                name, line = next(lines)
+                buffers[name].add(line)
+                yield line
+        except StopIteration as stop:
+            returncode = stop.value
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+        
+        output = ""
+        if buffers['stdout']:
+            output += f"📤 Output:\n{buffers['stdout'].text()}\n"
+        if buffers['stderr']:
+            output += f"⚠️ Stderr:\n{buffers['stderr'].text()}\n"
+        if returncode is None:
+            output += f"⏱️ Timeout dopo {timeout} secondi: processo terminato (output parziale)"
+            if self.shell is not None:
+                output += "\n🔄 Shell riavviata: directory corrente e variabili sono state azzerate"
+            return ToolResult(False, output)
+        if returncode != 0:
+            output += f"❌ Exit code: {returncode}"
+        else:
+            output += f"✅ Comando completato"
+        
+        return ToolResult(returncode == 0, output)
+    
+    def _run_process(self, command: str, timeout: float) -> Generator[Tuple[str, str], None, Optional[int]]:
+        """
+        Esegue il comando in un processo dedicato e yield (stream, riga).
+        Ritorna l'exit code, None in caso di timeout.
+        """
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=self.workspace,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            # Gruppo di processi dedicato: al timeout si termina anche i figli
+            start_new_session=os.name != 'nt'
+        )
+        lines = queue.Queue()
+        readers = [
+            threading.Thread(target=pump_lines, args=(name, pipe, lines), daemon=True)
+            for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr))
+        ]
+        for reader in readers:
+            reader.start()
+        
+        deadline = time.monotonic() + timeout
+        open_pipes = len(readers)
+        timed_out = False
+        while open_pipes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                kill_tree(process)
+                break
+            try:
+                name, line = lines.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                continue
+            if line is None:
+                open_pipes -= 1
+                continue
+            yield name, line.rstrip('\n')
+        
+        # Dopo il kill i pipe si chiudono: si recupera quanto già letto
+        for reader in readers:
+            reader.join(timeout=1)
+        while not lines.empty():
+            name, line = lines.get_nowait()
+            if line is not None:
+                yield name, line.rstrip('\n')
+        returncode = process.wait()
+        return None if timed_out else returncode
+    
+    def restart_shell(self) -> ToolResult:
+        """Riavvia la shell persistente (es. bloccata o in uno stato non valido)"""
+        if self.shell is None:
+            return ToolResult(False, "", "Shell persistente non attiva: ogni comando usa già una shell nuova")
+        try:
+            self.shell.restart()
+            return ToolResult(True, "🔄 Shell riavviata nella workspace")
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    def job_start(self, command: str) -> ToolResult:
+        """Avvia un comando in background"""
+        try:
+            job = self.jobs.start(command)
+            return ToolResult(True, f"🚀 Job {job.id} avviato in background: {command}\n📄 Log: {self.jobs.JOBS_DIR}/{job.id}.log")
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    def job_status(self, job_id: Optional[int] = None) -> ToolResult:
+        """Stato di un job, o di tutti se `job_id` è None"""
+        try:
+            if job_id is not None:
+                return ToolResult(True, self.jobs.describe(self.jobs.get(job_id)))
+            if not self.jobs.jobs:
+                return ToolResult(True, "📭 Nessun job avviato")
+            return ToolResult(True, "\n".join(self.jobs.describe(job) for job in self.jobs.jobs.values()))
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    def job_tail(self, job_id: int, lines: int = 50) -> ToolResult:
+        """Ultime righe dell'output di un job"""
+        try:
+            job = self.jobs.get(job_id)
+            return ToolResult(True, self._job_report(job, lines))
         except Exception as e:
-            return ToolResult(False, "", str(e))
\ No newline at end of file
+            return ToolResult(False, "", str(e))
+    
+    def job_wait(self, job_id: int, timeout: Optional[int] = None) -> ToolResult:
+        """Attende la fine di un job e ne mostra l'output finale"""
+        try:
+            job = self.jobs.wait(job_id, timeout or self.default_timeout)
+            report = self._job_report(job)
+            if job.returncode is None:
+                return ToolResult(True, f"{report}\n⏳ Ancora in esecuzione dopo {timeout or self.default_timeout}s di attesa")
+            return ToolResult(job.returncode == 0, report)
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    def job_kill(self, job_id: int) -> ToolResult:
+        """Termina un job"""
+        try:
+            job = self.jobs.kill(job_id)
+            return ToolResult(True, self._job_report(job))
+        except Exception as e:
+            return ToolResult(False, "", str(e))
+    
+    def _job_report(self, job, lines: int = 50) -> str:
+        tail, size = self.jobs.tail(job.id, lines)
+        report = self.jobs.describe(job)
+        if tail:
+            report += f"\n📤 Output (ultime {len(tail)} righe, log di {size} byte):\n" + "\n".join(tail)
+        return report
+    
+    def close(self):
+        """Termina la shell persistente e i job in background"""
+        if self.shell is not None:
+            self.shell.close()
+        self.jobs.close()
@@ -0,0 +1,158 @@
+"""Tracing del loop dell'agente: span con durate, token e dimensioni dei payload"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class Span:
+    """Una misura in corso: nome, attributi e istante di inizio"""
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def mark(self, key: str):
+        """Registra in `key` i millisecondi trascorsi dall'inizio dello span (es. ttft_ms)"""
+        self.attrs[key] = round((time.perf_counter() - self.start) * 1000, 2)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile nearest-rank di una lista non vuota"""
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Tracer:
+    """
+    Raccoglie gli span di chat, parsing, esecuzione dei comandi e conferme.
+
+    Ogni span chiuso diventa una riga JSON in `path` (se indicato) con nome,
+    task, iterazione, durata in ms e attributi; gli span del task corrente
+    restano in memoria per il riepilogo finale (`summary`). Con `path=None`
+    e `keep=False` il tracer è spento e `span()` costa solo un perf_counter.
+    """
+
+    def __init__(self, path: Optional[str] = None, keep: bool = False):
+        self.path = path
+        self.enabled = keep or path is not None
+        self.task = 0
+        self.iteration = 0
+        self._spans: List[dict] = []
+        self._task_start = time.perf_counter()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def begin_task(self):
+        """Nuovo task: azzera gli span del riepilogo"""
+        self.task += 1
+        self.iteration = 0
+        self._task_start = time.perf_counter()
+        with self._lock:
+            self._spans = []
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Span]:
+        span = Span(name, attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            if self.enabled:
+                self._record(span)
+
+    def _record(self, span: Span):
+        record = {
+            "ts": round(time.time(), 3),
+            "span": span.name,
+            "task": self.task,
+            "iteration": self.iteration,
+            "ms": round((time.perf_counter() - span.start) * 1000, 2),
+        }
+        record.update(span.attrs)
+        with self._lock:
+            self._spans.append(record)
+            if self.path is not None:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def close(self):
+        """Chiude il file di trace (uno span successivo lo riapre in append)"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # --- Riepilogo ---
+
+    @staticmethod
+    def _groups(spans: List[dict]) -> Dict[str, List[float]]:
+        """Durate per riga del riepilogo: chat, ttft, parse, confirm, un gruppo per tool"""
+        groups: Dict[str, List[float]] = {}
+        for record in spans:
+            if record["span"] == "execute":
+                key = f"execute {record.get('command', '?')}"
+            elif record["span"] == "iteration":
+                continue
+            else:
+                key = record["span"]
+            groups.setdefault(key, []).append(record["ms"])
+            if record["span"] == "chat" and "ttft_ms" in record:
+                groups.setdefault("chat ttft", []).append(record["ttft_ms"])
+        return groups
+
+    def summary(self) -> str:
+        """Tabella p50/p95 per span, token totali e byte di output dei tool rimandati al modello"""
+        with self._lock:
+            spans = list(self._spans)
+        if not spans:
+            return "📈 Trace: nessuno span registrato"
+
+        elapsed = time.perf_counter() - self._task_start
+        lines = [
+            f"📈 Trace del task {self.task}: {self.iteration} iterazioni in {elapsed:.1f}s",
+            f"   {'span':<24}{'n':>5}{'p50 ms':>11}{'p95 ms':>11}{'totale ms':>12}",
+        ]
+        for key, values in sorted(self._groups(spans).items()):
+            lines.append(
+                f"   {key:<24}{len(values):>5}{percentile(values, 50):>11.1f}"
+                f"{percentile(values, 95):>11.1f}{sum(values):>12.1f}"
+            )
+
+        tokens = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+        output_bytes = 0
+        for record in spans:
+            if record["span"] == "chat":
+                for key in tokens:
+                    tokens[key] += record.get(key) or 0
+            elif record["span"] == "execute":
+                output_bytes += record.get("output_bytes", 0)
+        lines.append(
+            f"   Token: {tokens['input_tokens']} input ({tokens['cached_tokens']} in cache), "
+            f"{tokens['output_tokens']} output"
+        )
+        lines.append(f"   Output dei tool rimandato al modello: {output_bytes} byte")
+        parses = [record for record in spans if record["span"] == "parse"]
+        failures = sum(1 for record in parses if not record.get("commands"))
+        lines.append(f"   Risposte senza comandi validi: {failures}/{len(parses)}")
+        sampled = [record for record in spans if record["span"] == "chat" and "candidates" in record]
+        if sampled:
+            saved = sum(record["saved_ms"] for record in sampled) / 1000
+            lines.append(
+                f"   Campionamento speculativo: {len(sampled)} round, "
+                f"{sum(record['candidates'] for record in sampled)} candidati, "
+                f"{sum(record['malformed'] for record in sampled)} non validi, "
+                f"~{saved:.1f}s risparmiati rispetto ai tentativi in sequenza"
+            )
+        return "\n".join(lines)